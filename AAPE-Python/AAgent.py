@@ -1,32 +1,84 @@
+import os
 import sys
+import time
 import aiohttp
 import asyncio
 import json
+from collections import Counter
+# Modules shared with the BehaviourTrees agent
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Shared"))
+import Kinematics
+import Actions
 import Sensors
 import Goals
 
 
-class InternalState:
+class InternalState(Kinematics.Pose):
     """
     Internal state
-        Stores the internal state of the agent.
+        Stores the internal state of the agent: the last sensor frame, read on demand (see Kinematics.Pose).
             currentActions: list<string> Actions the agent is currently executing
                            [W | D | A | S | Z]
             speed: <float> Speed of the agent
-            position: <dict { "x": <float>, "y": <float>, "z": <float> } Position using world coordinates
-            rotation: <dict { "x": <float>, "y": <float>, "z": <float> } Rotation y - Yaw, x - Pitch, z - Roll
+            position: <Vec3> Position using world coordinates
+            rotation: <Vec3> Rotation y - Yaw, x - Pitch, z - Roll
+            frame_id: <int> Number of sensor frames applied, it changes every time the state is updated
+            frame_time: <float> Time when the last frame was applied
+            frame_period: <float> Seconds between frames (moving average)
+            dirty: <int> Fields changed by the last frame (ACTIONS | SPEED | POSITION | ROTATION bits)
+            velocity: <Vec3> Velocity in units/s, estimated from the last two frames
+            angular_velocity: <Vec3> Angular velocity in degrees/s, estimated from the last two frames
     """
-    def __init__(self):
-        self.currentActions = []
-        self.speed = 0.0
-        self.position = {"x": 0, "y": 0, "z": 0}
-        self.rotation = {"x": 0, "y": 0, "z": 0}
+    # Bits of 'dirty' (POSITION and ROTATION: see Kinematics.Pose)
+    ACTIONS = 1
+    SPEED = 2
+
+    __slots__ = ("executing", "ledger")
+
+    def __init__(self, clock=time.monotonic):
+        super().__init__({"currentActions": [], "speed": 0.0, "position": {"x": 0.0, "y": 0.0, "z": 0.0},
+                          "rotation": {"x": 0.0, "y": 0.0, "z": 0.0}}, clock)
+        # Number of times each action is in currentActions, to check if an action is executing in O(1)
+        self.executing = Counter()
+        # Ledger of the active goal (see Actions.py), notified of the actions that start executing
+        self.ledger = None
+
+    def set_ledger(self, ledger: Actions.ActionLedger):
+        """
+        :param ledger: Ledger of the goal that becomes active, or None. The other goals do not request actions,
+                       so their ledgers are not notified
+        """
+        self.ledger = ledger
 
     def set_internal_state(self, i_state_dict):
-        self.currentActions = i_state_dict["currentActions"]
-        self.speed = i_state_dict["speed"]
-        self.position = i_state_dict["position"]
-        self.rotation = i_state_dict["rotation"]
+        current_actions = i_state_dict["currentActions"]
+        # The ledger is notified right away, not on demand
+        if current_actions != self.frame["currentActions"]:
+            # Only the actions that were not executing before are new: the requests they fulfil are removed
+            executing = Counter(current_actions)
+            started = executing - self.executing
+            self.executing = executing
+            if started and self.ledger is not None:
+                self.ledger.started(started)
+        super().set_internal_state(i_state_dict)
+
+    def derive_dirty(self):
+        frame, prev = self.frame, self.prev_frame
+        dirty = super().derive_dirty()
+        if frame["currentActions"] != prev["currentActions"]:
+            dirty |= self.ACTIONS
+        if frame["speed"] != prev["speed"]:
+            dirty |= self.SPEED
+        self._dirty = dirty
+        return dirty
+
+    @property
+    def currentActions(self):
+        return self.frame["currentActions"]
+
+    @property
+    def speed(self):
+        return self.frame["speed"]
 
 
 class AAgent:
@@ -41,6 +93,10 @@ class AAgent:
             self.config = json.loads(config_data)
         # Extract the parameters of the agent from the config dictionary
         self.AgentParameters = self.config['AgentParameters']
+        # Optional settings of the Python side of the agent. They are not sent to Unity
+        self.Runtime = self.config.get('Runtime', {})
+        # Ticks per second of the main loop while the simulation is running (0 -> as fast as possible)
+        self.tick_rate = self.Runtime.get('tick_rate', 0)
 
         # URL to connect with Unity
         self.url = f"ws://{self.config['Server']['host']}:{self.config['Server']['port']}/"
@@ -61,6 +117,10 @@ class AAgent:
         self.exit_event = asyncio.Event()
         # Flag that confirms the connection with Unity is fully operative and that Unity is waiting for messages
         self.connection_ready = False
+        # Asyncio events set when the state of the agent changes. The tasks wait on them instead of polling
+        self.connection_ready_event = asyncio.Event()
+        self.running_event = asyncio.Event()
+        self.control_event = asyncio.Event()
 
         # Reference to the possible goals the agent can execute
         self.goals = {
@@ -71,7 +131,23 @@ class AAgent:
             "Avoid": Goals.Avoid(self)
         }
         # Active goal
-        self.currentGoal = "DoNothing"
+        self.currentGoal = None
+        self.set_goal("DoNothing")
+
+    def set_goal(self, name: str):
+        """
+        Makes 'name' the active goal. Only its ledger is notified of the actions that start executing: the
+        requests still pending in the ledger of the previous goal are forgotten, they will not be matched.
+        :param name: Name of the goal (key of self.goals)
+        """
+        if name == self.currentGoal:
+            return
+        previous = self.goals.get(self.currentGoal)
+        if previous is not None:
+            previous.ledger.clear()
+        self.currentGoal = name
+        goal = self.goals.get(name)
+        self.i_state.set_ledger(goal.ledger if goal is not None else None)
 
     async def open_websocket(self):
         """
@@ -148,11 +224,14 @@ class AAgent:
             elif msg_dict["Type"] == "sim_control":
                 if msg_dict["Content"] == "connection_ready":
                     self.connection_ready = True
+                    self.connection_ready_event.set()
                 elif msg_dict["Content"] == "on_hold":
                     self.simulation_state = self.ON_HOLD
+                    self.running_event.clear()
                     print("ON HOLD")
                 elif msg_dict["Content"] == "start":
                     self.simulation_state = self.RUNNING
+                    self.running_event.set()
                     print("RUNNING")
                 elif msg_dict["Content"] == "error":
                     print("Error creating the agent in Unity.")
@@ -164,8 +243,10 @@ class AAgent:
                 # command:data
                 try:
                     command, data = msg_dict["Content"].split(":")
+                    # Wake up the main loop in case it is waiting for something to execute
+                    self.control_event.set()
                     if command == "goal":
-                        self.currentGoal = data
+                        self.set_goal(data)
                     else:
                         print("Agent_control message with an unknown command: " + msg_dict["content"])
                 except Exception as e:
@@ -178,13 +259,47 @@ class AAgent:
             print(f"Exception: {e}")
             raise e
 
+    async def wait_for_event(self, event: asyncio.Event):
+        """
+        Waits, without consuming CPU, till 'event' is set or the agent has to exit.
+        :param event: Event to wait for.
+        :return: True if 'event' is set, False if we are exiting.
+        """
+        if not event.is_set() and not self.exit_event.is_set():
+            waiters = [asyncio.create_task(event.wait()), asyncio.create_task(self.exit_event.wait())]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in waiters:
+                    task.cancel()
+        return event.is_set()
+
+    async def wait_next_tick(self, next_tick: float) -> float:
+        """
+        Sleeps till the time of the next tick when a tick rate is configured.
+        :param next_tick: Loop time at which the last tick was scheduled.
+        :return: Loop time of the following tick.
+        """
+        if self.tick_rate <= 0:
+            return next_tick
+        loop = asyncio.get_running_loop()
+        next_tick += 1.0 / self.tick_rate
+        delay = next_tick - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            return next_tick
+        # We are late, so we do not try to catch up with a burst of ticks
+        return loop.time()
+
     async def main_loop(self):
+        next_tick = asyncio.get_running_loop().time()
         # Keep going while there is not an event to exit
         while not self.exit_event.is_set():
             # Control if we are on hold (simulation paused from Unity)
             if self.simulation_state == self.ON_HOLD:
-                # Just wait, but allow the other tasks keep running
-                await asyncio.sleep(0)
+                # Wait till Unity starts the simulation, but allow the other tasks keep running
+                await self.wait_for_event(self.running_event)
+                next_tick = asyncio.get_running_loop().time()
             else:
                 # Here is where we perform the agent actions calling the update() method
                 # of the corresponding active goal
@@ -195,7 +310,8 @@ class AAgent:
                     # instead of finishing we change the goal to DoNothing
                     print("Execution of goal " + self.currentGoal + " failed.")
                     print(f"Exception: {e}")
-                    self.currentGoal = "DoNothing"
+                    self.set_goal("DoNothing")
+                next_tick = await self.wait_next_tick(next_tick)
         print("Finishing main_loop")
 
     async def run(self):
@@ -214,11 +330,10 @@ class AAgent:
                 asyncio.create_task(self.receive_messages())
                 # Wait for the flag "connection_ready" to be True. If it is true, it means we have received an ack
                 # from Unity saying that the connection is fully established and Unity is ready to receive messages
-                while not self.connection_ready:
-                    await asyncio.sleep(0)
-                print("Connection with Unity fully established")
-                # We are ready now  to start the main loop of the agent
-                await self.main_loop()
+                if await self.wait_for_event(self.connection_ready_event):
+                    print("Connection with Unity fully established")
+                    # We are ready now  to start the main loop of the agent
+                    await self.main_loop()
         finally:
             # Notify other possible running tasks that we have to exit
             self.exit_event.set()
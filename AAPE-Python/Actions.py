@@ -0,0 +1,76 @@
+import time
+import collections
+
+
+class ActionLedger:
+    """
+    Action ledger
+        Multiset of the actions requested by a goal that have not started executing yet, with the time of each
+        request. InternalState notifies the actions that start executing when a sensor frame changes
+        currentActions (see InternalState.set_internal_state()), and the oldest request of each of them is
+        removed. So checking the requests of an action is a dictionary lookup, and the time from each request
+        to its execution (command-to-execution latency) is measured.
+    """
+    def __init__(self, clock=time.monotonic, max_samples=1024):
+        """
+        :param clock: Function that returns the current time in seconds.
+        :param max_samples: Number of the latest latencies kept for latency_stats().
+        """
+        self.clock = clock
+        # Pending requests: {action: deque with the time of each request, oldest first}
+        self.pending = {}
+        # Command-to-execution latencies: latest ones, and totals of all of them
+        self.latencies = collections.deque(maxlen=max_samples)
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def request(self, action: str):
+        """
+        Registers a request of 'action', sent to Unity now
+        :param action: Action requested
+        """
+        times = self.pending.get(action)
+        if times is None:
+            times = self.pending[action] = collections.deque()
+        times.append(self.clock())
+
+    def requested(self, action: str) -> int:
+        """
+        :return: number of pending requests of 'action'
+        """
+        times = self.pending.get(action)
+        return len(times) if times else 0
+
+    def started(self, actions: dict):
+        """
+        Removes the oldest pending requests of the actions that have started executing
+        :param actions: {action: number of times it has started}, e.g. a Counter
+        """
+        now = self.clock()
+        for action, count in actions.items():
+            times = self.pending.get(action)
+            while times and count > 0:
+                latency = now - times.popleft()
+                self.latencies.append(latency)
+                self.latency_count += 1
+                self.latency_sum += latency
+                if latency > self.latency_max:
+                    self.latency_max = latency
+                count -= 1
+
+    def clear(self):
+        """
+        Forgets the pending requests
+        """
+        self.pending.clear()
+
+    def latency_stats(self) -> dict:
+        """
+        :return: count, mean, median and maximum of the command-to-execution latencies, in seconds
+        """
+        latest = sorted(self.latencies)
+        return {"count": self.latency_count,
+                "mean": self.latency_sum / self.latency_count if self.latency_count else None,
+                "p50": latest[len(latest) // 2] if latest else None,
+                "max": self.latency_max if self.latency_count else None}
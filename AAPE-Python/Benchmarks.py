@@ -0,0 +1,133 @@
+import sys
+import time
+import random
+from collections import Counter
+import AAgent
+import Actions
+
+
+class LegacyInternalState:
+    """
+    InternalState before the ActionLedger: currentActions is only stored
+    """
+    def __init__(self):
+        self.currentActions = []
+        self.speed = 0.0
+        self.position = {"x": 0, "y": 0, "z": 0}
+        self.rotation = {"x": 0, "y": 0, "z": 0}
+
+    def set_internal_state(self, i_state_dict):
+        self.currentActions = i_state_dict["currentActions"]
+        self.speed = i_state_dict["speed"]
+        self.position = i_state_dict["position"]
+        self.rotation = i_state_dict["rotation"]
+
+
+class LegacyGoal:
+    """
+    Bookkeeping of the requested actions of Goals.Goal before the ActionLedger: the requests are rebuilt from
+    three Counters on every update(), and requested() counts them in a list
+    """
+    def __init__(self, i_state):
+        self.i_state = i_state
+        self.prev_currentActions = []
+        self.requested_actions = []
+
+    def requested(self, action):
+        return self.requested_actions.count(action)
+
+    def executing(self, action):
+        return action in self.i_state.currentActions
+
+    def update_req_actions(self):
+        counter_prev = Counter(self.prev_currentActions)
+        counter = Counter(self.i_state.currentActions)
+        new_actions_executing = list((counter - counter_prev).elements())
+        counter_new_actions = Counter(new_actions_executing)
+        counter_req_actions = Counter(self.requested_actions)
+        for element, count in counter_new_actions.items():
+            counter_req_actions[element] -= min(count, counter_req_actions[element])
+        modified_req_actions = []
+        for element, count in counter_req_actions.items():
+            modified_req_actions.extend([element] * count)
+        self.requested_actions = modified_req_actions
+
+    def update(self):
+        self.update_req_actions()
+        self.prev_currentActions = self.i_state.currentActions
+
+
+def make_frames(count, seed=0):
+    """
+    :return: list with the internal state of 'count' sensor frames. The agent walks (W) and turns (A | D) from
+             time to time, so currentActions changes every few frames
+    """
+    rng = random.Random(seed)
+    frames = []
+    actions = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            actions = rng.choice([[], ["W"], ["W", "A"], ["W", "D"], ["A"], ["D"]])
+        frames.append({"currentActions": list(actions), "speed": 1.0, "position": {"x": 0, "y": 0, "z": 0},
+                       "rotation": {"x": 0, "y": 0, "z": 0}})
+    return frames
+
+
+def run_legacy(frames, stale):
+    i_state = LegacyInternalState()
+    goal = LegacyGoal(i_state)
+    goal.requested_actions.extend(["Z"] * stale)
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        i_state.set_internal_state(frame)
+        goal.update()
+        if not goal.executing("W") and not goal.requested("W"):
+            goal.requested_actions.append("W")
+        if i % 10 == 0:
+            goal.requested_actions.append("D")
+    return time.perf_counter() - start, len(goal.requested_actions)
+
+
+def run_ledger(frames, stale):
+    i_state = AAgent.InternalState()
+    ledger = Actions.ActionLedger()
+    i_state.set_ledger(ledger)
+    for _ in range(stale):
+        ledger.request("Z")
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        i_state.set_internal_state(frame)
+        if "W" not in i_state.executing and not ledger.requested("W"):
+            ledger.request("W")
+        if i % 10 == 0:
+            ledger.request("D")
+    return time.perf_counter() - start, sum(len(times) for times in ledger.pending.values())
+
+
+def bench_action_ledger(frames=20000):
+    """
+    Cost per sensor frame of the bookkeeping of the requested actions of a goal: applying the frame, updating
+    the requests and checking if "W" is executing or requested, with the Counters rebuilt every update()
+    (legacy) and with the ActionLedger. With 'stale' requests that never execute (e.g. a step of a turn that
+    ends between two frames) the legacy lists grow, and so does the cost of every update
+    """
+    frames = make_frames(frames)
+    print(f"{'stale requests':>15}{'legacy (us/frame)':>19}{'ledger (us/frame)':>19}{'speedup':>9}"
+          f"{'pending (legacy)':>18}{'pending (ledger)':>18}")
+    for stale in (0, 100, 1000):
+        legacy_time, legacy_pending = min(run_legacy(frames, stale) for _ in range(3))
+        ledger_time, ledger_pending = min(run_ledger(frames, stale) for _ in range(3))
+        print(f"{stale:>15}{legacy_time / len(frames) * 1e6:>19.2f}{ledger_time / len(frames) * 1e6:>19.2f}"
+              f"{legacy_time / ledger_time:>9.1f}{legacy_pending:>18}{ledger_pending:>18}")
+
+
+BENCHMARKS = {
+    "action_ledger": bench_action_ledger,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: python Benchmarks.py <" + " | ".join(BENCHMARKS) + ">")
+    else:
+        BENCHMARKS[sys.argv[1]]()
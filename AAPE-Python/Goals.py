@@ -1,7 +1,7 @@
 import random
 import asyncio
 import Sensors
-from collections import Counter
+import Actions
 
 class Goal:
     """
@@ -14,56 +14,35 @@ class Goal:
         self.rc_sensor = a_agent.rc_sensor
         self.i_state = a_agent.i_state
 
-        self.prev_currentActions = []
-        self.requested_actions = []
+        # Actions requested by the goal that have not started executing yet, kept up to date by i_state while
+        # the goal is active (see AAgent.set_goal())
+        self.ledger = Actions.ActionLedger()
 
     def requested(self, action):
         """
         Checks if the action is already requested
         :return: number of pending request for that action
         """
-        return self.requested_actions.count(action)
+        return self.ledger.requested(action)
 
     def executing(self, action):
         """
         Checks if the action is already executing
         :return: bool
         """
-        if action in self.i_state.currentActions:
-            return True
-        else:
-            return False
+        return action in self.i_state.executing
 
-    def update_req_actions(self):
+    async def request_action(self, action):
         """
-        Takes the list i_state.currentActions and finds which actions have been added
-        with respect prev_currentActions. Then updates the requested_actions list
-        accordingly
-        :return:
+        Sends the action to Unity and registers the request
+        :param action: Action to execute [W | D | A | S | Z]
         """
-        counter_prev = Counter(self.prev_currentActions)
-        counter = Counter(self.i_state.currentActions)
-
-        # New actions executing that were not executing before
-        new_actions_executing = list((counter - counter_prev).elements())
-        counter_new_actions = Counter(new_actions_executing)
-        counter_req_actions = Counter(self.requested_actions)
-
-        # Remove the new actions from the requested_actions list
-        # Remove elements in counter_req_actions that are also in counter_new_actions
-        for element, count in counter_new_actions.items():
-            counter_req_actions[element] -= min(count, counter_req_actions[element])
-        # Reconstruct the modified list counter_req_actions
-        modified_req_actions = []
-        for element, count in counter_req_actions.items():
-            modified_req_actions.extend([element] * count)
-
-        self.requested_actions = modified_req_actions
+        self.ledger.request(action)
+        await self.a_agent.send_message("action", action)
 
     async def update(self):
-        # update requested actions
-        self.update_req_actions()
-        self.prev_currentActions = self.i_state.currentActions
+        # The requested actions are updated by i_state when a sensor frame arrives (see Actions.py)
+        pass
 
 
 class DoNothing(Goal):
@@ -95,16 +74,14 @@ class ForwardStop(Goal):
         await super().update()
         if self.state == self.STOPPED:
             # If we are not moving, start moving 
-            self.requested_actions.append("W")
-            await self.a_agent.send_message("action", "W")
+            await self.request_action("W")
             self.state = self.MOVING
             print("MOVING")
         elif self.state == self.MOVING:
             # If we are moving, check if we detect a wall
             sensor_hit = self.rc_sensor.sensor_rays[Sensors.RayCastSensor.HIT]
             if any(ray_hit == 1 for ray_hit in self.rc_sensor.sensor_rays[Sensors.RayCastSensor.HIT]):
-                self.requested_actions.append("S")
-                await self.a_agent.send_message("action", "S")
+                await self.request_action("S")
                 self.state = self.END
                 print("END")
             else:
@@ -137,8 +114,7 @@ class Turn(Goal):
         
         print(f"Turning {turn_degrees} degrees to the {turn_direction}, in {abs(turns_needed)} turnsteps.")
         async for _ in self.async_turns(turns_needed):
-            self.requested_actions.append(turn_direction)
-            await self.a_agent.send_message("action", turn_direction)
+            await self.request_action(turn_direction)
             await asyncio.sleep(0.3)
         await asyncio.sleep(2)
         
@@ -183,13 +159,11 @@ class RandomRoam(Goal):
 
         #if its choice is moving, start moving and check if there is any obstacle
         elif self.state == self.MOVING:
-            self.requested_actions.append("W")
-            await self.a_agent.send_message("action", "W")
+            await self.request_action("W")
             print("MOVING")
 
             if any(ray_hit == 1 for ray_hit in self.rc_sensor.sensor_rays[Sensors.RayCastSensor.HIT]):
-                self.requested_actions.append("S")
-                await self.a_agent.send_message("action", "S")
+                await self.request_action("S")
                 self.state = self.TURNING
                 await asyncio.sleep(2)
             else:
@@ -201,8 +175,7 @@ class RandomRoam(Goal):
             await asyncio.sleep(0.1)
 
         elif self.state == self.STOP:
-            self.requested_actions.append("S")
-            await self.a_agent.send_message("action", "S")
+            await self.request_action("S")
             await asyncio.sleep(2)
 
             next_state = random.choices([self.TURNING, self.STOP, self.MOVING], weights=(55, 10, 35), k=1)[0]
@@ -212,8 +185,7 @@ class RandomRoam(Goal):
            
         elif self.state == self.TURNING:
             if self.turn_direction is None or self.num_turns is None:
-                self.requested_actions.append("S")  
-                await self.a_agent.send_message("action", "S")
+                await self.request_action("S")
                 await asyncio.sleep(0.1)
                 self.turn_direction = random.choice(["A", "D"])  
                 self.turn_degrees = random.randint(0, 360) 
@@ -222,8 +194,7 @@ class RandomRoam(Goal):
                 print("Turn degrees:", self.turn_degrees)
 
             while self.turned < self.turn_degrees:
-                self.requested_actions.append(self.turn_direction)
-                await self.a_agent.send_message("action", self.turn_direction)
+                await self.request_action(self.turn_direction)
                 self.turned += 5
                 await asyncio.sleep(0.3)
             self.turn_direction = None  
@@ -262,12 +233,10 @@ class Avoid(Goal):
 
         #if it is moving, check if there is any obstacle
         elif self.state == self.MOVING:
-            self.requested_actions.append("W")
-            await self.a_agent.send_message("action", "W")
+            await self.request_action("W")
 
             if any(ray_hit == 1 for ray_hit in self.rc_sensor.sensor_rays[Sensors.RayCastSensor.HIT]):
-                self.requested_actions.append("S")
-                await self.a_agent.send_message("action", "S")
+                await self.request_action("S")
                 print("STOPPING")
                 
                 #decide the direction of the turn
@@ -286,8 +255,7 @@ class Avoid(Goal):
         
         elif self.state == self.TURNING:
             # Turn a little bit to avoid the obstacle
-            self.requested_actions.append(self.turn_direction)
-            await self.a_agent.send_message("action", self.turn_direction)
+            await self.request_action(self.turn_direction)
             await asyncio.sleep(0.1)
             # Turn a bit to pass the obstacle
             if self.avoid_distance < 3:  
@@ -1,42 +1,116 @@
+import os
 import sys
+import time
+import random
 import aiohttp
 import asyncio
 import json
+# Modules shared with the AAPE agent
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Shared"))
+import Kinematics
+import Codec
+import Control
+import AgentLog
+import Metrics
+import Outbound
 import Sensors
+import Tracing
 import Goals_BT
 import BTRoam
 import BTCritter
 
 
-class InternalState:
+class InternalState(Kinematics.Pose):
     """
     Internal state
-        Stores the internal state of the agent.
+        Stores the internal state of the agent: the last sensor frame, read on demand (see Kinematics.Pose).
             isRotatingRight: <bool>
             isRotatingLeft: <bool>
             movingForwards: <bool>
             movingBackwards: <bool>
             speed: <float> Speed of the agent
-            position: <dict { "x": <float>, "y": <float>, "z": <float> } Position using world coordinates
-            rotation: <dict { "x": <float>, "y": <float>, "z": <float> } Rotation y - Yaw, x - Pitch, z - Roll
+            position: <Vec3> Position using world coordinates
+            rotation: <Vec3> Rotation y - Yaw, x - Pitch, z - Roll
+            frame_id: <int> Number of sensor frames applied, it changes every time the state is updated
+            frame_time: <float> Agent clock when the last frame was received
+            frame_period: <float> Seconds between frames (moving average)
+            dirty: <int> Fields changed by the last frame (MOVEMENT | SPEED | POSITION | ROTATION bits)
+            velocity: <Vec3> Velocity in units/s, estimated from the last two frames
+            angular_velocity: <Vec3> Angular velocity in degrees/s, estimated from the last two frames
+    """
+    # Bits of 'dirty' (POSITION and ROTATION: see Kinematics.Pose)
+    MOVEMENT = 1
+    SPEED = 2
+
+    __slots__ = ()
+
+    def __init__(self, clock=time.time):
+        super().__init__({"isRotatingRight": False, "isRotatingLeft": False, "movingForwards": False,
+                          "movingBackwards": False, "speed": 0.0, "position": {"x": 0.0, "y": 0.0, "z": 0.0},
+                          "rotation": {"x": 0.0, "y": 0.0, "z": 0.0}}, clock)
+
+    def derive_dirty(self):
+        frame, prev = self.frame, self.prev_frame
+        dirty = super().derive_dirty()
+        if (frame["isRotatingRight"] != prev["isRotatingRight"] or frame["isRotatingLeft"] != prev["isRotatingLeft"]
+                or frame["movingForwards"] != prev["movingForwards"]
+                or frame["movingBackwards"] != prev["movingBackwards"]):
+            dirty |= self.MOVEMENT
+        if frame["speed"] != prev["speed"]:
+            dirty |= self.SPEED
+        self._dirty = dirty
+        return dirty
+
+    @property
+    def isRotatingRight(self):
+        return self.frame["isRotatingRight"]
+
+    @property
+    def isRotatingLeft(self):
+        return self.frame["isRotatingLeft"]
+
+    @property
+    def movingForwards(self):
+        return self.frame["movingForwards"]
+
+    @property
+    def movingBackwards(self):
+        return self.frame["movingBackwards"]
+
+    @property
+    def speed(self):
+        return self.frame["speed"]
+
+
+def resolve_future(future: asyncio.Future, result):
+    """
+    Sets the result of 'future' if it is still pending.
+    """
+    if not future.done():
+        future.set_result(result)
+
+
+class ExitEvent(asyncio.Event):
+    """
+    Exit event of the agent. Setting it also sets the events linked to it, so the tasks waiting on one of those
+    (e.g. the GoalRunners) wake up and see that the agent is exiting, without waiting on two events.
     """
     def __init__(self):
-        self.isRotatingRight = False
-        self.isRotatingLeft = False
-        self.movingForwards = False
-        self.movingBackwards = False
-        self.speed = 0.0
-        self.position = {"x": 0, "y": 0, "z": 0}
-        self.rotation = {"x": 0, "y": 0, "z": 0}
-
-    def set_internal_state(self, i_state_dict):
-        self.isRotatingRight = i_state_dict["isRotatingRight"]
-        self.isRotatingLeft = i_state_dict["isRotatingLeft"]
-        self.movingForwards = i_state_dict["movingForwards"]
-        self.movingBackwards = i_state_dict["movingBackwards"]
-        self.speed = i_state_dict["speed"]
-        self.position = i_state_dict["position"]
-        self.rotation = i_state_dict["rotation"]
+        super().__init__()
+        self.linked = []
+
+    def link(self, event: asyncio.Event):
+        """
+        :param event: Event set when the exit event is set (at once if it is already set)
+        """
+        self.linked.append(event)
+        if self.is_set():
+            event.set()
+
+    def set(self):
+        super().set()
+        for event in self.linked:
+            event.set()
 
 
 class AAgent:
@@ -44,13 +118,37 @@ class AAgent:
     ON_HOLD = 0
     RUNNING = 1
 
-    def __init__(self, config_file_path: str):
+    def __init__(self, config_file_path: str, session: aiohttp.ClientSession = None, clock=None,
+                 runtime: dict = None):
         # Read the agent configuration file and put the info in the 'config' dictionary.
         with open(config_file_path, 'r') as file:
             config_data = file.read()
             self.config = json.loads(config_data)
         # Extract the parameters of the agent from the config dictionary
         self.AgentParameters = self.config['AgentParameters']
+        # Optional settings of the Python side of the agent. They are not sent to Unity.
+        # 'runtime' overrides the ones of the configuration file (e.g. to run the same agent with other settings)
+        self.Runtime = dict(self.config.get('Runtime', {}), **(runtime or {}))
+        # Ticks per second of the main loop while the simulation is running (0 -> as fast as possible)
+        self.tick_rate = self.Runtime.get('tick_rate', 0)
+        # Codec of the messages exchanged with Unity: json | ujson | orjson | msgpack (by default the fastest JSON one)
+        self.codec = Codec.get_codec(self.Runtime.get('codec'))
+        # Mailbox mode: the sensor frames are not decoded as they arrive, only the newest one is kept and applied
+        self.sensor_mailbox = self.Runtime.get('sensor_mailbox', False)
+        # Executor of the behaviour trees: "py_trees" | "flat" (see FlatTree.py)
+        self.bt_executor = self.Runtime.get('bt_executor', "py_trees")
+        # Tick mode of the behaviour trees: "free" (tick continuously) | "reactive" (tick only when something
+        # changes: a new sensor frame, a control message, a goal that finishes or a timer that expires)
+        self.tick_mode = self.Runtime.get('tick_mode', "free")
+        # In reactive mode, maximum seconds without ticking even if nothing has changed
+        self.max_tick_latency = self.Runtime.get('max_tick_latency', 0.5)
+
+        # Random generator of the goals. With a 'seed' in the Runtime settings the choices of the agent are
+        # reproducible (e.g. the random distances and turns of the roaming)
+        self.random = random.Random(self.Runtime.get('seed'))
+        # Clock of the agent: function that returns the current time in seconds. The behaviours use it instead of
+        # time.time(), so they can run on simulated time (see Headless.py)
+        self.clock = clock if clock is not None else time.time
 
         # URL to connect with Unity
         self.url = f"ws://{self.config['Server']['host']}:{self.config['Server']['port']}/"
@@ -59,18 +157,152 @@ class AAgent:
         self.rc_sensor = Sensors.RayCastSensor(self.AgentParameters['ray_perception_sensor_param'])
 
         # Agent internal state
-        self.i_state = InternalState()
+        self.i_state = InternalState(self.clock)
 
         # Misc. variables
         # variables used for the websocket connection
-        self.session = None
+        # The session can be shared with other agents running in the same process (see AgentHost.py)
+        self.session = session
+        self.shared_session = session is not None
         self.ws = None
         # State of the simulation: ON_HOLD | RUNNING
         self.simulation_state = self.ON_HOLD
         # Asyncio exit event used to notify the tasks that they have to finish
-        self.exit_event = asyncio.Event()
+        self.exit_event = ExitEvent()
+        # Runners of the goals of the behaviours (see Goals_BT.GoalRunner), closed when the agent finishes
+        self.goal_runners = []
         # Flag that confirms the connection with Unity is fully operative and that Unity is waiting for messages
         self.connection_ready = False
+        # Asyncio events set when the state of the agent changes. The tasks wait on them instead of polling
+        self.connection_ready_event = asyncio.Event()
+        self.running_event = asyncio.Event()
+        self.control_event = asyncio.Event()
+        # Set when something has changed and the behaviour tree has to be ticked (reactive tick mode)
+        self.tick_event = asyncio.Event()
+        self.exit_event.link(self.tick_event)
+        # Counters used to report the activity of the agent (see Supervisor.py)
+        self.ticks = 0
+        self.messages_received = 0
+        self.messages_sent = 0
+        # Mailbox of sensor frames: newest frame not applied yet (raw data, decoded dict or None, time received)
+        self.pending_sensor = None
+        self.pending_sensor_scheduled = False
+        self.pending_sensor_coalesced = False
+        # Frames received, applied, dropped without decoding because a newer one arrived, and number of times
+        # that several frames were coalesced into the newest one
+        self.sensor_frames_received = 0
+        self.sensor_frames_applied = 0
+        self.sensor_frames_dropped = 0
+        self.sensor_frames_coalesced = 0
+        # Goals waiting for a sensor frame (see wait_until()): list of (predicate or None, future)
+        self.frame_waiters = []
+        # Ticks done in reactive mode because max_tick_latency expired, without any tick request
+        self.fallback_ticks = 0
+        # Counters of the behaviour of the agent: flowers eaten and seconds (of the agent clock) following
+        # astronauts (see EpisodeRunner.py)
+        self.flowers_eaten = 0
+        self.follow_time = 0.0
+        # Actions sent to Unity
+        self.actions_sent = 0
+        # Batching of the actions (see Outbound.py): with "action_batching" the actions of a tick are queued,
+        # coalesced and sent in a single "actions" frame, and the ones repeated within "action_refresh" seconds
+        # are not sent again. The server has to understand "actions" messages (see Simulator.py)
+        self.action_batcher = None
+        if self.Runtime.get('action_batching', False):
+            self.action_batcher = Outbound.ActionBatcher(self.codec, self.clock,
+                                                         self.Runtime.get('action_refresh', 1.0))
+        self.actions_flush_scheduled = False
+
+        # Instrumentation of the hot paths (see Metrics.py). It can be switched off with "metrics": false,
+        # and served in the Prometheus text format on http://127.0.0.1:<metrics_port>/metrics
+        self.metrics = Metrics.Registry(self.Runtime.get('metrics', True), agent=self.AgentParameters['name'])
+        self.metrics_port = self.Runtime.get('metrics_port')
+        self.decode_time = self.metrics.histogram("aagent_decode_seconds", "Time decoding a received message")
+        self.sensor_apply_time = self.metrics.histogram("aagent_sensor_apply_seconds",
+                                                        "Time applying the perception of a sensor frame")
+        self.tick_time = self.metrics.histogram("aagent_bt_tick_seconds", "Time ticking the behaviour tree")
+        self.send_time = self.metrics.histogram("aagent_send_seconds",
+                                                "Time encoding and sending (or queueing) a message")
+        self.write_time = self.metrics.histogram("aagent_ws_write_seconds", "Time writing a frame in the websocket")
+        self.metrics.counter("aagent_frames_in_total", "Messages received", lambda: self.messages_received)
+        self.metrics.counter("aagent_frames_out_total", "Messages sent", lambda: self.messages_sent)
+        self.metrics.counter("aagent_actions_sent_total", "Actions sent", lambda: self.actions_sent)
+        self.metrics.counter("aagent_ticks_total", "Ticks of the behaviour tree", lambda: self.ticks)
+        if self.action_batcher is not None:
+            batcher = self.action_batcher
+            self.metrics.counter("aagent_actions_coalesced_total", "Actions replaced by a later one of the same tick",
+                                 lambda: batcher.actions_coalesced)
+            self.metrics.counter("aagent_actions_deduplicated_total", "Repeated actions not sent again",
+                                 lambda: batcher.actions_deduplicated)
+            self.metrics.counter("aagent_action_frames_total", "Frames sent with actions", lambda: batcher.frames_sent)
+            self.metrics.counter("aagent_action_bytes_saved_total", "Bytes saved by the batching of the actions",
+                                 lambda: batcher.bytes_unbatched - batcher.bytes_sent)
+        # Writer task (see Outbound.py). With "send_queue": <frames>, the messages are put in a bounded queue and
+        # sent by a task of their own, so the goals do not wait for the network. "send_queue_policy" decides what
+        # is dropped when the queue is full: drop_oldest | drop_newest (movement commands) | block
+        self.writer = None
+        if self.Runtime.get('send_queue', 0) > 0:
+            self.writer = Outbound.OutboundWriter(self.write_queued_frame, self.Runtime['send_queue'],
+                                                  self.Runtime.get('send_queue_policy', "drop_oldest"),
+                                                  self.action_dropped, self.metrics)
+        # Reconnection (Runtime setting "reconnect"). When the connection with Unity is lost, the agent keeps its
+        # state (internal state, behaviour tree or goal, timers of the behaviours) and connects again. Between the
+        # attempts it waits a random time between 0 and "reconnect_delay" * 2^attempt seconds (exponential
+        # backoff with full jitter, at most "reconnect_max_delay"), so when Unity restarts the agents of a fleet
+        # do not reconnect all at once. With "reconnect_timeout" > 0 it exits after that many seconds disconnected
+        self.reconnect = self.Runtime.get('reconnect', False)
+        self.reconnect_delay = self.Runtime.get('reconnect_delay', 0.5)
+        self.reconnect_max_delay = self.Runtime.get('reconnect_max_delay', 10.0)
+        self.reconnect_timeout = self.Runtime.get('reconnect_timeout', 0)
+        # Random generator of the backoff, apart from self.random so reconnecting does not change the choices
+        # of the goals
+        seed = self.Runtime.get('seed')
+        self.reconnect_random = random.Random(f"{seed}:reconnect" if seed is not None else None)
+        # Set when the connection is lost and the agent has to reconnect
+        self.connection_lost_event = asyncio.Event()
+        # Agent clock when the connection was lost, None while connected
+        self.disconnected_at = None
+        self.connection_losses = 0
+        self.reconnect_attempts = 0
+        self.reconnects = 0
+        # Messages not sent because the connection was closed
+        self.messages_lost = 0
+        # Seconds (agent clock) from losing the connection to having it ready again, of every reconnection
+        self.recover_times = []
+        self.recover_time = self.metrics.histogram("aagent_time_to_recover_seconds", "Time from losing the "
+                                                   "connection to having it ready again",
+                                                   Metrics.exponential_buckets(0.1, 2, 12))
+        self.metrics.counter("aagent_connection_losses_total", "Connections with Unity lost",
+                             lambda: self.connection_losses)
+        self.metrics.counter("aagent_reconnect_attempts_total", "Attempts to reconnect with Unity",
+                             lambda: self.reconnect_attempts)
+        self.metrics.counter("aagent_reconnects_total", "Connections with Unity recovered", lambda: self.reconnects)
+        self.metrics.counter("aagent_messages_lost_total", "Messages not sent because the connection was closed",
+                             lambda: self.messages_lost)
+        # Perception-to-action latency (see Tracing.py). It can be switched off with "tracing": false, and
+        # with "trace_file" the latencies are also written in that file as a Chrome trace when the agent finishes
+        # ("{name}" in the file name is replaced by the name of the agent, for hosts running several agents)
+        self.trace_file = self.Runtime.get('trace_file')
+        self.tracer = Tracing.Tracer(self.clock, self.metrics, self.Runtime.get('tracing', True),
+                                     self.trace_file is not None, self.AgentParameters['name'])
+        # Stop of the movements of ForwardDist and Turn (see Control.py). With "predictive_stop" the stop is sent
+        # before reaching the target, extrapolating the velocity, so the agent stops on it. "stop_lead": seconds
+        # the movement goes on after the stop, till it is learnt. The errors are measured in both modes
+        predictive_stop = self.Runtime.get('predictive_stop', False)
+        stop_lead = self.Runtime.get('stop_lead', 0.05)
+        self.stop_predictors = {"move": Control.StopPredictor("move", predictive_stop, stop_lead, metrics=self.metrics),
+                                "turn": Control.StopPredictor("turn", predictive_stop, stop_lead, metrics=self.metrics)}
+        self.stop_predictor_of = {action: predictor for name, predictor in self.stop_predictors.items()
+                                  for action in Control.START_ACTIONS[name]}
+        # Structured logging of the agent (see AgentLog.py). The records are written by a background thread,
+        # and each event (e.g. "action") is rate limited: "log_rate" records per second, in bursts of "log_burst",
+        # or the rate of "log_rates" {event: rate}. With "log_level": "DEBUG" the actions and the status of the
+        # behaviours are logged every tick. "log_format": text | json, "log_file": file instead of stdout
+        AgentLog.setup(self.Runtime.get('log_format', "text"), self.Runtime.get('log_file'),
+                       self.Runtime.get('log_queue', True))
+        self.log = AgentLog.AgentLogger(self.AgentParameters['name'], self.clock, lambda: self.ticks,
+                                        self.Runtime.get('log_level', "INFO"), self.Runtime.get('log_rate', 20.0),
+                                        self.Runtime.get('log_burst', 20), self.Runtime.get('log_rates'))
 
         # Reference to the possible goals the agent can execute
         self.goals = {
@@ -98,40 +330,159 @@ class AAgent:
         """
         Establishes the connection with Unity using a websocket. After that, it sends the initial parameters of the
         agent, obtained previously from the configuration file.
+        :return: True if the websocket is open, False if the connection failed.
         """
         try:
-            self.session = aiohttp.ClientSession()
-            print("Connecting to: " + self.url)
+            if self.session is None:
+                self.session = aiohttp.ClientSession()
+            self.log.info("connection", "Connecting to: " + self.url)
             self.ws = await self.session.ws_connect(self.url)
-            print("Connected to WebSocket server")
+            self.log.info("connection", "Connected to WebSocket server")
             param_json = json.dumps(self.AgentParameters)
-            print("Sending the initial parameters: " + param_json)
+            self.log.info("connection", "Sending the initial parameters: " + param_json)
             await self.send_message("initial_params", param_json)
-        except:
-            print("Failed connection")
-            self.exit_event.set()
+            return True
+        except Exception as e:
+            if self.reconnect:
+                self.log.warning("connection", f"Failed connection: {e}")
+            else:
+                self.log.error("connection", "Failed connection", exc_info=True)
+                self.exit_event.set()
+            return False
+
+    async def close_connection(self):
+        """
+        Closes the websocket, if it is open. The session is kept to connect again.
+        """
+        if self.ws is not None and not self.ws.closed:
+            await self.ws.close()
 
     async def close_websocket(self):
         """
         Properly close the websocket connection.
         """
-        if self.ws:
-            await self.ws.close()
-        if self.session:
+        await self.close_connection()
+        if self.session and not self.shared_session:
             await self.session.close()
-        print("WebSocket connection properly closed")
+        self.log.info("connection", "WebSocket connection properly closed")
 
-    async def send_message(self, msg_type: str, msg_content: str):
+    async def send_message(self, msg_type: str, msg_content: str, trace: str = None):
         """
-        Sends a message in json format of type 'msg_type' and with content 'msg_content' to Unity
+        Sends a message of type 'msg_type' and with content 'msg_content' to Unity, encoded with the codec
+        of the agent (json format by default)
         :param msg_type: General type of the message.
         :param msg_content: Content of the message
+        :param trace: Name of the behaviour that decided the action with the current perception, to trace
+                      its perception-to-action latency (see Tracing.py)
         """
-        msg = {"type": msg_type, "content": msg_content}
-        msg_json = json.dumps(msg)
         if msg_type == "action":
-            print(msg_content)
-        await self.ws.send_str(msg_json)
+            self.actions_sent += 1
+            self.tracer.action_sent(msg_content, trace, self.rc_sensor)
+            self.log.debug("action", msg_content)
+            predictor = self.stop_predictor_of.get(msg_content)
+            if predictor is not None:
+                # A new movement: the stop sent before is not measured if the agent has not stopped yet
+                predictor.moved()
+            if self.action_batcher is not None:
+                # The action is sent with the rest of actions of the tick, when the queue is flushed
+                self.action_batcher.add(msg_content)
+                if not self.actions_flush_scheduled:
+                    # Flushed by the main loop after the tick, or in the next iteration of the event loop if
+                    # the action comes from a goal running between ticks
+                    self.actions_flush_scheduled = True
+                    asyncio.create_task(self.flush_scheduled_actions())
+                return
+        elif self.action_batcher is not None and self.action_batcher.pending:
+            # Keep the order of the messages: the actions queued before this message go first
+            await self.flush_actions()
+        start = time.perf_counter()
+        msg = {"type": msg_type, "content": msg_content}
+        await self.send_data(self.codec.encode(msg), [msg_content] if msg_type == "action" else None)
+        self.send_time.observe(time.perf_counter() - start)
+
+    async def send_data(self, msg_data, actions: list = None):
+        """
+        Sends a message already encoded with the codec of the agent, through the writer task if there is one.
+        :param msg_data: Encoded message, str or bytes.
+        :param actions: Actions in the message, None if it is not an action message.
+        """
+        if self.writer is not None and self.writer.running():
+            # The goal does not wait for the network, only (with the "block" policy) for room in the queue
+            await self.writer.put(msg_data, actions)
+        else:
+            await self.write_frame(msg_data)
+
+    async def write_frame(self, msg_data):
+        """
+        Writes an encoded message in the websocket.
+        :param msg_data: Encoded message, str or bytes.
+        """
+        if self.reconnect and (self.ws is None or self.ws.closed):
+            # The connection has been lost, the message is dropped while the agent reconnects
+            self.messages_lost += 1
+            return
+        start = time.perf_counter()
+        self.messages_sent += 1
+        try:
+            if self.codec.binary:
+                await self.ws.send_bytes(msg_data)
+            else:
+                await self.ws.send_str(msg_data)
+        except ConnectionError as e:
+            if not self.reconnect:
+                raise
+            # The connection is being closed, receive_messages() is going to notice it
+            self.messages_lost += 1
+            self.log.debug("send", f"Message lost: {e!r}")
+            return
+        self.write_time.observe(time.perf_counter() - start)
+
+    async def write_queued_frame(self, msg_data):
+        """
+        write_frame() of the writer task, that reports why it fails.
+        :param msg_data: Encoded message, str or bytes.
+        """
+        try:
+            await self.write_frame(msg_data)
+        except Exception as e:
+            if not self.exit_event.is_set():
+                self.log.error("send", f"The writer task failed: {e!r}")
+            raise
+
+    def action_dropped(self, actions: list):
+        """
+        Called by the writer task when a frame with 'actions' is dropped because the queue is full.
+        :param actions: Actions of the frame.
+        """
+        self.log.debug("action_dropped", ",".join(actions))
+        if self.action_batcher is not None:
+            self.action_batcher.forget(actions)
+
+    async def flush_actions(self):
+        """
+        Sends the actions queued by the batching in a single frame, if there is any (see Outbound.py).
+        """
+        if self.action_batcher is None:
+            return
+        start = time.perf_counter()
+        batch = self.action_batcher.take()
+        if batch is not None:
+            await self.send_data(*batch)
+            self.send_time.observe(time.perf_counter() - start)
+
+    async def flush_scheduled_actions(self):
+        """
+        Flushes the actions queued, in a task of its own (see send_message()).
+        """
+        self.actions_flush_scheduled = False
+        try:
+            await self.flush_actions()
+        except Exception as e:
+            if self.exit_event.is_set():
+                # The connection is being closed, e.g. the goals preempted at the end send their "stop"
+                self.log.debug("action", f"Actions not sent, the agent is exiting: {e!r}")
+            else:
+                self.log.error("action", f"Failed sending the actions: {e!r}")
 
     async def receive_messages(self):
         """
@@ -143,50 +494,170 @@ class AAgent:
             # At each iteration, the event loop will suspend execution until a new value becomes available
             # from self.ws. The loop continues iterating over self.ws till the websocket is closed.
             async for msg in self.ws:
-                if msg.type == aiohttp.WSMsgType.TEXT:
-                    self.process_incoming_message(msg.data)
+                if msg.type == aiohttp.WSMsgType.TEXT or msg.type == aiohttp.WSMsgType.BINARY:
+                    if self.sensor_mailbox:
+                        self.post_incoming_message(msg.data)
+                    else:
+                        self.process_incoming_message(msg.data)
                 elif msg.type == aiohttp.WSMsgType.CLOSED:
-                    print("Connection closed by Unity")
+                    self.log.info("connection", "Connection closed by Unity")
                     break
                 elif msg.type == aiohttp.WSMsgType.ERROR:
-                    print(f"WebSocket connection closed with error: {self.ws.exception()}")
+                    self.log.error("connection", f"WebSocket connection closed with error: {self.ws.exception()}")
                     break
         except Exception as e:
-            print(f"Connection failed: {e}")
+            self.log.error("connection", f"Connection failed: {e}")
         finally:
-            print("Finishing receive_messages")
-            self.exit_event.set()
+            self.log.info("connection", "Finishing receive_messages")
+            if self.reconnect and not self.exit_event.is_set():
+                self.connection_lost()
+            else:
+                self.exit_event.set()
+
+    def connection_lost(self):
+        """
+        The connection with Unity has been lost and the agent is going to reconnect (see run()). The main loop
+        waits like when the simulation is on hold, keeping the behaviour tree or the goal, till Unity starts the
+        agent again.
+        """
+        if self.disconnected_at is None:
+            # Not a failed attempt to reconnect
+            self.connection_losses += 1
+            self.disconnected_at = self.clock()
+            self.log.warning("connection", "Connection with Unity lost")
+        self.connection_ready = False
+        self.connection_ready_event.clear()
+        self.simulation_state = self.ON_HOLD
+        self.running_event.clear()
+        # The sensor frame of the old connection is stale
+        self.pending_sensor = None
+        self.connection_lost_event.set()
 
-    def process_incoming_message(self, msg_data: str):
+    def process_incoming_message(self, msg_data):
         """
-        Processes the message 'msg_data' received from Unity. It is expected to be in json format.
-        :param msg_data: Message received in json format.
+        Processes the message 'msg_data' received from Unity. It is expected to be in the format of the codec
+        of the agent (json format by default).
+        :param msg_data: Message received, str for TEXT frames or bytes for BINARY frames.
+        """
+        self.messages_received += 1
+        received = self.clock()
+        msg_dict = self.decode_message(msg_data)
+        if msg_dict is not None:
+            self.apply_message(msg_dict, received)
+
+    def decode_message(self, msg_data):
+        """
+        Decodes the message 'msg_data' with the codec of the agent.
+        :param msg_data: Message received, str for TEXT frames or bytes for BINARY frames.
+        :return: The message as a dictionary, or None if it could not be decoded.
         """
         try:
-            msg_dict = json.loads(msg_data)
+            start = time.perf_counter()
+            msg_dict = self.codec.decode(msg_data)
+            self.decode_time.observe(time.perf_counter() - start)
+            return msg_dict
+        except (ValueError, TypeError):
+            self.log.warning("decode_error", f"Failed {self.codec.name} decoding of the received message",
+                             data=msg_data)
+            return None
 
+    def post_incoming_message(self, msg_data):
+        """
+        Mailbox mode of process_incoming_message(). Only the type of the message is parsed. The sensor frames are
+        kept in a mailbox that only holds the newest one, which is applied once per tick (or as soon as the event
+        loop is free if there is no behaviour tree being ticked). The rest of the messages are processed in order
+        right away, after the pending sensor frame.
+        :param msg_data: Message received, str for TEXT frames or bytes for BINARY frames.
+        """
+        self.messages_received += 1
+        try:
+            msg_type, msg_dict = self.codec.peek(msg_data)
+        except (ValueError, KeyError, TypeError):
+            self.log.warning("decode_error", f"Failed {self.codec.name} decoding of the received message",
+                             data=msg_data)
+            return
+        if msg_type == "sensor":
+            self.sensor_frames_received += 1
+            if self.pending_sensor is not None:
+                # The previous frame is stale, we drop it without decoding it
+                self.sensor_frames_dropped += 1
+                self.pending_sensor_coalesced = True
+            self.pending_sensor = (msg_data, msg_dict, self.clock())
+            if not self.pending_sensor_scheduled and not (self.currentBT and self.simulation_state == self.RUNNING):
+                # The main loop is not ticking a BT, so it is not going to apply it
+                self.pending_sensor_scheduled = True
+                asyncio.get_running_loop().call_soon(self.apply_pending_sensor)
+            else:
+                # The frame is applied in the next tick
+                self.request_tick()
+        else:
+            # Keep the order of the messages: the sensor frame received before this message goes first
+            self.apply_pending_sensor()
+            if msg_dict is None:
+                msg_dict = self.decode_message(msg_data)
+            if msg_dict is not None:
+                self.apply_message(msg_dict)
+
+    def apply_pending_sensor(self):
+        """
+        Decodes and applies the sensor frame of the mailbox, if any.
+        """
+        self.pending_sensor_scheduled = False
+        if self.pending_sensor is None:
+            return
+        msg_data, msg_dict, received = self.pending_sensor
+        self.pending_sensor = None
+        if self.pending_sensor_coalesced:
+            self.pending_sensor_coalesced = False
+            self.sensor_frames_coalesced += 1
+        self.sensor_frames_applied += 1
+        if msg_dict is None:
+            msg_dict = self.decode_message(msg_data)
+        if msg_dict is not None:
+            self.apply_message(msg_dict, received)
+
+    def apply_message(self, msg_dict: dict, received: float = None):
+        """
+        Applies a message received from Unity, once decoded.
+        :param msg_dict: Message received.
+        :param received: Time (agent clock) at which the message was received, if known
+        """
+        try:
             if msg_dict["Type"] == "sensor":
-                self.rc_sensor.set_perception(msg_dict["Content"][0])
-                self.i_state.set_internal_state(msg_dict["Content"][1])
+                start = time.perf_counter()
+                self.rc_sensor.set_perception(msg_dict["Content"][0], received)
+                self.i_state.set_internal_state(msg_dict["Content"][1], received)
+                self.sensor_apply_time.observe(time.perf_counter() - start)
+                self.request_tick()
+                if self.frame_waiters:
+                    self.notify_frame_waiters()
             elif msg_dict["Type"] == "sim_control":
+                self.request_tick()
                 if msg_dict["Content"] == "connection_ready":
                     self.connection_ready = True
+                    self.connection_ready_event.set()
                 elif msg_dict["Content"] == "on_hold":
                     self.simulation_state = self.ON_HOLD
-                    print("ON HOLD")
+                    self.running_event.clear()
+                    self.log.info("sim_control", "ON HOLD")
                 elif msg_dict["Content"] == "start":
                     self.simulation_state = self.RUNNING
-                    print("RUNNING")
+                    self.running_event.set()
+                    self.log.info("sim_control", "RUNNING")
                 elif msg_dict["Content"] == "error":
-                    print("Error creating the agent in Unity.")
+                    self.log.error("sim_control", "Error creating the agent in Unity.")
                     self.exit_event.set()
                 else:
-                    print("Received unknown message - Type: " + msg_dict["Type"] + "- Content: " + msg_dict["Content"])
+                    self.log.warning("unknown_message", "Received unknown message", type=msg_dict["Type"],
+                                     content=msg_dict["Content"])
             elif msg_dict["Type"] == "agent_control":
                 # These kind of messages have the format
                 # command:data
                 try:
                     command, data = msg_dict["Content"].split(":")
+                    # Wake up the main loop in case it is waiting for something to execute
+                    self.control_event.set()
+                    self.request_tick()
                     if command == "goal":
                         self.currentGoal = data
                         if self.currentBT:  # If there is a BT running
@@ -197,75 +668,336 @@ class AAgent:
                         if self.currentGoal:   # If there is a single Goal running
                             self.currentGoal = None
                     else:
-                        print("Agent_control message with an unknown command: " + msg_dict["content"])
+                        self.log.warning("agent_control", "Agent_control message with an unknown command",
+                                         content=msg_dict["Content"])
                 except Exception as e:
-                    print(f"Exception1: {e}")
+                    self.log.error("agent_control", f"Exception1: {e}")
             else:
-                print("Received unknown message - Type: " + msg_dict["Type"] + "- Content: " + msg_dict["Content"])
-        except json.JSONDecodeError as e:
-            print(f"Failed JSON decoding of the received message: {msg_data}")
+                self.log.warning("unknown_message", "Received unknown message", type=msg_dict["Type"],
+                                 content=msg_dict["Content"])
         except Exception as e:
-            print(f"Exception2: {e}")
+            self.log.error("message", f"Exception2: {e}")
             raise e
 
+    def frame_waiter(self, predicate=None, timeout: float = None):
+        """
+        Registers a waiter of the sensor frames.
+        :param predicate: Function without arguments, evaluated every time a sensor frame is applied. None -> the
+                          next sensor frame.
+        :param timeout: Seconds till the waiter gives up, None -> no limit.
+        :return: asyncio.Future, resolved with True when a sensor frame is applied and 'predicate' is true, or with
+                 False when the timeout expires or the agent exits.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.frame_waiters.append((predicate, future))
+        if timeout is not None:
+            handle = loop.call_later(max(timeout, 0), resolve_future, future, False)
+            future.add_done_callback(lambda _: handle.cancel())
+        return future
+
+    async def wait_until(self, predicate, timeout: float = None) -> bool:
+        """
+        Waits till 'predicate' is true. It is evaluated now and then only when a new sensor frame is applied, so
+        the goals do not poll the state of the agent.
+        :param predicate: Function without arguments.
+        :param timeout: Seconds till giving up, None -> no limit.
+        :return: True if 'predicate' is true, False if the timeout has expired or the agent is exiting.
+        """
+        if predicate():
+            return True
+        return await self.frame_waiter(predicate, timeout)
+
+    async def next_frame(self, timeout: float = None) -> bool:
+        """
+        Waits till a new sensor frame is applied.
+        :param timeout: Seconds till giving up, None -> no limit.
+        :return: True if there is a new frame, False if the timeout has expired or the agent is exiting.
+        """
+        return await self.frame_waiter(None, timeout)
+
+    def notify_frame_waiters(self):
+        """
+        A sensor frame has been applied: wakes up the waiters whose predicate is true now.
+        """
+        waiters = self.frame_waiters
+        self.frame_waiters = []
+        for predicate, future in waiters:
+            if future.done():
+                # Timed out, or woken up by its goal (see Goal.wait_frame())
+                continue
+            try:
+                ready = predicate is None or predicate()
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            if ready:
+                future.set_result(True)
+            else:
+                self.frame_waiters.append((predicate, future))
+
+    def cancel_frame_waiters(self):
+        """
+        The agent is exiting: no more frames are coming.
+        """
+        waiters = self.frame_waiters
+        self.frame_waiters = []
+        for _, future in waiters:
+            resolve_future(future, False)
+
+    def request_tick(self):
+        """
+        Asks the main loop to tick the behaviour tree because something has changed (reactive tick mode).
+        """
+        self.tick_event.set()
+
+    def request_tick_later(self, delay: float):
+        """
+        Asks the main loop to tick the behaviour tree in 'delay' seconds, e.g. when a timer of a behaviour expires.
+        :param delay: Seconds till the tick.
+        :return: asyncio.TimerHandle, that can be cancelled.
+        """
+        return asyncio.get_running_loop().call_later(max(delay, 0), self.request_tick)
+
+    async def wait_tick_request(self):
+        """
+        Reactive tick mode. Waits, without consuming CPU, till a tick is requested, the agent has to exit or
+        max_tick_latency seconds have passed.
+        """
+        if self.tick_event.is_set():
+            return
+        # A single awaitable: the exit event also sets tick_event, and the timeout is a timer that sets it
+        timeout = asyncio.get_running_loop().call_later(self.max_tick_latency, self.tick_timeout)
+        try:
+            await self.tick_event.wait()
+        finally:
+            timeout.cancel()
+
+    def tick_timeout(self):
+        """
+        max_tick_latency has expired without any tick request: a fallback tick.
+        """
+        if not self.tick_event.is_set():
+            self.fallback_ticks += 1
+            self.tick_event.set()
+
+    async def wait_for_event(self, event: asyncio.Event):
+        """
+        Waits, without consuming CPU, till 'event' is set or the agent has to exit.
+        :param event: Event to wait for.
+        :return: True if 'event' is set, False if we are exiting.
+        """
+        if not event.is_set() and not self.exit_event.is_set():
+            waiters = [asyncio.create_task(event.wait()), asyncio.create_task(self.exit_event.wait())]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in waiters:
+                    task.cancel()
+        return event.is_set()
+
+    async def wait_next_tick(self, next_tick: float) -> float:
+        """
+        Sleeps till the time of the next tick when a tick rate is configured.
+        :param next_tick: Loop time at which the last tick was scheduled.
+        :return: Loop time of the following tick.
+        """
+        if self.tick_rate <= 0:
+            return next_tick
+        loop = asyncio.get_running_loop()
+        next_tick += 1.0 / self.tick_rate
+        delay = next_tick - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            return next_tick
+        # We are late, so we do not try to catch up with a burst of ticks
+        return loop.time()
+
     async def main_loop(self):
+        next_tick = asyncio.get_running_loop().time()
         # Keep going while there is not an event to exit
         while not self.exit_event.is_set():
             # Control if we are on hold (simulation paused from Unity)
             if self.simulation_state == self.ON_HOLD:
-                # Just wait, but allow the other tasks keep running
-                await asyncio.sleep(0)
+                # Wait till Unity starts the simulation, but allow the other tasks keep running
+                await self.wait_for_event(self.running_event)
+                next_tick = asyncio.get_running_loop().time()
             else:
                 # Here is where we perform the agent actions
                 # It can be we are executing a simple goal or a behaviour tree
                 try:
                     if self.currentBT:   # We are running a behaviour tree
+                        # The requests made from now on (even during the tick) ask for another tick
+                        self.tick_event.clear()
+                        # In mailbox mode, the newest sensor frame is applied once per tick
+                        self.apply_pending_sensor()
                         await self.bts[self.currentBT].tick()
+                        self.ticks += 1
+                        await self.flush_actions()
+                        if self.tick_mode == "reactive":
+                            await self.wait_tick_request()
                     elif self.currentGoal:     # We are running a simple goal
                         await self.goals[self.currentGoal].run()
-                    else:
+                        # Like the tick of the behaviour trees, let the other tasks run (e.g. receive_messages),
+                        # in case the goal finished without waiting for anything
                         await asyncio.sleep(0)
+                    else:
+                        # Nothing to execute. Wait till Unity sends us a goal or a behaviour tree
+                        self.control_event.clear()
+                        await self.wait_for_event(self.control_event)
+                        next_tick = asyncio.get_running_loop().time()
+                        continue
                 except Exception as e:
                     # In case there is an error executing the update() of the goal,
                     # instead of finishing we change the goal to DoNothing
-                    print("Execution of goal " + self.currentGoal + " failed.")
-                    print(f"Exception3: {e}")
+                    self.log.error("goal", f"Execution of goal {self.currentGoal} failed. Exception3: {e}",
+                                   exc_info=True)
                     self.exit_event.set()
                     #self.currentGoal = "DoNothing"
-        print("Finishing main_loop")
+                next_tick = await self.wait_next_tick(next_tick)
+        self.log.info("main_loop", "Finishing main_loop")
 
-    async def run(self):
-        try:
-            # Create the connection task, that will manage the connection with Unity,
-            # and the exit_event task, that will be used to exit if there is an error
-            connect_task = asyncio.create_task(self.open_websocket())
-            awaited_exit_event = asyncio.create_task(self.exit_event.wait())
+    async def connect(self):
+        """
+        Opens the websocket, starts receiving the messages from Unity and waits till Unity says that the
+        connection is ready.
+        :return: True if the connection is ready, False if it failed or we have to exit.
+        """
+        self.connection_lost_event.clear()
+        # Wait for the websocket to be open or the exit event, what comes first
+        connect_task = asyncio.create_task(self.open_websocket())
+        awaited_exit_event = asyncio.create_task(self.exit_event.wait())
+        await asyncio.wait([connect_task, awaited_exit_event], return_when=asyncio.FIRST_COMPLETED)
+        awaited_exit_event.cancel()
+        if self.exit_event.is_set():
+            connect_task.cancel()
+            return False
+        if not connect_task.result():
+            return False
+        # Now that the connection is established, create the task to start receiving messages from Unity
+        # We are not awaiting this task because it has to run till the connection is closed
+        receive_task = asyncio.create_task(self.receive_messages())
+        if self.writer is not None:
+            self.writer.start()
+        # Wait for the flag "connection_ready" to be True. If it is true, it means we have received an ack
+        # from Unity saying that the connection is fully established and Unity is ready to receive messages.
+        # The connection can also be closed before that
+        ready_task = asyncio.create_task(self.wait_for_event(self.connection_ready_event))
+        await asyncio.wait([ready_task, receive_task], return_when=asyncio.FIRST_COMPLETED)
+        if not ready_task.done():
+            ready_task.cancel()
+            return False
+        return ready_task.result()
+
+    async def reconnect_loop(self):
+        """
+        Connects again with Unity after losing the connection, waiting between the attempts with exponential
+        backoff and full jitter (see "reconnect" in __init__()).
+        :return: True if the connection is ready again, False if we have to exit or we have given up.
+        """
+        # The messages queued for the old connection are stale
+        if self.writer is not None:
+            await self.writer.stop()
+            self.writer.clear()
+        if self.action_batcher is not None:
+            self.action_batcher.reset()
+        await self.close_connection()
+        attempt = 0
+        while not self.exit_event.is_set():
+            delay = self.reconnect_random.uniform(0, min(self.reconnect_max_delay,
+                                                         self.reconnect_delay * 2 ** min(attempt, 30)))
+            if 0 < self.reconnect_timeout < self.clock() + delay - self.disconnected_at:
+                self.log.error("connection", f"Connection with Unity not recovered in {self.reconnect_timeout} s")
+                self.exit_event.set()
+                return False
+            try:
+                await asyncio.wait_for(self.exit_event.wait(), delay)
+                return False
+            except asyncio.TimeoutError:
+                pass
+            attempt += 1
+            self.reconnect_attempts += 1
+            self.log.info("connection", f"Reconnecting with Unity, attempt {attempt}")
+            if await self.connect():
+                recover_time = self.clock() - self.disconnected_at
+                self.disconnected_at = None
+                self.reconnects += 1
+                self.recover_times.append(recover_time)
+                self.recover_time.observe(recover_time)
+                self.log.info("connection", f"Connection with Unity recovered in {recover_time:.2f} s",
+                              attempts=attempt)
+                return True
+            if self.writer is not None:
+                await self.writer.stop()
+            await self.close_connection()
+        return False
 
-            # Wait for the connection with Unity to be ready or the exit event, what comes first
-            await asyncio.wait([connect_task, awaited_exit_event], return_when=asyncio.FIRST_COMPLETED)
+    async def close_goal_runners(self):
+        """
+        Cancels the tasks of the goal runners and waits till they finish, so none is left pending.
+        """
+        tasks = [runner.close() for runner in self.goal_runners]
+        tasks = [task for task in tasks if task is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-            if not self.exit_event.is_set():
-                # Now that the connection is established, create the task to start receiving messages from Unity
-                # We are not awaiting this task because it has to run forever till the main loop finishes
-                asyncio.create_task(self.receive_messages())
-                # Wait for the flag "connection_ready" to be True. If it is true, it means we have received an ack
-                # from Unity saying that the connection is fully established and Unity is ready to receive messages
-                while not self.connection_ready:
-                    await asyncio.sleep(0)
-                print("Connection with Unity fully established")
+    async def run(self):
+        metrics_server = None
+        if self.metrics_port and self.metrics.enabled:
+            metrics_server = Metrics.MetricsServer([self.metrics], port=self.metrics_port)
+            try:
+                await metrics_server.start()
+            except OSError as e:
+                self.log.error("metrics", f"Failed serving the metrics on port {self.metrics_port}: {e}")
+                metrics_server = None
+        main_task = None
+        try:
+            if await self.connect():
+                self.log.info("connection", "Connection with Unity fully established")
                 # We are ready now  to start the main loop of the agent
-                await self.main_loop()
+                main_task = asyncio.create_task(self.main_loop())
+                # With "reconnect", the main loop keeps running (on hold) while the agent connects again
+                while self.reconnect and not main_task.done():
+                    lost_task = asyncio.create_task(self.connection_lost_event.wait())
+                    try:
+                        await asyncio.wait([main_task, lost_task], return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        lost_task.cancel()
+                    if main_task.done() or not await self.reconnect_loop():
+                        break
+                await main_task
         finally:
             # Notify other possible running tasks that we have to exit
             self.exit_event.set()
+            self.cancel_frame_waiters()
+            await self.close_goal_runners()
+            if main_task is not None and not main_task.done():
+                main_task.cancel()
+                try:
+                    await main_task
+                except asyncio.CancelledError:
+                    pass
+            # Send the actions still queued by the batching
+            if self.action_batcher is not None and self.ws is not None and not self.ws.closed:
+                await self.flush_scheduled_actions()
+            if self.writer is not None:
+                # Give the writer task some time to send the messages still queued
+                if self.ws is not None and not self.ws.closed:
+                    await self.writer.drain(0.5)
+                await self.writer.stop()
             # Clean the websocket connection
             await self.close_websocket()
-            print("Connection with Unity closed")
+            self.log.info("connection", "Connection with Unity closed")
+            if metrics_server is not None:
+                await metrics_server.stop()
+            if self.trace_file:
+                self.tracer.dump_chrome_trace(self.trace_file.format(name=self.AgentParameters['name']))
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python AAgent_Python.py <init_file.json>")
+        print("To run several agents in the same process use: python AgentHost.py <init_file.json | glob> ...")
     else:
         # Get the name of the file with the initial parameters
         init_file = sys.argv[1]
@@ -0,0 +1,76 @@
+import sys
+import glob
+import asyncio
+import aiohttp
+import AAgent_BT
+
+
+def expand_config_paths(patterns):
+    '''
+    Description: Expands the list of configuration files and glob patterns given in the command line
+    Input: patterns: list of file paths or glob patterns (e.g. "AAgent-*.json")
+    Output: config_paths: list of configuration files, in order and without repetitions
+    '''
+    config_paths = []
+    for pattern in patterns:
+        # If the pattern does not match any file we keep it, so the agent reports the missing file
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if path not in config_paths:
+                config_paths.append(path)
+    return config_paths
+
+
+def create_agents(config_paths, session):
+    '''
+    Description: Creates one AAgent per configuration file, all of them using the same session
+    Input: config_paths: list of configuration files
+           session: aiohttp.ClientSession shared by the agents
+    Output: agents: list with the AAgent objects
+    '''
+    agents = []
+    for path in config_paths:
+        try:
+            agents.append(AAgent_BT.AAgent(path, session=session))
+        except Exception as e:
+            # A wrong configuration file only discards its own agent
+            print(f"Failed creating the agent of {path}: {e!r}")
+    return agents
+
+
+async def run_agents(config_paths, monitor=None):
+    '''
+    Description: Runs one AAgent per configuration file as tasks of the same event loop.
+                 All the agents share the same aiohttp session (connection pool) and the modules
+                 Goals_BT, BTCritter and BTRoam, that are imported only once.
+                 Each agent keeps its own exit_event, so if one of them fails or its connection is
+                 closed the rest keep running.
+    Input: config_paths: list of configuration files
+           monitor: optional coroutine function, monitor(agents), run while the agents are alive
+    Output: agents: list with the AAgent objects, once all of them have finished
+    '''
+    # Each agent keeps a websocket open, so the pool must not limit the number of connections
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        agents = create_agents(config_paths, session)
+        monitor_task = asyncio.create_task(monitor(agents)) if monitor else None
+        results = await asyncio.gather(*[agent.run() for agent in agents], return_exceptions=True)
+        if monitor_task:
+            monitor_task.cancel()
+        for agent, result in zip(agents, results):
+            if isinstance(result, BaseException):
+                print(f"Agent {agent.AgentParameters['name']} failed: {result!r}")
+    return agents
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python AgentHost.py <init_file.json | glob> ...")
+    else:
+        # Get the names of the files with the initial parameters of each agent
+        init_files = expand_config_paths(sys.argv[1:])
+        print(f"Running {len(init_files)} agents: {', '.join(init_files)}")
+
+        # Run all the agents in the same event loop
+        asyncio.run(run_agents(init_files))
+
+        print("Bye!!!")
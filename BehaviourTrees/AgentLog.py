@@ -0,0 +1,245 @@
+import sys
+import json
+import queue
+import atexit
+import threading
+import logging
+
+
+# Levels of the Runtime setting "log_level". "OFF" discards everything
+LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR,
+          "OFF": logging.CRITICAL + 1}
+
+# Logger of the agents. All the agents of the process share it (and its handler), each one through an AgentLogger
+LOGGER_NAME = "aagent"
+
+# Writer thread of the process, None if the records are written by the thread that logs them
+writer = None
+# Handler that writes the records (to stdout or to a file)
+output_handler = None
+
+
+class ConsoleHandler(logging.StreamHandler):
+    '''
+    Description: Writes the records to the current sys.stdout, like print(). So contextlib.redirect_stdout()
+                 applies to them too (e.g. to run the agents quietly, see Headless.py)
+    '''
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+    def emit(self, record):
+        if sys.stdout is not None:
+            super().emit(record)
+
+
+class RecordWriter:
+    '''
+    Description: Background thread that writes the records of the agents. The agents only put a tuple with the
+                 data of the record in a queue (see AgentLogger.log()), and the thread builds the LogRecord,
+                 formats it and writes it, so a slow terminal or disk never blocks the event loop
+    '''
+    def __init__(self, handler):
+        self.handler = handler
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="AgentLog", daemon=True)
+        self.thread.start()
+
+    def put(self, data):
+        self.queue.put(data)
+
+    def run(self):
+        logger = logging.getLogger(LOGGER_NAME)
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if isinstance(data, threading.Event):
+                # Marker of flush(): all the records before it are written
+                self.handler.flush()
+                data.set()
+                continue
+            self.handler.handle(make_record(logger, *data))
+
+    def flush(self):
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def make_record(logger, level, message, exc_info, extra):
+    '''
+    :return: LogRecord with the data of an AgentLogger record. It is built directly, without looking for the
+             caller in the stack
+    '''
+    return logger.makeRecord(LOGGER_NAME, level, "", 0, message, None, exc_info, None, extra)
+
+
+class TextFormatter(logging.Formatter):
+    '''
+    Description: One line per record: agent time, level, agent, tick, event, message and fields, e.g.
+                 "12.345 DEBUG Critter_1 #250 action: tr"
+    '''
+    def format(self, record):
+        line = f"{record.agent_time:.3f} {record.levelname} {record.agent} #{record.tick} {record.event}"
+        message = record.getMessage()
+        if message:
+            line += f": {message}"
+        if record.fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in record.fields.items())
+        if record.suppressed:
+            line += f" ({record.suppressed} similar records suppressed)"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Description: One JSON object per record (JSON lines), with the fields of the record as keys
+    '''
+    def format(self, record):
+        data = {"time": record.agent_time, "level": record.levelname, "agent": record.agent, "tick": record.tick,
+                "event": record.event, "message": record.getMessage()}
+        data.update(record.fields)
+        if record.suppressed:
+            data["suppressed"] = record.suppressed
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def setup(log_format="text", log_file=None, use_queue=True):
+    '''
+    Description: Configures the output of the agents of the process, if it is not configured yet.
+                 With 'use_queue' the records are written by a background thread (RecordWriter), so logging
+                 never blocks the event loop
+    Input: log_format: str, "text" | "json"
+           log_file: str, file where the records are appended (None -> stdout)
+           use_queue: bool, write the records in a background thread
+    '''
+    global writer, output_handler
+    if output_handler is not None:
+        return
+    output_handler = logging.FileHandler(log_file) if log_file else ConsoleHandler()
+    output_handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    if use_queue:
+        writer = RecordWriter(output_handler)
+    # Write the pending records when the process exits (registered once)
+    atexit.unregister(shutdown)
+    atexit.register(shutdown)
+
+
+def flush():
+    '''
+    Description: Waits till the background thread has written all the records logged so far
+    '''
+    if writer is not None:
+        writer.flush()
+
+
+def shutdown():
+    '''
+    Description: Writes the pending records and closes the output, so setup() can configure it again
+    '''
+    global writer, output_handler
+    if writer is not None:
+        writer.stop()
+        writer = None
+    if output_handler is not None:
+        output_handler.close()
+        output_handler = None
+
+
+class AgentLogger:
+    '''
+    Description: Structured, rate-limited logger of an agent. Every record has the name of the agent, its clock,
+                 the tick of the behaviour tree, an event (the type of the message, e.g. "action") and optional
+                 fields. Records below the level of the agent are discarded with a single comparison, and each
+                 event is rate limited with a token bucket: at most 'rate' records per second of the agent clock,
+                 with bursts of 'burst' (errors are never dropped). The records dropped are counted and reported in
+                 the next one of the event
+    '''
+    def __init__(self, name, clock, tick=lambda: 0, level="INFO", rate=20.0, burst=20, rates=None):
+        '''
+        init method for AgentLogger
+        Input: name: str, name of the agent
+               clock: function that returns the current time in seconds (the clock of the agent)
+               tick: function that returns the current tick of the agent
+               level: str, minimum level of the records (see LEVELS)
+               rate: float, records per second allowed for each event (0 -> no limit)
+               burst: int, records allowed in a row before the rate applies
+               rates: dict {event: rate} with the rate of some events, instead of 'rate'
+        '''
+        self.name = name
+        self.clock = clock
+        self.tick = tick
+        self.level = LEVELS[level.upper()] if isinstance(level, str) else level
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.logger = logging.getLogger(LOGGER_NAME)
+        # Token buckets: {event: [tokens, time of the last refill, records suppressed]}
+        self.buckets = {}
+        self.records_suppressed = 0
+
+    def debug(self, event, message="", **fields):
+        if logging.DEBUG >= self.level:
+            self.log(logging.DEBUG, event, message, fields)
+
+    def info(self, event, message="", **fields):
+        if logging.INFO >= self.level:
+            self.log(logging.INFO, event, message, fields)
+
+    def warning(self, event, message="", **fields):
+        if logging.WARNING >= self.level:
+            self.log(logging.WARNING, event, message, fields)
+
+    def error(self, event, message="", exc_info=None, **fields):
+        if logging.ERROR >= self.level:
+            self.log(logging.ERROR, event, message, fields, exc_info)
+
+    def log(self, level, event, message, fields, exc_info=None):
+        '''
+        Logs a record, if the rate of 'event' allows it (errors and above are never dropped, they only report
+        the records of the event dropped before them)
+        '''
+        now = self.clock()
+        rate = self.rates.get(event, self.rate)
+        suppressed = 0
+        if level >= logging.ERROR:
+            bucket = self.buckets.get(event)
+            if bucket is not None:
+                suppressed, bucket[2] = bucket[2], 0
+        elif rate > 0:
+            bucket = self.buckets.get(event)
+            if bucket is None:
+                bucket = self.buckets[event] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                self.records_suppressed += 1
+                return
+            bucket[0] = tokens - 1
+            suppressed, bucket[2] = bucket[2], 0
+        if exc_info is True:
+            exc_info = sys.exc_info()
+        extra = {"agent": self.name, "agent_time": now, "tick": self.tick(), "event": event, "fields": fields,
+                 "suppressed": suppressed}
+        if writer is not None:
+            writer.put((level, message, exc_info, extra))
+        elif output_handler is not None:
+            output_handler.handle(make_record(self.logger, level, message, exc_info, extra))
@@ -1,11 +1,11 @@
+import time
 import asyncio
 import random
 import py_trees
 import py_trees as pt
 from py_trees import common
 import Goals_BT
-import Sensors
-import time
+import FlatTree
 
 
 class BN_DoNothing(pt.behaviour.Behaviour):
@@ -16,10 +16,10 @@ class BN_DoNothing(pt.behaviour.Behaviour):
         '''
         init method for BN_DoNothing
         '''
-        #Set the goal to None
-        self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_DoNothing")
+        #Create the goal, run by a GoalRunner every time the behaviour is initialised
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.DoNothing(aagent))
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_DoNothing")
         #Call the parent constructor
         super(BN_DoNothing, self).__init__("BN_DoNothing")
         #get the agent
@@ -27,9 +27,9 @@ class BN_DoNothing(pt.behaviour.Behaviour):
 
     def initialise(self):
         '''
-        initialise method for BN_DoNothing, creates a task to make the agent do nothing
+        initialise method for BN_DoNothing, arms the goal to make the agent do nothing
         '''
-        self.my_goal = asyncio.create_task(Goals_BT.DoNothing(self.my_agent).run())
+        self.my_goal.arm()
 
     def update(self):
         '''
@@ -44,21 +44,21 @@ class BN_DoNothing(pt.behaviour.Behaviour):
         else:
             #Check if the goal was successful
             if self.my_goal.result():
-                print("BN_DoNothing completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_DoNothing completed with SUCCESS")
                 #Return success
                 return pt.common.Status.SUCCESS
             #If the goal was not successful
             else:
-                print("BN_DoNothing completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_DoNothing completed with FAILURE")
                 #Return failure
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
         '''
-        terminate method for BN_DoNothing by cancelling the goal
+        terminate method for BN_DoNothing by preempting the goal
         '''
-        #we have to stop the associated task
-        self.my_goal.cancel()
+        #we have to preempt the associated goal
+        self.my_goal.preempt()
 
 
 
@@ -70,10 +70,10 @@ class BN_ForwardRandom(pt.behaviour.Behaviour):
         '''
         init method for BN_ForwardRandom
         '''
-        #Set the goal to None
-        self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_ForwardRandom")
+        #Create the goal, run by a GoalRunner every time the behaviour is initialised
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.ForwardDist(aagent, -1, 1, 5), "stop")
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_ForwardRandom")
         #Call the parent constructor
         super(BN_ForwardRandom, self).__init__("BN_ForwardRandom")
         #log the message
@@ -84,12 +84,12 @@ class BN_ForwardRandom(pt.behaviour.Behaviour):
 
     def initialise(self):
         '''
-        initialise method for BN_ForwardRandom, creates a task to move the agent forward
+        initialise method for BN_ForwardRandom, arms the goal to move the agent forward
         '''
         #Print a message to the terminal
-        self.logger.debug("Create Goals_BT.ForwardDist task")
-        #Create a task to move the agent forward for 1 to 5 units of distance
-        self.my_goal = asyncio.create_task(Goals_BT.ForwardDist(self.my_agent, -1, 1, 5).run())
+        self.logger.debug("Arm Goals_BT.ForwardDist goal")
+        #Arm the goal to move the agent forward for 1 to 5 units of distance
+        self.my_goal.arm()
 
     def update(self):
         '''
@@ -105,23 +105,23 @@ class BN_ForwardRandom(pt.behaviour.Behaviour):
             #Check if the goal was successful
             if self.my_goal.result():
                 self.logger.debug("BN_ForwardRandom completed with SUCCESS")
-                print("BN_ForwardRandom completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_ForwardRandom completed with SUCCESS")
                 #Return success
                 return pt.common.Status.SUCCESS
             #If the goal was not successful
             else:
                 self.logger.debug("BN_ForwardRandom completed with FAILURE")
-                print("BN_ForwardRandom completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_ForwardRandom completed with FAILURE")
                 #Return failure
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
         '''
-        terminate method for BN_ForwardRandom by cancelling the goal
+        terminate method for BN_ForwardRandom by preempting the goal
         '''
-        # we have to stop the associated task
+        # we have to preempt the associated goal
         self.logger.debug("Terminate BN_ForwardRandom")
-        self.my_goal.cancel()
+        self.my_goal.preempt()
 
 
 
@@ -133,10 +133,10 @@ class BN_TurnRandom(pt.behaviour.Behaviour):
         '''
         init method for BN_TurnRandom
         '''
-        #Set the goal to None
-        self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_TurnRandom")
+        #Create the goal, run by a GoalRunner every time the behaviour is initialised
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.Turn(aagent), "nt")
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_TurnRandom")
         #Call the parent constructor
         super(BN_TurnRandom, self).__init__("BN_TurnRandom")
         #get the agent
@@ -144,9 +144,9 @@ class BN_TurnRandom(pt.behaviour.Behaviour):
 
     def initialise(self):
         '''
-        initialise method for BN_TurnRandom, creates a task to turn the agent
+        initialise method for BN_TurnRandom, arms the goal to turn the agent
         '''
-        self.my_goal = asyncio.create_task(Goals_BT.Turn(self.my_agent).run())
+        self.my_goal.arm()
 
     def update(self):
         '''
@@ -161,22 +161,22 @@ class BN_TurnRandom(pt.behaviour.Behaviour):
         else:
             #If the goal was successful
             if self.my_goal.result():
-                print("BN_Turn completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_Turn completed with SUCCESS")
                 #Return success
                 return pt.common.Status.SUCCESS
             #If the goal was not successful
             else:
-                print("BN_Turn completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_Turn completed with FAILURE")
                 #Return failure
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
         '''
-        terminate method for BN_TurnRandom by cancelling the goal
+        terminate method for BN_TurnRandom by preempting the goal
         '''
-        # we have to stop the associated task
+        # we have to preempt the associated goal
         self.logger.debug("Terminate BN_TurnRandom")
-        self.my_goal.cancel()
+        self.my_goal.preempt()
 
 
 
@@ -191,12 +191,15 @@ class BN_DetectFlower(pt.behaviour.Behaviour):
         '''
         #Set the goal to None
         self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_DetectFlower")
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_DetectFlower")
         #Call the parent constructor
         super(BN_DetectFlower, self).__init__("BN_DetectFlower")
         #get the agent
         self.my_agent = aagent
+        #Sequence number of the last sensor frame checked and the status we got with it
+        self.last_frame = -1
+        self.last_status = pt.common.Status.FAILURE
 
     def initialise(self):
         '''
@@ -209,20 +212,20 @@ class BN_DetectFlower(pt.behaviour.Behaviour):
         update method for BN_DetectFlower:
         checks if the raycast sensor detects a flower in the environment or not 
         '''
-        #Get the object information from the raycast sensor
-        sensor_obj_info = self.my_agent.rc_sensor.sensor_rays[Sensors.RayCastSensor.OBJECT_INFO]
-        #Iterate through the object information
-        for index, value in enumerate(sensor_obj_info):
-            #If there is a hit with an object
-            if value:  
-                #If the object it hits is a flower
-                if value["tag"] == "Flower": 
-                    # a flower is detected, print a message to the terminal
-                    print("BN_DetectFlower completed with SUCCESS")
-                    #Return success
-                    return pt.common.Status.SUCCESS
-        #If no flower is detected, print a message to the terminal
-        return pt.common.Status.FAILURE
+        #Get the raycast sensor
+        rc_sensor = self.my_agent.rc_sensor
+        #If no new sensor frame has arrived, the result is the same as in the last update
+        if rc_sensor.frame_seq != self.last_frame:
+            self.last_frame = rc_sensor.frame_seq
+            #Check in the tag index of the frame if any ray hits a flower
+            if "Flower" in rc_sensor.tag_index:
+                self.last_status = pt.common.Status.SUCCESS
+            else:
+                self.last_status = pt.common.Status.FAILURE
+        #If a flower is detected, print a message to the terminal
+        if self.last_status == pt.common.Status.SUCCESS:
+            self.my_agent.log.debug("bt_status", "BN_DetectFlower completed with SUCCESS")
+        return self.last_status
 
     def terminate(self, new_status: common.Status):
         '''
@@ -242,10 +245,10 @@ class BN_EatFlower(pt.behaviour.Behaviour):
         '''
         init method for BN_EatFlower
         '''
-        #Set the goal to None
-        self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_EatFlower")
+        #Create the goal, run by a GoalRunner every time the behaviour is initialised
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.EatFlower(aagent))
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_EatFlower")
         #Call the parent constructor
         super(BN_EatFlower, self).__init__("BN_EatFlower")
         #get the agent
@@ -253,42 +256,42 @@ class BN_EatFlower(pt.behaviour.Behaviour):
 
     def initialise(self):
         '''
-        initialise method for BN_EatFlower, creates a task to eat the flower
+        initialise method for BN_EatFlower, arms the goal to eat the flower
         '''
-        self.my_goal = asyncio.create_task(Goals_BT.EatFlower(self.my_agent).run())
+        self.my_goal.arm()
 
     def update(self):
         '''
         update method for BN_EatFlower: 
         checks if the goal is done, if it is, checks if the goal was successful or not
         '''
-        #Print a message to the terminal
-        print("inside BN_EatFlower")
+        #Log a message
+        self.my_agent.log.debug("bt_update", "inside BN_EatFlower")
         #Check if the goal is not done
         if not self.my_goal.done():
-            print("running BN_EatFlower")
+            self.my_agent.log.debug("bt_update", "running BN_EatFlower")
             #Return running
             return pt.common.Status.RUNNING
         #If the goal is done
         else:
             #Check if the goal was successful
             if  self.my_goal.result():
-                print("BN_EatFlower completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_EatFlower completed with SUCCESS")
                 #Return success
                 return pt.common.Status.SUCCESS
             #If the goal was not successful
             else:
-                print("BN_EatFlower completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_EatFlower completed with FAILURE")
                 #Return failure
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
         '''
-        terminate method for BN_EatFlower by cancelling the goal
+        terminate method for BN_EatFlower by preempting the goal
         '''
-        #we have to stop the associated task
+        #we have to preempt the associated goal
         self.logger.debug("Terminate BN_EatFlower")
-        self.my_goal.cancel()
+        self.my_goal.preempt()
 
 
 
@@ -297,18 +300,24 @@ class BN_DetectObstacle(pt.behaviour.Behaviour):
     Description: Behaviour that detects an obstacle in the environment
                  using the raycast sensor of the critter
     '''
+    # Tags of the objects that are not obstacles
+    NOT_OBSTACLES = frozenset(("Astronaut", "CritterMantaRay"))
+
     def __init__(self, aagent):
         '''
         init method for BN_DetectObstacle
         '''
         #Set the goal to None
         self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_DetectObstacle")
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_DetectObstacle")
         #Call the parent constructor
         super(BN_DetectObstacle, self).__init__("BN_DetectObstacle")
         #get the agent
         self.my_agent = aagent
+        #Sequence number of the last sensor frame checked and the status we got with it
+        self.last_frame = -1
+        self.last_status = pt.common.Status.FAILURE
 
     def initialise(self):
         '''
@@ -321,20 +330,26 @@ class BN_DetectObstacle(pt.behaviour.Behaviour):
         update method for BN_DetectObstacle:
         checks if the raycast sensor detects an obstacle in the environment or not
         '''
-        #Get the object information from the raycast sensor
-        sensor_obj_info = self.my_agent.rc_sensor.sensor_rays[Sensors.RayCastSensor.OBJECT_INFO]
-        #Iterate through the object information
-        for index, value in enumerate(sensor_obj_info):
-            #If there is a hit with an object
-            if value: 
-                #If the object it hits is not an astronaut nor critter
-                if value["tag"] != "Astronaut" and value["tag"]!="CritterMantaRay":
-                    # an obstacle is detected, print a message to the terminal
-                    print("BN_DetectObstacle completed with SUCCESS")
-                    #Return success
-                    return pt.common.Status.SUCCESS
-        #Return failure if no obstacle is detected
-        return pt.common.Status.FAILURE
+        #Get the raycast sensor
+        rc_sensor = self.my_agent.rc_sensor
+        #If no new sensor frame has arrived, the result is the same as in the last update
+        if rc_sensor.frame_seq != self.last_frame:
+            self.last_frame = rc_sensor.frame_seq
+            #An obstacle is any object hit that is not an astronaut nor critter
+            #(checked on the tags of the index, without a loop in Python)
+            if not self.NOT_OBSTACLES.issuperset(rc_sensor.tag_index):
+                self.last_status = pt.common.Status.SUCCESS
+            else:
+                self.last_status = pt.common.Status.FAILURE
+            #Trace the perception-to-action latency of the detection (see Tracing.py)
+            if self.last_status == pt.common.Status.SUCCESS:
+                self.my_agent.tracer.detected(self.name, rc_sensor, "Avoid")
+            else:
+                self.my_agent.tracer.lost(self.name)
+        #If an obstacle is detected, print a message to the terminal
+        if self.last_status == pt.common.Status.SUCCESS:
+            self.my_agent.log.debug("bt_status", "BN_DetectObstacle completed with SUCCESS")
+        return self.last_status
 
     def terminate(self, new_status: common.Status):
         '''
@@ -351,10 +366,10 @@ class BN_Avoid(pt.behaviour.Behaviour):
         '''
         init method for BN_Avoid
         '''
-        #Set the goal to None
-        self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_Avoid")
+        #Create the goal, run by a GoalRunner every time the behaviour is initialised
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.Avoid(aagent, degrees), "nt")
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_Avoid")
         #Call the parent constructor
         super(BN_Avoid, self).__init__("BN_Avoid")
         #get the agent
@@ -363,9 +378,9 @@ class BN_Avoid(pt.behaviour.Behaviour):
 
     def initialise(self):
         '''
-        initialise method for BN_Avoid, creates a task to avoid the obstacle
+        initialise method for BN_Avoid, arms the goal to avoid the obstacle
         '''
-        self.my_goal = asyncio.create_task(Goals_BT.Avoid(self.my_agent, self.degrees).run())
+        self.my_goal.arm()
 
     def update(self):
         '''
@@ -380,22 +395,22 @@ class BN_Avoid(pt.behaviour.Behaviour):
         else:
             #Check if the goal was successful
             if self.my_goal.result():
-                print("BN_Avoid completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_Avoid completed with SUCCESS")
                 #Return success
                 return pt.common.Status.SUCCESS
             #If the goal was not successful
             else:
-                print("BN_Avoid completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_Avoid completed with FAILURE")
                 #Return failure
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
         '''
-        terminate method for BN_Avoid by cancelling the goal
+        terminate method for BN_Avoid by preempting the goal
         '''
-        # we have to stop the associated task
+        # we have to preempt the associated goal
         self.logger.debug("Terminate BN_Avoid")
-        self.my_goal.cancel()
+        self.my_goal.preempt()
 
 
 class HungryTimer(pt.behaviour.Behaviour):
@@ -415,6 +430,8 @@ class HungryTimer(pt.behaviour.Behaviour):
         self.agent.hungry = True
         #Set the start time
         self.start_time = current_time
+        #Deadline for which a tick of the behaviour tree has been requested (reactive tick mode)
+        self.tick_deadline = None
 
     def initialise(self):
         '''
@@ -427,11 +444,11 @@ class HungryTimer(pt.behaviour.Behaviour):
         update method for HungryTimer:
         checks if the critter is hungry or not
         '''
-        #Get the current time
-        current_time = time.time()
+        #Get the current time, from the clock of the agent
+        current_time = self.agent.clock()
         #If the critter is hungry
         if self.agent.hungry:
-            print("Hungry completed with SUCCESS")
+            self.agent.log.debug("bt_status", "Hungry completed with SUCCESS")
             #Return success
             return pt.common.Status.SUCCESS
         
@@ -441,12 +458,17 @@ class HungryTimer(pt.behaviour.Behaviour):
             self.agent.hungry = True  
             #Set the start time to the current time, resetting the timer
             self.start_time = current_time
-            print("Hungry completed with SUCCESS")
+            self.agent.log.debug("bt_status", "Hungry completed with SUCCESS")
             #Return success
             return pt.common.Status.SUCCESS
         #If the critter is not hungry and the timer is less than 15 seconds
         else:
-            print("Hungry completed with FAILURE")
+            #Ask for a tick when the critter gets hungry, in case nothing else ticks the tree before
+            if self.tick_deadline != self.start_time + 15:
+                self.tick_deadline = self.start_time + 15
+                #(a bit after the deadline, because the timer needs more than 15 seconds)
+                self.agent.request_tick_later(self.tick_deadline - current_time + 0.01)
+            self.agent.log.debug("bt_status", "Hungry completed with FAILURE")
             #Return failure
             return pt.common.Status.FAILURE
 
@@ -472,14 +494,17 @@ class BN_DetectAstro(pt.behaviour.Behaviour):
         '''
         #Set the goal to None
         self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_DetectAstro")
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_DetectAstro")
         #Call the parent constructor
         super(BN_DetectAstro, self).__init__("BN_DetectAstro")
         #get the agent
         self.my_agent = aagent
         #Create a variable to store the sensor index, initialized to None
         self.my_agent.det_sensor = None
+        #Sequence number of the last sensor frame checked and the status we got with it
+        self.last_frame = -1
+        self.last_status = pt.common.Status.FAILURE
 
     def initialise(self):
         '''
@@ -492,22 +517,28 @@ class BN_DetectAstro(pt.behaviour.Behaviour):
         update method for BN_DetectAstro:
         checks if the raycast sensor detects an astronaut in the environment or not
         '''
-        #Get the object information from the raycast sensor
-        sensor_obj_info = self.my_agent.rc_sensor.sensor_rays[Sensors.RayCastSensor.OBJECT_INFO]
-        #Iterate through the object information
-        for index, value in enumerate(sensor_obj_info):
-            #If there is a hit with an object
-            if value:  
-                #If the object it hits is an astronaut
-                if value["tag"] == "Astronaut": 
-                    # an astronaut is detected, print a message to the terminal
-                    print("BN_DetectAstro completed with SUCCESS")
-                    #Set the sensor index to the index of the astronaut
-                    self.my_agent.det_sensor = index
-                    #Return success
-                    return pt.common.Status.SUCCESS
-        #Return failure if no astronaut is detected
-        return pt.common.Status.FAILURE
+        #Get the raycast sensor
+        rc_sensor = self.my_agent.rc_sensor
+        #If no new sensor frame has arrived, the result is the same as in the last update
+        if rc_sensor.frame_seq != self.last_frame:
+            self.last_frame = rc_sensor.frame_seq
+            #Look for the rays hitting an astronaut in the tag index of the frame
+            astronaut = rc_sensor.tag_index.get("Astronaut")
+            if astronaut:
+                #Set the sensor index to the index of the first ray that hits the astronaut
+                self.my_agent.det_sensor = astronaut.rays[0]
+                self.last_status = pt.common.Status.SUCCESS
+            else:
+                self.last_status = pt.common.Status.FAILURE
+            #Trace the perception-to-action latency of the detection (see Tracing.py)
+            if self.last_status == pt.common.Status.SUCCESS:
+                self.my_agent.tracer.detected(self.name, rc_sensor, "FollowAstronaut")
+            else:
+                self.my_agent.tracer.lost(self.name)
+        #If an astronaut is detected, print a message to the terminal
+        if self.last_status == pt.common.Status.SUCCESS:
+            self.my_agent.log.debug("bt_status", "BN_DetectAstro completed with SUCCESS")
+        return self.last_status
 
     def terminate(self, new_status: common.Status):
         '''
@@ -523,20 +554,23 @@ class BN_FollowAstro(pt.behaviour.Behaviour):
         '''
         init method for BN_FollowAstro
         '''
-        #Set the goal to None
-        self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_FollowAstro")
+        #Create the goal, run by a GoalRunner every time the behaviour is initialised
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.FollowAstronaut(aagent), "nt")
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_FollowAstro")
         #Call the parent constructor
         super(BN_FollowAstro, self).__init__("BN_FollowAstro")
         #get the agent
         self.my_agent = aagent
+        #Time (agent clock) at which the agent started following the astronaut
+        self.follow_start = None
 
     def initialise(self):
         '''
-        initialise method for BN_FollowAstro, creates a task to follow the astronaut
+        initialise method for BN_FollowAstro, arms the goal to follow the astronaut
         '''
-        self.my_goal = asyncio.create_task(Goals_BT.FollowAstronaut(self.my_agent).run())
+        self.my_goal.arm()
+        self.follow_start = self.my_agent.clock()
 
     def update(self):
         '''
@@ -551,22 +585,26 @@ class BN_FollowAstro(pt.behaviour.Behaviour):
         else:
             #Check if the goal was successful
             if self.my_goal.result():
-                print("BN_FollowAstro completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_FollowAstro completed with SUCCESS")
                 #Return success
                 return pt.common.Status.SUCCESS
             #If the goal was not successful
             else:
-                print("BN_FollowAstro completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_FollowAstro completed with FAILURE")
                 #Return failure
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
         '''
-        terminate method for BN_FollowAstro by cancelling the goal
+        terminate method for BN_FollowAstro by preempting the goal
         '''
-        # we have to stop the associated task
+        # we have to preempt the associated goal
         self.logger.debug("Terminate BN_FollowAstro")
-        self.my_goal.cancel()
+        self.my_goal.preempt()
+        #Add the time following the astronaut to the counter of the agent
+        if self.follow_start is not None:
+            self.my_agent.follow_time += self.my_agent.clock() - self.follow_start
+            self.follow_start = None
 
 class BN_DetectCritter(pt.behaviour.Behaviour):
     '''
@@ -579,12 +617,15 @@ class BN_DetectCritter(pt.behaviour.Behaviour):
         '''
         #Set the goal to None
         self.my_goal = None
-        #Print a message to the terminal
-        print("Initializing BN_DetectCritter")
+        #Log a message
+        aagent.log.debug("bt_init", "Initializing BN_DetectCritter")
         #Call the parent constructor
         super(BN_DetectCritter, self).__init__("BN_DetectCritter")
         #get the agent
         self.my_agent = aagent
+        #Sequence number of the last sensor frame checked and the status we got with it
+        self.last_frame = -1
+        self.last_status = pt.common.Status.FAILURE
 
     def initialise(self):
         '''
@@ -597,21 +638,25 @@ class BN_DetectCritter(pt.behaviour.Behaviour):
         update method for BN_DetectCritter:
         checks if the raycast sensor detects an astronaut in the environment or not
         '''
-        #Get the object information from the raycast sensor
-        sensor_obj_info = self.my_agent.rc_sensor.sensor_rays[Sensors.RayCastSensor.OBJECT_INFO]
-        #Iterate through the object information
-        for index, value in enumerate(sensor_obj_info):
-            #If there is a hit with an object
-            if value:  
-                #If the object it hits is a critter
-                if value["tag"] == "CritterMantaRay": 
-
-                    # a critter is detected, print a message to the terminal
-                    print("BN_DetectCritter completed with SUCCESS")
-                    #Return success
-                    return pt.common.Status.SUCCESS
-        #Return failure if no critter is detected
-        return pt.common.Status.FAILURE
+        #Get the raycast sensor
+        rc_sensor = self.my_agent.rc_sensor
+        #If no new sensor frame has arrived, the result is the same as in the last update
+        if rc_sensor.frame_seq != self.last_frame:
+            self.last_frame = rc_sensor.frame_seq
+            #Check in the tag index of the frame if any ray hits a critter
+            if "CritterMantaRay" in rc_sensor.tag_index:
+                self.last_status = pt.common.Status.SUCCESS
+            else:
+                self.last_status = pt.common.Status.FAILURE
+            #Trace the perception-to-action latency of the detection (see Tracing.py)
+            if self.last_status == pt.common.Status.SUCCESS:
+                self.my_agent.tracer.detected(self.name, rc_sensor, "Avoid")
+            else:
+                self.my_agent.tracer.lost(self.name)
+        #If a critter is detected, print a message to the terminal
+        if self.last_status == pt.common.Status.SUCCESS:
+            self.my_agent.log.debug("bt_status", "BN_DetectCritter completed with SUCCESS")
+        return self.last_status
 
     def terminate(self, new_status: common.Status):
         '''
@@ -657,8 +702,8 @@ class BTCritter:
         '''
         #Set the agent
         self.aagent = aagent  
-        #Get the current time
-        current_time = time.time()
+        #Get the current time, from the clock of the agent
+        current_time = aagent.clock()
         #Create a HungryTimer object to check if the critter is hungry
         hungry_timer = HungryTimer(self.aagent, current_time)
 
@@ -698,8 +743,8 @@ class BTCritter:
         #Add the detect flower, detect astronaut, detect avoid, and roaming behaviours to the selector as children
         self.root.add_children([det_flower, det_astro, det_critter, det_avoid, roaming])
 
-        #set the behaviour tree with the root
-        self.behaviour_tree = pt.trees.BehaviourTree(self.root)
+        #set the behaviour tree with the root, ticked by the executor chosen in the agent configuration
+        self.behaviour_tree = FlatTree.create_executor(self.root, aagent.bt_executor)
 
 
 
@@ -725,6 +770,8 @@ class BTCritter:
         tick method for BTCritter, runs the behaviour tree
         '''
         #Run the behaviour tree
+        start = time.perf_counter()
         self.behaviour_tree.tick()
+        self.aagent.tick_time.observe(time.perf_counter() - start)
         #Wait for 0 seconds to allow other tasks to run
         await asyncio.sleep(0)
@@ -1,49 +1,50 @@
+import time
 import asyncio
 import random
 import py_trees
 import py_trees as pt
 from py_trees import common
 import Goals_BT
-import Sensors
+import FlatTree
 
 
 class BN_DoNothing(pt.behaviour.Behaviour):
     def __init__(self, aagent):
         self.my_agent = aagent
-        self.my_goal = None
-        print("Initializing BN_DoNothing")
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.DoNothing(aagent))
+        aagent.log.debug("bt_init", "Initializing BN_DoNothing")
         super(BN_DoNothing, self).__init__("BN_DoNothing")
 
     def initialise(self):
-        self.my_goal = asyncio.create_task(Goals_BT.DoNothing(self.my_agent).run())
+        self.my_goal.arm()
 
     def update(self):
         if not self.my_goal.done():
             return pt.common.Status.RUNNING
         else:
             if self.my_goal.result():
-                print("BN_DoNothing completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_DoNothing completed with SUCCESS")
                 return pt.common.Status.SUCCESS
             else:
-                print("BN_DoNothing completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_DoNothing completed with FAILURE")
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
-        # Finishing the behaviour, therefore we have to stop the associated task
-        self.my_goal.cancel()
+        # Finishing the behaviour, therefore we have to preempt the associated goal
+        self.my_goal.preempt()
 
 
 class BN_ForwardRandom(pt.behaviour.Behaviour):
     def __init__(self, aagent):
-        self.my_goal = None
-        print("Initializing BN_ForwardRandom")
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.ForwardDist(aagent, -1, 1, 5), "stop")
+        aagent.log.debug("bt_init", "Initializing BN_ForwardRandom")
         super(BN_ForwardRandom, self).__init__("BN_ForwardRandom")
         self.logger.debug("Initializing BN_ForwardRandom")
         self.my_agent = aagent
 
     def initialise(self):
-        self.logger.debug("Create Goals_BT.ForwardDist task")
-        self.my_goal = asyncio.create_task(Goals_BT.ForwardDist(self.my_agent, -1, 1, 5).run())
+        self.logger.debug("Arm Goals_BT.ForwardDist goal")
+        self.my_goal.arm()
 
     def update(self):
         if not self.my_goal.done():
@@ -51,28 +52,28 @@ class BN_ForwardRandom(pt.behaviour.Behaviour):
         else:
             if self.my_goal.result():
                 self.logger.debug("BN_ForwardRandom completed with SUCCESS")
-                print("BN_ForwardRandom completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_ForwardRandom completed with SUCCESS")
                 return pt.common.Status.SUCCESS
             else:
                 self.logger.debug("BN_ForwardRandom completed with FAILURE")
-                print("BN_ForwardRandom completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_ForwardRandom completed with FAILURE")
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
-        # Finishing the behaviour, therefore we have to stop the associated task
+        # Finishing the behaviour, therefore we have to preempt the associated goal
         self.logger.debug("Terminate BN_ForwardRandom")
-        self.my_goal.cancel()
+        self.my_goal.preempt()
 
 
 class BN_TurnRandom(pt.behaviour.Behaviour):
     def __init__(self, aagent):
-        self.my_goal = None
-        print("Initializing BN_TurnRandom")
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.Turn(aagent), "nt")
+        aagent.log.debug("bt_init", "Initializing BN_TurnRandom")
         super(BN_TurnRandom, self).__init__("BN_TurnRandom")
         self.my_agent = aagent
 
     def initialise(self):
-        self.my_goal = asyncio.create_task(Goals_BT.Turn(self.my_agent).run())
+        self.my_goal.arm()
 
     def update(self):
         if not self.my_goal.done():
@@ -80,50 +81,62 @@ class BN_TurnRandom(pt.behaviour.Behaviour):
         else:
             res = self.my_goal.result()
             if res:
-                print("BN_Turn completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_Turn completed with SUCCESS")
                 return pt.common.Status.SUCCESS
             else:
-                print("BN_Turn completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_Turn completed with FAILURE")
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
-        # Finishing the behaviour, therefore we have to stop the associated task
+        # Finishing the behaviour, therefore we have to preempt the associated goal
         self.logger.debug("Terminate BN_TurnRandom")
-        self.my_goal.cancel()
+        self.my_goal.preempt()
 
 
 class BN_DetectFlower(pt.behaviour.Behaviour):
     def __init__(self, aagent):
         self.my_goal = None
-        print("Initializing BN_DetectFlower")
+        aagent.log.debug("bt_init", "Initializing BN_DetectFlower")
         super(BN_DetectFlower, self).__init__("BN_DetectFlower")
         self.my_agent = aagent
+        # Sequence number of the last sensor frame checked and the status we got with it
+        self.last_frame = -1
+        self.last_status = pt.common.Status.FAILURE
 
     def initialise(self):
         pass
 
     def update(self):
-        sensor_obj_info = self.my_agent.rc_sensor.sensor_rays[Sensors.RayCastSensor.OBJECT_INFO]
-        for index, value in enumerate(sensor_obj_info):
-            if value:  # there is a hit with an object
-                if value["tag"] == "Flower":  # If it is a flower
-                    # print("Flower detected!")
-                    print("BN_DetectFlower completed with SUCCESS")
-                    return pt.common.Status.SUCCESS
+        rc_sensor = self.my_agent.rc_sensor
+        # If no new sensor frame has arrived, the result is the same as in the last update
+        if rc_sensor.frame_seq != self.last_frame:
+            self.last_frame = rc_sensor.frame_seq
+            if "Flower" in rc_sensor.tag_index:  # If a ray hits a flower
+                self.last_status = pt.common.Status.SUCCESS
+            else:
+                self.last_status = pt.common.Status.FAILURE
+        if self.last_status == pt.common.Status.SUCCESS:
+            self.my_agent.log.debug("bt_status", "BN_DetectFlower completed with SUCCESS")
         # print("No flower...")
         # print("BN_DetectFlower completed with FAILURE")
-        return pt.common.Status.FAILURE
+        return self.last_status
 
     def terminate(self, new_status: common.Status):
         pass
 
 
 class BN_DetectObstacle(pt.behaviour.Behaviour):
+    # Tags of the objects that are not obstacles
+    NOT_OBSTACLES = frozenset(("Astronaut",))
+
     def __init__(self, aagent):
         self.my_goal = None
-        print("Initializing BN_DetectObstacle")
+        aagent.log.debug("bt_init", "Initializing BN_DetectObstacle")
         super(BN_DetectObstacle, self).__init__("BN_DetectObstacle")
         self.my_agent = aagent
+        # Sequence number of the last sensor frame checked and the status we got with it
+        self.last_frame = -1
+        self.last_status = pt.common.Status.FAILURE
 
     def initialise(self):
         pass
@@ -131,28 +144,38 @@ class BN_DetectObstacle(pt.behaviour.Behaviour):
     def update(self):
         #print("inside bn detect obstacle")
         #if any(ray_hit == 1 for ray_hit in self.my_agent.rc_sensor.sensor_rays[Sensors.RayCastSensor.HIT]):
-        sensor_obj_info = self.my_agent.rc_sensor.sensor_rays[Sensors.RayCastSensor.OBJECT_INFO]
-        for index, value in enumerate(sensor_obj_info):
-            if value:  # there is a hit with an object
-                if value["tag"] != "Astronaut":
-                    print("BN_DetectObstacle completed with SUCCESS")
-                    return pt.common.Status.SUCCESS
+        rc_sensor = self.my_agent.rc_sensor
+        # If no new sensor frame has arrived, the result is the same as in the last update
+        if rc_sensor.frame_seq != self.last_frame:
+            self.last_frame = rc_sensor.frame_seq
+            # If a ray hits something that is not an astronaut
+            if not self.NOT_OBSTACLES.issuperset(rc_sensor.tag_index):
+                self.last_status = pt.common.Status.SUCCESS
+            else:
+                self.last_status = pt.common.Status.FAILURE
+            # Trace the perception-to-action latency of the detection (see Tracing.py)
+            if self.last_status == pt.common.Status.SUCCESS:
+                self.my_agent.tracer.detected(self.name, rc_sensor, "Avoid")
+            else:
+                self.my_agent.tracer.lost(self.name)
+        if self.last_status == pt.common.Status.SUCCESS:
+            self.my_agent.log.debug("bt_status", "BN_DetectObstacle completed with SUCCESS")
         # print("No obstacle...")
         # print("BN_DetectObstacle completed with FAILURE")
-        return pt.common.Status.FAILURE
+        return self.last_status
 
     def terminate(self, new_status: common.Status):
         pass
 
 class BN_Avoid(pt.behaviour.Behaviour):
     def __init__(self, aagent):
-        self.my_goal = None
-        print("Initializing BN_Avoid")
+        self.my_goal = Goals_BT.GoalRunner(aagent, Goals_BT.Avoid(aagent), "nt")
+        aagent.log.debug("bt_init", "Initializing BN_Avoid")
         super(BN_Avoid, self).__init__("BN_Avoid")
         self.my_agent = aagent
 
     def initialise(self):
-        self.my_goal = asyncio.create_task(Goals_BT.Avoid(self.my_agent).run())
+        self.my_goal.arm()
 
     def update(self):
         #print("inside bn avoid")
@@ -162,16 +185,16 @@ class BN_Avoid(pt.behaviour.Behaviour):
         else:
             res = self.my_goal.result()
             if res:
-                print("BN_Avoid completed with SUCCESS")
+                self.my_agent.log.debug("bt_status", "BN_Avoid completed with SUCCESS")
                 return pt.common.Status.SUCCESS
             else:
-                print("BN_Avoid completed with FAILURE")
+                self.my_agent.log.debug("bt_status", "BN_Avoid completed with FAILURE")
                 return pt.common.Status.FAILURE
 
     def terminate(self, new_status: common.Status):
-        # Finishing the behaviour, therefore we have to stop the associated task
+        # Finishing the behaviour, therefore we have to preempt the associated goal
         self.logger.debug("Terminate BN_Avoid")
-        self.my_goal.cancel()
+        self.my_goal.preempt()
 
 
 
@@ -201,7 +224,7 @@ class BTRoam:
         self.root = pt.composites.Selector(name="Selector", memory=False)
         self.root.add_children([detection, roaming])
 
-        self.behaviour_tree = pt.trees.BehaviourTree(self.root)
+        self.behaviour_tree = FlatTree.create_executor(self.root, aagent.bt_executor)
 
     # Function to set invalid state for a node and its children recursively
     def set_invalid_state(self, node):
@@ -214,5 +237,7 @@ class BTRoam:
         self.set_invalid_state(self.root)
 
     async def tick(self):
+        start = time.perf_counter()
         self.behaviour_tree.tick()
+        self.aagent.tick_time.observe(time.perf_counter() - start)
         await asyncio.sleep(0)
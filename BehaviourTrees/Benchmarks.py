@@ -0,0 +1,1004 @@
+import os
+import sys
+import math
+import random
+import glob
+import json
+import time
+import timeit
+import asyncio
+import resource
+import tempfile
+import subprocess
+import contextlib
+import tracemalloc
+import Codec
+import AAgent_BT
+import BTCritter
+import AgentLog
+import Goals_BT
+import Headless
+import Kinematics
+import Metrics
+import Sensors
+import Simulator
+
+
+# Directory of this file, where the agent configuration files are
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_agent(config_file="AAgent-1.json", num_rays=None, runtime=None):
+    '''
+    Description: Creates an agent from one of the configuration files, without connecting it to Unity
+    Input: config_file: name of the configuration file
+           num_rays: int, number of rays of the sensor (by default, the ones of the configuration file)
+           runtime: dict with the 'Runtime' settings of the agent (by default, the ones of the configuration file)
+    Output: agent: AAgent object
+    '''
+    with open(os.path.join(BASE_DIR, config_file), 'r') as file:
+        config = json.load(file)
+    if num_rays is not None:
+        config['AgentParameters']['ray_perception_sensor_param'] = [num_rays // 2, 90, 0, 5]
+    if runtime is not None:
+        config['Runtime'] = runtime
+    with tempfile.NamedTemporaryFile('w', suffix=".json", delete=False) as file:
+        json.dump(config, file)
+    try:
+        return AAgent_BT.AAgent(file.name)
+    finally:
+        os.remove(file.name)
+
+
+def make_sensor_frame(num_rays=11, tags=("Wall", None, "Flower", None, "Astronaut")):
+    '''
+    Description: Builds a 'sensor' message like the ones Unity sends, hitting objects with the given tags
+    Input: num_rays: int, number of rays of the sensor
+           tags: tags of the objects hit by the rays, cyclically (None means no hit)
+    Output: frame: dict with the message
+    '''
+    perception = []
+    for ray in range(num_rays):
+        tag = tags[ray % len(tags)]
+        if tag is None:
+            perception.append([ray, 0, None])
+        else:
+            perception.append([ray, 1, {"name": f"{tag}_{ray}", "tag": tag, "distance": 1.0 + ray % 4}])
+    i_state = {"isRotatingRight": False, "isRotatingLeft": False, "movingForwards": True,
+               "movingBackwards": False, "speed": 2.5,
+               "position": {"x": 12.5, "y": 0.0, "z": -3.25}, "rotation": {"x": 0.0, "y": 87.5, "z": 0.0}}
+    return {"Type": "sensor", "Content": [perception, i_state]}
+
+
+class SlowWebSocket:
+    '''
+    Description: Stand-in of the websocket of an agent connected to a slow server: every write takes 'delay'
+                 seconds, like a websocket whose socket buffers are full because the server reads one frame
+                 every 'delay' seconds
+    '''
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = 0
+        self.stops = 0
+        self.closed = False
+
+    async def send_str(self, data):
+        await asyncio.sleep(self.delay)
+        self.sent += 1
+        self.stops += data.count('"stop"')
+
+    async def send_bytes(self, data):
+        await asyncio.sleep(self.delay)
+        self.sent += 1
+
+
+class NullWebSocket:
+    '''
+    Description: Stand-in of the websocket of an agent that discards the messages sent to Unity
+    '''
+    def __init__(self):
+        self.sent = 0
+
+    async def send_str(self, data):
+        self.sent += 1
+
+    async def send_bytes(self, data):
+        self.sent += 1
+
+
+def make_running_agent(bt, num_rays=None, runtime=None, config_file="AAgent-1.json"):
+    '''
+    Description: Creates an agent ready to tick the behaviour tree 'bt', sending its actions to a NullWebSocket
+    '''
+    agent = make_agent(config_file, num_rays, runtime)
+    agent.ws = NullWebSocket()
+    agent.simulation_state = agent.RUNNING
+    agent.running_event.set()
+    agent.currentBT = bt
+    return agent
+
+
+async def cancel_pending_tasks():
+    '''
+    Description: Cancels the tasks left running by a benchmark (e.g. the goals of a behaviour tree)
+    '''
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def measure_cpu(coro, duration):
+    '''
+    Description: Runs the coroutine 'coro' during 'duration' seconds and measures the CPU it consumes
+    Input: coro: coroutine to measure, it is cancelled when the time is over
+           duration: float, seconds to run the coroutine
+    Output: cpu: float, percentage of a core used by the process while the coroutine was running
+    '''
+    task = asyncio.create_task(coro)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return 100.0 * cpu / wall
+
+
+async def legacy_spin(agent):
+    '''
+    Description: Reproduces the old main loop, that polled the simulation state with asyncio.sleep(0)
+    '''
+    while not agent.exit_event.is_set():
+        if agent.simulation_state == agent.ON_HOLD:
+            await asyncio.sleep(0)
+
+
+async def bench_idle_cpu(duration=2.0):
+    '''
+    Description: CPU used by an idle agent with the old busy loop and with the event driven main loop
+    '''
+    agent = make_agent()
+    print(f"{'scenario':<32}{'cpu (% of a core)':>20}")
+    cpu = await measure_cpu(legacy_spin(agent), duration)
+    print(f"{'legacy spin, on hold':<32}{cpu:>20.2f}")
+
+    agent = make_agent()
+    cpu = await measure_cpu(agent.main_loop(), duration)
+    print(f"{'main_loop, on hold':<32}{cpu:>20.2f}")
+
+    agent = make_agent()
+    agent.simulation_state = agent.RUNNING
+    agent.running_event.set()
+    cpu = await measure_cpu(agent.main_loop(), duration)
+    print(f"{'main_loop, running without BT':<32}{cpu:>20.2f}")
+
+
+async def bench_host_startup(num_agents=7):
+    '''
+    Description: Startup time and memory of 'num_agents' agents with one process per agent
+                 and with all of them in the same process (AgentHost.py)
+    '''
+    config_files = sorted(glob.glob(os.path.join(BASE_DIR, "AAgent-*.json")))
+    config_files = [config_files[i % len(config_files)] for i in range(num_agents)]
+
+    # One process per agent: each one starts an interpreter and imports aiohttp, py_trees...
+    start = time.perf_counter()
+    for config_file in config_files:
+        subprocess.run([sys.executable, "-c", "import sys, AAgent_BT; AAgent_BT.AAgent(sys.argv[1])", config_file],
+                       cwd=BASE_DIR, stdout=subprocess.DEVNULL, check=True)
+    per_process_time = time.perf_counter() - start
+    # Linux reports the maximum resident set size in KB
+    per_process_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    # All the agents in this process, which has already imported all the modules
+    tracemalloc.start()
+    start = time.perf_counter()
+    agents = [AAgent_BT.AAgent(config_file) for config_file in config_files]
+    host_time = time.perf_counter() - start
+    host_memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+
+    print(f"{'mode':<24}{'startup (s)':>14}{'memory/agent (MB)':>20}")
+    print(f"{'process per agent':<24}{per_process_time:>14.3f}{per_process_rss:>20.2f}")
+    print(f"{'AgentHost':<24}{host_time:>14.3f}{host_memory / len(agents):>20.2f}")
+    print(f"AgentHost process RSS with {len(agents)} agents: "
+          f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.2f} MB")
+
+
+async def bench_codecs(iterations=20000):
+    '''
+    Description: Time per sensor frame to decode it and apply it to the agent (process_incoming_message),
+                 and time to encode an action, with each of the available codecs
+    '''
+    agent = make_agent()
+    frame = make_sensor_frame()
+    action = {"type": "action", "content": "mf"}
+    print(f"{'codec':<10}{'frame bytes':>12}{'decode+apply (us)':>20}{'encode action (us)':>20}")
+    for name in Codec.CODECS:
+        agent.codec = Codec.get_codec(name)
+        data = agent.codec.encode(frame)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            agent.process_incoming_message(data)
+        decode_time = (time.perf_counter() - start) / iterations * 1e6
+        start = time.perf_counter()
+        for _ in range(iterations):
+            agent.codec.encode(action)
+        encode_time = (time.perf_counter() - start) / iterations * 1e6
+        print(f"{name:<10}{len(data):>12}{decode_time:>20.2f}{encode_time:>20.2f}")
+
+
+async def bench_mailbox(bursts=200, burst_size=20, num_rays=101):
+    '''
+    Description: Cost of receiving bursts of sensor frames, as when the agent falls behind Unity,
+                 applying all of them in order and with the mailbox mode that only applies the newest one
+    '''
+    print(f"{'mode':<12}{'time/burst (ms)':>16}{'received':>10}{'applied':>9}{'dropped':>9}{'coalesced':>11}")
+    for mailbox in (False, True):
+        agent = make_agent(num_rays=num_rays, runtime={"sensor_mailbox": mailbox})
+        data = agent.codec.encode(make_sensor_frame(num_rays))
+        start = time.perf_counter()
+        for _ in range(bursts):
+            # All the frames of the burst are read from the websocket without giving control to the event loop
+            for _ in range(burst_size):
+                if mailbox:
+                    agent.post_incoming_message(data)
+                else:
+                    agent.process_incoming_message(data)
+            await asyncio.sleep(0)
+        elapsed = (time.perf_counter() - start) / bursts * 1000
+        received = agent.sensor_frames_received if mailbox else bursts * burst_size
+        applied = agent.sensor_frames_applied if mailbox else bursts * burst_size
+        print(f"{'mailbox' if mailbox else 'in order':<12}{elapsed:>16.3f}{received:>10}{applied:>9}"
+              f"{agent.sensor_frames_dropped:>9}{agent.sensor_frames_coalesced:>11}")
+
+
+def legacy_detect(rc_sensor):
+    '''
+    Description: Detection of BTCritter before the tag index: each of the four detection nodes of the
+                 memoryless Selector rescans the object info of the rays
+    '''
+    sensor_obj_info = rc_sensor.object_info
+    for tag in ("Flower", "Astronaut", "CritterMantaRay"):
+        for index, value in enumerate(sensor_obj_info):
+            if value and value["tag"] == tag:
+                break
+    for index, value in enumerate(sensor_obj_info):
+        if value and value["tag"] != "Astronaut" and value["tag"] != "CritterMantaRay":
+            break
+
+
+def indexed_detect(rc_sensor):
+    '''
+    Description: Detection of BTCritter with the tag index of the frame
+    '''
+    tag_index = rc_sensor.tag_index
+    for tag in ("Flower", "Astronaut", "CritterMantaRay"):
+        tag in tag_index
+    not BTCritter.BN_DetectObstacle.NOT_OBSTACLES.issuperset(tag_index)
+
+
+async def bench_bt_ticks(duration=2.0, iterations=20000):
+    '''
+    Description: Ticks per second of BTCritter with 11 and 101 rays, with a new sensor frame every tick
+                 and every 10 ticks, and cost of the detection of the four detection nodes per tick,
+                 rescanning the rays and with the tag index of the frame
+    '''
+    print(f"{'rays':>5}{'ticks/s (frame/tick)':>22}{'ticks/s (frame/10 ticks)':>26}"
+          f"{'scan detect (us)':>18}{'index detect (us)':>19}")
+    for num_rays in (11, 101):
+        # Only the last ray hits something, a wall, so the critter is avoiding it
+        frame = make_sensor_frame(num_rays, tags=(None,) * (num_rays - 1) + ("Wall",))
+        results = []
+        for frames_every in (1, 10):
+            agent = make_running_agent("BTCritter", num_rays)
+            bt = agent.bts["BTCritter"]
+            ticks = 0
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                start = time.perf_counter()
+                while time.perf_counter() - start < duration:
+                    if ticks % frames_every == 0:
+                        agent.apply_message(frame)
+                    await bt.tick()
+                    ticks += 1
+                elapsed = time.perf_counter() - start
+                agent.exit_event.set()
+                await cancel_pending_tasks()
+            results.append(ticks / elapsed)
+
+        agent = make_agent(num_rays=num_rays)
+        agent.apply_message(frame)
+        times = []
+        for detect in (legacy_detect, indexed_detect):
+            def detect_new_frame():
+                # A new frame each time, so the index has to be built again
+                agent.rc_sensor.frame_seq += 1
+                detect(agent.rc_sensor)
+            times.append(min(timeit.repeat(detect_new_frame, number=iterations, repeat=7)) / iterations * 1e6)
+        print(f"{num_rays:>5}{results[0]:>22.0f}{results[1]:>26.0f}{times[0]:>18.2f}{times[1]:>19.2f}")
+
+
+async def bench_bt_executor(duration=2.0, iterations=20000):
+    '''
+    Description: Ticks per second of BTCritter and memory allocated during each tick, ticking the tree with
+                 py_trees.trees.BehaviourTree and with FlatTree.FlatBehaviourTree.
+                 The critter is avoiding a wall, so the detection nodes of the higher priority branches
+                 fail every tick and BN_Avoid keeps running (the steady state of the tree)
+    '''
+    frame = make_sensor_frame(11, tags=(None,) * 10 + ("Wall",))
+    print(f"{'executor':>10}{'ticks/s':>10}{'us/tick':>10}{'allocated bytes/tick':>22}")
+    for executor in ("py_trees", "flat"):
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            agent = make_running_agent("BTCritter", runtime={"bt_executor": executor})
+            bt = agent.bts["BTCritter"]
+            agent.apply_message(frame)
+            # The first tick starts the goal of BN_Avoid
+            await bt.tick()
+            ticks = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < duration:
+                bt.behaviour_tree.tick()
+                ticks += 1
+            elapsed = time.perf_counter() - start
+
+            # Peak of the memory allocated during each tick (temporary objects, generators...)
+            tracemalloc.start()
+            allocated = 0
+            for _ in range(iterations):
+                tracemalloc.reset_peak()
+                current = tracemalloc.get_traced_memory()[0]
+                bt.behaviour_tree.tick()
+                allocated += tracemalloc.get_traced_memory()[1] - current
+            tracemalloc.stop()
+            agent.exit_event.set()
+            await cancel_pending_tasks()
+        print(f"{executor:>10}{ticks / elapsed:>10.0f}{elapsed / ticks * 1e6:>10.2f}{allocated / iterations:>22.0f}")
+
+
+async def feed_sensor_frames(agent, frame, rate):
+    '''
+    Description: Runs the main loop of 'agent' while it receives the sensor frame 'frame' 'rate' times per second
+    '''
+    msg_data = agent.codec.encode(frame)
+    main_loop = asyncio.create_task(agent.main_loop())
+    try:
+        while True:
+            agent.process_incoming_message(msg_data)
+            await asyncio.sleep(1.0 / rate)
+    finally:
+        agent.exit_event.set()
+        await main_loop
+
+
+async def bench_tick_mode(duration=3.0, rate=20):
+    '''
+    Description: CPU, ticks and actions per second of a critter avoiding a wall, with sensor frames arriving
+                 'rate' times per second, ticking the behaviour tree continuously and in reactive mode
+    '''
+    frame = make_sensor_frame(11, tags=(None,) * 10 + ("Wall",))
+    print(f"{'tick mode':>10}{'cpu (% of a core)':>20}{'ticks/s':>10}{'actions/s':>11}{'fallback ticks':>16}")
+    for tick_mode in ("free", "reactive"):
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            agent = make_running_agent("BTCritter", runtime={"tick_mode": tick_mode})
+            cpu = await measure_cpu(feed_sensor_frames(agent, frame, rate), duration)
+            await cancel_pending_tasks()
+        print(f"{tick_mode:>10}{cpu:>20.2f}{agent.ticks / duration:>10.0f}{agent.ws.sent / duration:>11.1f}"
+              f"{agent.fallback_ticks:>16}")
+
+
+async def burst_goal(agent, burst, period, stalls):
+    '''
+    Description: Goal that sends a burst of 'burst' movement actions followed by a "stop" every 'period' seconds,
+                 and keeps in 'stalls' the time it spends sending each burst
+    '''
+    actions = ("tr", "mf", "tl", "mf")
+    while True:
+        start = time.perf_counter()
+        for i in range(burst):
+            await agent.send_message("action", actions[i % len(actions)])
+        await agent.send_message("action", "stop")
+        stalls.append(time.perf_counter() - start)
+        await asyncio.sleep(period)
+
+
+async def bench_send_queue(duration=3.0, delay=0.02, burst=8, period=0.1):
+    '''
+    Description: A goal sending bursts of actions (burst_goal(), 90 frames/s) to a slow server that reads 50
+                 frames/s (SlowWebSocket, every write takes 'delay' seconds), writing directly from the goal
+                 and through the writer task (see Outbound.py) with each overflow policy.
+                 Time the goal spends sending a burst, frames written, frames dropped and "stop" actions written
+    '''
+    configurations = [("direct", {}),
+                      ("drop_oldest", {"send_queue": 16, "send_queue_policy": "drop_oldest"}),
+                      ("drop_newest", {"send_queue": 16, "send_queue_policy": "drop_newest"}),
+                      ("block", {"send_queue": 16, "send_queue_policy": "block"})]
+    print(f"{'send path':>12}{'bursts':>8}{'burst p50 (ms)':>16}{'burst max (ms)':>16}{'written/s':>11}"
+          f"{'dropped':>9}{'stops written':>15}{'max depth':>11}")
+    for name, runtime in configurations:
+        agent = make_running_agent("BTCritter", runtime=dict(runtime, log_level="OFF"))
+        agent.ws = SlowWebSocket(delay)
+        if agent.writer is not None:
+            agent.writer.start()
+        stalls = []
+        await measure_cpu(burst_goal(agent, burst, period, stalls), duration)
+        if agent.writer is not None:
+            await agent.writer.drain(1.0)
+            await agent.writer.stop()
+            stats = agent.writer.stats()
+        else:
+            stats = {"dropped": 0, "max_depth": 0}
+        await cancel_pending_tasks()
+        stalls.sort()
+        print(f"{name:>12}{len(stalls):>8}{stalls[len(stalls) // 2] * 1e3:>16.2f}{stalls[-1] * 1e3:>16.2f}"
+              f"{agent.ws.sent / duration:>11.1f}{stats['dropped']:>9}{f'{agent.ws.stops}/{len(stalls)}':>15}"
+              f"{stats['max_depth']:>11}")
+
+
+async def legacy_goal_cycle(agent, reenter):
+    '''
+    Description: Reproduces how the behaviours ran their goals: a new goal object and task every time the behaviour
+                 is initialised, and the task cancelled when it is terminated
+    '''
+    task = asyncio.create_task(Goals_BT.Turn(agent).run())
+    await asyncio.sleep(0)
+    task.cancel()
+    if reenter:
+        task = asyncio.create_task(Goals_BT.Turn(agent).run())
+        await asyncio.sleep(0)
+        task.cancel()
+    await asyncio.sleep(0)
+
+
+async def runner_goal_cycle(runner, reenter):
+    '''
+    Description: Same as legacy_goal_cycle(), with a GoalRunner
+    '''
+    runner.arm()
+    await asyncio.sleep(0)
+    runner.preempt()
+    if reenter:
+        runner.arm()
+        await asyncio.sleep(0)
+        runner.preempt()
+    await asyncio.sleep(0)
+
+
+async def bench_goal_runner(cycles=2000, rounds=7):
+    '''
+    Description: Cost of starting and preempting the Turn goal of a behaviour, creating a new goal and task every
+                 time and with a GoalRunner: time and memory allocated per cycle and actions sent per cycle.
+                 With re-entry, the behaviour is initialised again right after being terminated, like a
+                 memoryless selector that goes back to the same branch.
+                 The time is measured without tracemalloc, after a warm-up round: median and spread (min-max) of
+                 'rounds' rounds of 'cycles' cycles, alternating both kinds of goal
+    '''
+    async def run_cycles(name, agent, runner, reenter, count):
+        start = time.perf_counter()
+        for _ in range(count):
+            if name == "legacy":
+                await legacy_goal_cycle(agent, reenter)
+            else:
+                await runner_goal_cycle(runner, reenter)
+        return (time.perf_counter() - start) / count
+
+    print(f"{'goal':>8}{'re-entry':>10}{'us/cycle p50':>14}{'min-max':>15}{'allocated bytes/cycle':>23}"
+          f"{'actions/cycle':>15}")
+    for reenter in (False, True):
+        setups = {}
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            for name in ("legacy", "runner"):
+                agent = make_running_agent("BTCritter", runtime={"log_level": "OFF"})
+                agent.apply_message(make_sensor_frame())
+                setups[name] = (agent, Goals_BT.GoalRunner(agent, Goals_BT.Turn(agent), "nt"))
+            # Warm-up, then the rounds of both kinds of goal one after the other
+            for name, (agent, runner) in setups.items():
+                await run_cycles(name, agent, runner, reenter, cycles)
+            times = {name: [] for name in setups}
+            sent = {}
+            for _ in range(rounds):
+                for name, (agent, runner) in setups.items():
+                    times[name].append(await run_cycles(name, agent, runner, reenter, cycles))
+            allocated = {}
+            for name, (agent, runner) in setups.items():
+                sent_before = agent.ws.sent
+                tracemalloc.start()
+                total = 0
+                for _ in range(cycles):
+                    tracemalloc.reset_peak()
+                    current = tracemalloc.get_traced_memory()[0]
+                    await run_cycles(name, agent, runner, reenter, 1)
+                    total += tracemalloc.get_traced_memory()[1] - current
+                tracemalloc.stop()
+                allocated[name] = total / cycles
+                sent[name] = (agent.ws.sent - sent_before) / cycles
+                agent.exit_event.set()
+            await cancel_pending_tasks()
+        for name in setups:
+            round_times = sorted(times[name])
+            spread = f"{round_times[0] * 1e6:.1f}-{round_times[-1] * 1e6:.1f}"
+            print(f"{name:>8}{str(reenter):>10}{round_times[len(round_times) // 2] * 1e6:>14.1f}{spread:>15}"
+                  f"{allocated[name]:>23.0f}{sent[name]:>15.2f}")
+
+
+def make_world(num_agents, batch_rays=True, seed=0):
+    '''
+    Description: Creates a World with 'num_agents' critters with 11 rays of length 5, in a square arena whose size
+                 grows with the number of agents (about 16 square units per agent), with flowers and astronauts
+    '''
+    rng = random.Random(seed)
+    half = math.sqrt(16 * num_agents) / 2
+
+    def point():
+        return [rng.uniform(-half, half), rng.uniform(-half, half)]
+
+    scene = {
+        "walls": [{"from": [-half, -half], "to": [half, -half]}, {"from": [half, -half], "to": [half, half]},
+                  {"from": [half, half], "to": [-half, half]}, {"from": [-half, half], "to": [-half, -half]}],
+        "flowers": [{"position": point(), "radius": 0.3} for _ in range(num_agents // 2 + 1)],
+        "astronauts": [{"position": point()} for _ in range(num_agents // 10 + 1)],
+        "spawn_points": [point() + [rng.uniform(0, 360)] for _ in range(num_agents)],
+        "physics": {"spawn_jitter": 0.0},
+    }
+    world = Simulator.World(scene, seed, batch_rays)
+    for i in range(num_agents):
+        world.add_body({"name": f"Critter_{i}", "type": "AAgentCritterMantaRay", "spawn_point": i,
+                        "ray_perception_sensor_param": [5, 90, 0, 5]})
+    return world
+
+
+async def bench_ray_caster(min_time=1.0):
+    '''
+    Description: Time to cast the rays of all the agents of a world (one sensor step) with 10, 100 and 1000 agents,
+                 one ray at a time in Python (World.cast_rays) and with RayCaster.BatchRayCaster
+    '''
+    print(f"{'agents':>7}{'python (ms/step)':>18}{'batch (ms/step)':>17}{'speedup':>9}{'batch rays/s':>14}")
+    for num_agents in (10, 100, 1000):
+        times = []
+        for batch_rays in (False, True):
+            world = make_world(num_agents, batch_rays)
+            steps = 0
+            start = time.perf_counter()
+            while steps == 0 or time.perf_counter() - start < min_time:
+                world.perceive_all(world.bodies)
+                steps += 1
+            times.append((time.perf_counter() - start) / steps)
+        print(f"{num_agents:>7}{times[0] * 1e3:>18.2f}{times[1] * 1e3:>17.2f}{times[0] / times[1]:>9.1f}"
+              f"{num_agents * 11 / times[1]:>14.0f}")
+
+
+async def bench_metrics(iterations=10000, rounds=5):
+    '''
+    Description: Cost of the instrumentation (see Metrics.py): time to receive a sensor frame and tick BTCritter,
+                 with the metrics switched off and on (best of 'rounds' alternated rounds), and the cost of
+                 observing a value in a histogram
+    '''
+    frame = make_sensor_frame(11, tags=(None,) * 10 + ("Wall",))
+    best = {False: math.inf, True: math.inf}
+    for _ in range(rounds):
+        for enabled in (False, True):
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                agent = make_running_agent("BTCritter", runtime={"bt_executor": "flat", "metrics": enabled})
+                bt = agent.bts["BTCritter"]
+                msg_data = agent.codec.encode(frame)
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    agent.process_incoming_message(msg_data)
+                    await bt.tick()
+                best[enabled] = min(best[enabled], time.perf_counter() - start)
+                agent.exit_event.set()
+                await cancel_pending_tasks()
+    print(f"{'metrics':>8}{'us/frame+tick':>15}")
+    for enabled in (False, True):
+        print(f"{'on' if enabled else 'off':>8}{best[enabled] / iterations * 1e6:>15.2f}")
+    print(f"overhead: {100 * (best[True] / best[False] - 1):.1f}%")
+    histogram = Metrics.Histogram("bench_seconds", "", {})
+    elapsed = min(timeit.repeat(lambda: histogram.observe(1.5e-5), number=100000, repeat=5)) / 100000
+    print(f"Histogram.observe(): {elapsed * 1e9:.0f} ns")
+
+
+def run_headless_quietly(*args, **kwargs):
+    with contextlib.redirect_stdout(None):
+        return Headless.run_headless(*args, **kwargs)
+
+
+async def bench_headless(duration=600.0):
+    '''
+    Description: Simulated seconds per second of wall time of BTCritter in the headless world (see Headless.py),
+                 with one and two critters, in free and reactive tick mode
+    '''
+    scene = os.path.join(BASE_DIR, "Scene-1.json")
+    print(f"{'critters':>9}{'tick mode':>11}{'wall (s)':>10}{'speedup':>9}{'ticks/s':>10}{'distance':>10}")
+    for config_files in (["AAgent-1.json"], ["AAgent-1.json", "AAgent-3.json"]):
+        config_paths = [os.path.join(BASE_DIR, config_file) for config_file in config_files]
+        for tick_mode in ("free", "reactive"):
+            start = time.perf_counter()
+            # The headless run has its own event loop, so it runs in another thread
+            world, agents, bodies = await asyncio.to_thread(
+                run_headless_quietly, scene, config_paths, duration, "bt:BTCritter", 0,
+                runtime={"tick_mode": tick_mode, "bt_executor": "flat"})
+            elapsed = time.perf_counter() - start
+            ticks = sum(agent.ticks for agent in agents)
+            distance = sum(body.distance_travelled for body in bodies)
+            print(f"{len(agents):>9}{tick_mode:>11}{elapsed:>10.1f}{world.time / elapsed:>9.0f}"
+                  f"{ticks / world.time:>10.0f}{distance:>10.1f}")
+
+
+async def bench_logging(duration=120.0):
+    '''
+    Description: Ticks per second of wall time of two critters in the headless world, in free tick mode (a tick
+                 every iteration of the event loop), with the logging off (level INFO, the default) and with
+                 DEBUG records every tick: written synchronously without limits (like the old print() calls),
+                 through the background thread without limits, and through the background thread rate limited
+    '''
+    scene = os.path.join(BASE_DIR, "Scene-1.json")
+    config_paths = [os.path.join(BASE_DIR, config_file) for config_file in ("AAgent-1.json", "AAgent-3.json")]
+    configurations = [("off", {"log_level": "INFO"}),
+                      ("sync, no limit", {"log_level": "DEBUG", "log_queue": False, "log_rate": 0}),
+                      ("queue, no limit", {"log_level": "DEBUG", "log_rate": 0}),
+                      ("queue, rate limit", {"log_level": "DEBUG"})]
+    print(f"{'logging':>18}{'wall (s)':>10}{'ticks/s':>10}{'lines':>9}{'suppressed':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, settings in configurations:
+            log_file = os.path.join(directory, name.replace(", ", "_") + ".log")
+            # The output of the process is configured by the first agent created after shutdown()
+            AgentLog.shutdown()
+            start = time.perf_counter()
+            world, agents, bodies = await asyncio.to_thread(
+                run_headless_quietly, scene, config_paths, duration, "bt:BTCritter", 0,
+                runtime=dict(settings, tick_mode="free", bt_executor="flat", log_file=log_file))
+            AgentLog.shutdown()
+            elapsed = time.perf_counter() - start
+            with open(log_file) as file:
+                lines = sum(1 for _ in file)
+            ticks = sum(agent.ticks for agent in agents)
+            suppressed = sum(agent.log.records_suppressed for agent in agents)
+            print(f"{name:>18}{elapsed:>10.1f}{ticks / elapsed:>10.0f}{lines:>9}{suppressed:>12}")
+
+
+async def bench_action_batching(duration=600.0, seeds=5):
+    '''
+    Description: Actions and frames sent by a critter in the headless world, with and without the batching
+                 of the actions (see Outbound.py). The batched runs also count what they saved: the actions
+                 coalesced and deduplicated, the frames and the bytes, with respect to sending every action
+                 in its own frame. (With two critters the runs depend on how they meet, so one is used)
+    '''
+    scene = os.path.join(BASE_DIR, "Scene-1.json")
+    config_paths = [os.path.join(BASE_DIR, "AAgent-1.json")]
+    print(f"{'batching':>9}{'actions':>9}{'frames':>8}{'coalesced':>11}{'dedup':>7}{'bytes saved':>13}"
+          f"{'frames/action':>15}{'distance':>10}")
+    for batching in (False, True):
+        totals = dict.fromkeys(["actions", "frames", "coalesced", "deduplicated", "bytes_saved", "distance"], 0)
+        for seed in range(seeds):
+            world, agents, bodies = await asyncio.to_thread(
+                run_headless_quietly, scene, config_paths, duration, "bt:BTCritter", seed,
+                runtime={"tick_mode": "reactive", "bt_executor": "flat", "action_batching": batching})
+            totals["distance"] += sum(body.distance_travelled for body in bodies)
+            for agent in agents:
+                totals["actions"] += agent.actions_sent
+                # Only actions are sent once the agent is connected, the initial parameters are not counted
+                totals["frames"] += agent.messages_sent - 1
+                if agent.action_batcher is not None:
+                    stats = agent.action_batcher.stats()
+                    for key in ("coalesced", "deduplicated", "bytes_saved"):
+                        totals[key] += stats[key]
+        print(f"{'on' if batching else 'off':>9}{totals['actions']:>9}{totals['frames']:>8}{totals['coalesced']:>11}"
+              f"{totals['deduplicated']:>7}{totals['bytes_saved']:>13}"
+              f"{totals['frames'] / max(totals['actions'], 1):>15.2f}{totals['distance']:>10.0f}")
+
+
+class LegacyInternalState:
+    '''
+    Description: InternalState before it was updated in place: the dictionaries of the frame are kept
+    '''
+    def __init__(self):
+        self.isRotatingRight = False
+        self.isRotatingLeft = False
+        self.movingForwards = False
+        self.movingBackwards = False
+        self.speed = 0.0
+        self.position = {"x": 0, "y": 0, "z": 0}
+        self.rotation = {"x": 0, "y": 0, "z": 0}
+
+    def set_internal_state(self, i_state_dict):
+        self.isRotatingRight = i_state_dict["isRotatingRight"]
+        self.isRotatingLeft = i_state_dict["isRotatingLeft"]
+        self.movingForwards = i_state_dict["movingForwards"]
+        self.movingBackwards = i_state_dict["movingBackwards"]
+        self.speed = i_state_dict["speed"]
+        self.position = i_state_dict["position"]
+        self.rotation = i_state_dict["rotation"]
+
+
+def legacy_turned(prev_rotation, current_rotation):
+    '''
+    Description: Degrees turned to the right, like the goals computed it before InternalState.yaw_delta()
+    '''
+    if prev_rotation > current_rotation:
+        return 360 - prev_rotation + current_rotation
+    return current_rotation - prev_rotation
+
+
+async def bench_internal_state(number=200000):
+    '''
+    Description: Cost of the internal state of the agent: applying the internal state of a sensor frame, keeping
+                 the dictionaries of the frame (legacy, and the slotted InternalState, that derives the position,
+                 the velocities and the dirty flags when they are first read), applying it and reading the
+                 position, and the checks of the goals on each poll: distance to the starting position of
+                 ForwardDist and degrees turned of Turn. Memory of each state object
+    '''
+    frames = []
+    for i in range(100):
+        frame = make_sensor_frame()["Content"][1]
+        frame["position"] = {"x": i * 0.1, "y": 0.0, "z": 5.0 - i * 0.05}
+        frame["rotation"] = {"x": 0.0, "y": (i * 7.0) % 360, "z": 0.0}
+        frames.append(frame)
+    legacy = LegacyInternalState()
+    clock = iter(range(10 ** 9)).__next__
+    slotted = AAgent_BT.InternalState(clock)
+    start_dict = {"x": 0.0, "y": 0.0, "z": 0.0}
+    start_vec = Kinematics.Vec3()
+    results = {}
+    for name, state in (("legacy", legacy), ("slotted", slotted)):
+        apply = min(timeit.repeat(lambda: [state.set_internal_state(frame) for frame in frames],
+                                  number=number // 1000, repeat=5)) / (number // 10)
+        read = min(timeit.repeat(lambda: [(state.set_internal_state(frame), state.position["x"]) for frame in frames],
+                                 number=number // 1000, repeat=5)) / (number // 10)
+        results[name] = [apply, read]
+    legacy.set_internal_state(frames[-1])
+    slotted.set_internal_state(frames[-1])
+    results["legacy"].append(min(timeit.repeat(
+        lambda: Goals_BT.calculate_distance(start_dict, legacy.position) >= 5, number=number, repeat=5)) / number)
+    results["slotted"].append(min(timeit.repeat(
+        lambda: slotted.position.dist2(start_vec) >= 25, number=number, repeat=5)) / number)
+    results["legacy"].append(min(timeit.repeat(
+        lambda: legacy_turned(350.0, legacy.rotation["y"]), number=number, repeat=5)) / number)
+    results["slotted"].append(min(timeit.repeat(
+        lambda: slotted.yaw_delta(350.0), number=number, repeat=5)) / number)
+    results["legacy"].append(sys.getsizeof(legacy) + sys.getsizeof(legacy.__dict__) +
+                             sys.getsizeof(legacy.position) + sys.getsizeof(legacy.rotation))
+    results["slotted"].append(sys.getsizeof(slotted) + 4 * sys.getsizeof(slotted.position))
+    print(f"{'state':>8}{'apply frame (ns)':>18}{'apply + read (ns)':>19}{'distance check (ns)':>21}"
+          f"{'turned (ns)':>13}{'bytes':>7}")
+    for name, (apply, read, distance, turned, size) in results.items():
+        print(f"{name:>8}{apply * 1e9:>18.0f}{read * 1e9:>19.0f}{distance * 1e9:>21.0f}{turned * 1e9:>13.0f}"
+              f"{size:>7}")
+
+
+async def feed_frames(agent, rate, applied):
+    '''
+    Description: Applies 'rate' sensor frames per second to 'agent', moving it forward 0.1 units every frame.
+                 applied[0] is the perf_counter() of the last frame applied
+    '''
+    frame = make_sensor_frame()
+    x = 0.0
+    while True:
+        await asyncio.sleep(1.0 / rate)
+        # (a new internal state every frame, like the decoded messages: the agent keeps the last two)
+        x += 0.1
+        frame["Content"][1] = dict(frame["Content"][1], position={"x": x, "y": 0.0, "z": 0.0})
+        agent.apply_message(frame)
+        applied[0] = time.perf_counter()
+
+
+async def distance_goal(agent, mode, distance, stats, applied):
+    '''
+    Description: Goal that waits till the agent has moved 'distance' units, over and over, like ForwardDist:
+                 polling the position with asyncio.sleep(0) or asyncio.sleep(0.1), or with agent.wait_until().
+                 stats: [checks of the position, reaction latencies (s)]
+    '''
+    target = distance * distance
+    while True:
+        start = agent.i_state.position.copy()
+
+        def arrived():
+            stats[0] += 1
+            return agent.i_state.position.dist2(start) >= target
+        if mode == "wait_until":
+            await agent.wait_until(arrived)
+        else:
+            delay = 0 if mode == "sleep(0)" else 0.1
+            while not arrived():
+                await asyncio.sleep(delay)
+        stats[1].append(time.perf_counter() - applied[0])
+
+
+async def bench_frame_waits(duration=3.0, rate=20.0, distance=1.0):
+    '''
+    Description: Goals waiting till the agent has moved a distance, with 20 sensor frames/s: polling the state
+                 with asyncio.sleep(0) (ForwardDist, Turn) or asyncio.sleep(0.1) (Avoid), or waiting for the
+                 frames with agent.wait_until(). CPU used, checks of the state per second and latency from the
+                 frame that completes the distance to the reaction of the goal, with 1 and 10 goals waiting
+    '''
+    print(f"{'wait':>11}{'goals':>7}{'cpu (%)':>9}{'checks/s':>10}{'reactions':>11}{'latency p50 (ms)':>18}"
+          f"{'latency max (ms)':>18}")
+    for goals in (1, 10):
+        for mode in ("sleep(0)", "sleep(0.1)", "wait_until"):
+            agent = make_running_agent("BTCritter", runtime={"log_level": "OFF"})
+            applied = [time.perf_counter()]
+            stats = [[0, []] for _ in range(goals)]
+
+            async def run():
+                await asyncio.gather(feed_frames(agent, rate, applied),
+                                     *(distance_goal(agent, mode, distance, goal_stats, applied)
+                                       for goal_stats in stats))
+            cpu = await measure_cpu(run(), duration)
+            await cancel_pending_tasks()
+            checks = sum(goal_stats[0] for goal_stats in stats)
+            latencies = sorted(latency for goal_stats in stats for latency in goal_stats[1])
+            # No reaction when the agent did not move the distance while polling, e.g. a short duration
+            p50 = f"{latencies[len(latencies) // 2] * 1e3:.2f}" if latencies else "-"
+            latency_max = f"{latencies[-1] * 1e3:.2f}" if latencies else "-"
+            print(f"{mode:>11}{goals:>7}{cpu:>9.1f}{checks / duration:>10.0f}{len(latencies):>11}"
+                  f"{p50:>18}{latency_max:>18}")
+
+
+async def bench_reconnect(duration=90.0, start=30.0, outages=(1.0, 5.0, 20.0)):
+    '''
+    Description: A fleet of critters in the headless world with "reconnect" on, and an outage of the Simulator
+                 (all the agents disconnected and no connections accepted) of each length: time to recover
+                 (from losing the connection to having it ready again), attempts to reconnect per agent, and
+                 agents that came back with their behaviour tree (and its timers) and kept ticking it
+    '''
+    scene = os.path.join(BASE_DIR, "Scene-1.json")
+    config_paths = [os.path.join(BASE_DIR, f"AAgent-{i}.json") for i in (1, 3, 4, 5, 6, 7)]
+    print(f"{'outage (s)':>11}{'agents':>8}{'recovered':>11}{'recover p50 (s)':>17}{'recover max (s)':>17}"
+          f"{'attempts/agent':>16}{'BT kept':>9}")
+    for outage in outages:
+        world, agents, bodies = await asyncio.to_thread(
+            run_headless_quietly, scene, config_paths, duration, "bt:BTCritter", 0,
+            runtime={"tick_mode": "reactive", "bt_executor": "flat", "reconnect": True, "log_level": "OFF"},
+            outages=[(start, outage)])
+        recover_times = sorted(time for agent in agents for time in agent.recover_times)
+        attempts = sum(agent.reconnect_attempts for agent in agents)
+        kept = sum(1 for agent in agents if agent.reconnects and agent.currentBT == "BTCritter")
+        p50 = recover_times[len(recover_times) // 2] if recover_times else float("nan")
+        worst = recover_times[-1] if recover_times else float("nan")
+        print(f"{outage:>11.0f}{len(agents):>8}{len(recover_times):>11}{p50:>17.2f}{worst:>17.2f}"
+              f"{attempts / max(len(agents), 1):>16.1f}{kept:>9}")
+
+
+async def stop_script(agents, moves=40, pause=0.5):
+    '''
+    Description: Runs ForwardDist (1 to 5 units) and Turn (10 to 90 degrees) on the agent, one after the other,
+                 'moves' times each, pausing 'pause' seconds after each of them so the stops can be measured
+    '''
+    agent = agents[0]
+    await agent.wait_until(lambda: agent.i_state.frame_id > 0, 10.0)
+    for _ in range(moves):
+        await Goals_BT.ForwardDist(agent, agent.random.uniform(1, 5), 1, 5).run()
+        await asyncio.sleep(pause)
+        await Goals_BT.Turn(agent).run()
+        await asyncio.sleep(pause)
+
+
+async def bench_predictive_stop(moves=40, latencies=(0.0, 0.05, 0.1)):
+    '''
+    Description: ForwardDist and Turn in an empty headless world, with the network latency of each of
+                 'latencies' (each way), stopping at the target or with the predictive stop (see Control.py):
+                 signed and absolute errors of the stops (units and degrees beyond the target), leads learnt
+                 (move/turn) and stops measured
+    '''
+    config_path = os.path.join(BASE_DIR, "AAgent-1.json")
+    print(f"{'latency (ms)':>13}{'predictive':>12}{'move mean':>11}{'move p50':>10}{'move max':>10}"
+          f"{'turn mean':>11}{'turn p50':>10}{'turn max':>10}{'leads (ms)':>12}{'stops':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        scene = os.path.join(directory, "Empty.json")
+        with open(scene, "w") as file:
+            json.dump({"spawn_points": [[0.0, 0.0, 0.0]]}, file)
+        for latency in latencies:
+            for predictive in (False, True):
+                world, agents, bodies = await asyncio.to_thread(
+                    run_headless_quietly, scene, [config_path], moves * 30.0, None, 0,
+                    runtime={"predictive_stop": predictive, "log_level": "OFF"}, latency=latency,
+                    script=lambda agents: stop_script(agents, moves))
+                move = agents[0].stop_predictors["move"].stats()
+                turn = agents[0].stop_predictors["turn"].stats()
+                print(f"{latency * 1e3:>13.0f}{str(predictive):>12}{move['mean']:>+11.3f}{move['p50']:>10.3f}"
+                      f"{move['max']:>10.3f}{turn['mean']:>+11.2f}{turn['p50']:>10.2f}{turn['max']:>10.2f}"
+                      f"{move['lead'] * 1e3:>6.0f}/{turn['lead'] * 1e3:<5.0f}{move['stops'] + turn['stops']:>7}")
+
+
+def legacy_avoid_turn(rc_sensor):
+    '''
+    Description: Turn of Avoid before the geometry of the sensor: the left side is hardcoded as rays 0-4
+    '''
+    if rc_sensor.any_hit(slice(None, 5)):
+        return 1
+    return -1 if rc_sensor.any_hit(slice(5, None)) else 0
+
+
+def legacy_follow_angle(ray):
+    '''
+    Description: Degrees FollowAstronaut turned before the geometry of the sensor, for the ray hitting the astronaut
+    '''
+    if ray < 5:
+        return -90 + ray * (90 / 5)
+    return ray * (90 / 5) if ray > 5 else 0
+
+
+def random_perception(rng, num_rays):
+    '''
+    Description: Perception of a frame where each ray hits a wall or an astronaut at a random distance, or nothing
+    '''
+    perception = []
+    for ray in range(num_rays):
+        tag = rng.choice(("Wall", "Astronaut", None, None, None))
+        perception.append([ray, 0, None] if tag is None else
+                          [ray, 1, {"name": f"{tag}_{ray}", "tag": tag, "distance": rng.uniform(0.5, 5.0)}])
+    return perception
+
+
+async def bench_ray_geometry(frames=20000):
+    '''
+    Description: Avoid and FollowAstronaut with the sensors of AAgent-1.json (11 rays, 90 degrees) and AAgent-3.json
+                 (3 rays, 15 degrees), over random frames, with hardcoded ray indices (legacy) and with the geometry
+                 of the sensor: turns of Avoid towards the side that hits something when only one side does (by
+                 the angles of the rays), mean error of the degrees FollowAstronaut turns with the legacy formula,
+                 and cost of steering() per frame (tag index of the frame included)
+    '''
+    rng = random.Random(0)
+    print(f"{'sensor':>14}{'one side hit':>14}{'wrong turns (legacy)':>22}{'wrong turns':>13}"
+          f"{'follow error (legacy)':>23}{'steering() (us)':>17}")
+    for config in ([5, 90, 0, 5], [1, 15, 0, 5]):
+        rc_sensor = Sensors.RayCastSensor(config)
+        perceptions = [random_perception(rng, rc_sensor.num_rays) for _ in range(frames)]
+        one_side = 0
+        wrong = [0, 0]
+        error = 0.0
+        follows = 0
+        for perception in perceptions:
+            rc_sensor.set_perception(perception)
+            left, right = rc_sensor.hit[rc_sensor.angle < 0].any(), rc_sensor.hit[rc_sensor.angle > 0].any()
+            if left != right:
+                one_side += 1
+                turn = 1 if left else -1
+                wrong[0] += legacy_avoid_turn(rc_sensor) != turn
+                # The turn of Avoid with the sides of the sensor (see Goals_BT.Avoid)
+                wrong[1] += (1 if rc_sensor.any_hit(rc_sensor.left) else -1) != turn
+            astronaut = rc_sensor.tag_index.get("Astronaut")
+            if astronaut and rc_sensor.num_rays == 11:
+                # Legacy: the first ray hitting an astronaut (see BTCritter.BN_DetectAstro)
+                follows += 1
+                error += abs(legacy_follow_angle(astronaut.rays[0]) - rc_sensor.angles[astronaut.rays[0]])
+        start = time.perf_counter()
+        for _ in perceptions:
+            rc_sensor.frame_seq += 1
+            rc_sensor.steering("Astronaut")
+        elapsed = (time.perf_counter() - start) / frames
+        follow_error = f"{error / follows:.1f}" if follows else "-"
+        print(f"{str(config):>14}{one_side:>14}{wrong[0] / one_side * 100:>21.1f}%{wrong[1] / one_side * 100:>12.1f}%"
+              f"{follow_error:>23}{elapsed * 1e6:>17.2f}")
+
+BENCHMARKS = {
+    "idle_cpu": bench_idle_cpu,
+    "host_startup": bench_host_startup,
+    "codecs": bench_codecs,
+    "mailbox": bench_mailbox,
+    "bt_ticks": bench_bt_ticks,
+    "bt_executor": bench_bt_executor,
+    "tick_mode": bench_tick_mode,
+    "goal_runner": bench_goal_runner,
+    "ray_caster": bench_ray_caster,
+    "headless": bench_headless,
+    "metrics": bench_metrics,
+    "logging": bench_logging,
+    "action_batching": bench_action_batching,
+    "send_queue": bench_send_queue,
+    "reconnect": bench_reconnect,
+    "internal_state": bench_internal_state,
+    "frame_waits": bench_frame_waits,
+    "predictive_stop": bench_predictive_stop,
+    "ray_geometry": bench_ray_geometry,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: python Benchmarks.py <" + " | ".join(BENCHMARKS) + ">")
+    else:
+        asyncio.run(BENCHMARKS[sys.argv[1]]())
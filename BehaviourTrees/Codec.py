@@ -0,0 +1,127 @@
+import json
+
+# Faster encoders/decoders are used when they are installed, but none of them is required
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonCodec:
+    '''
+    Description: Encodes and decodes the messages exchanged with Unity using the json module
+                 of the standard library. The messages are sent as websocket TEXT frames.
+                 The decoding errors of all the codecs are subclasses of ValueError.
+    '''
+    name = "json"
+    # True if the messages have to be sent as BINARY frames
+    binary = False
+
+    def encode(self, msg: dict):
+        return json.dumps(msg)
+
+    def decode(self, data):
+        return json.loads(data)
+
+    def peek(self, data):
+        '''
+        Gets the type of a message without decoding all of it when possible.
+        Unity puts the key "Type" at the beginning of the message, so we only look for it there.
+        :param data: Message, str (TEXT frames) or bytes (BINARY frames)
+        :return: (msg_type, msg_dict) where msg_dict is the decoded message, or None if it was not decoded
+        '''
+        if isinstance(data, str):
+            start = data.find('"Type"', 0, 32)
+            if start >= 0:
+                start = data.find('"', data.index(':', start + 6)) + 1
+                end = data.find('"', start)
+                if 0 < start < end:
+                    return data[start:end], None
+        elif isinstance(data, (bytes, bytearray)):
+            start = data.find(b'"Type"', 0, 32)
+            if start >= 0:
+                start = data.find(b'"', data.index(b':', start + 6)) + 1
+                end = data.find(b'"', start)
+                if 0 < start < end:
+                    return data[start:end].decode(), None
+        msg_dict = self.decode(data)
+        return msg_dict["Type"], msg_dict
+
+
+class UjsonCodec(JsonCodec):
+    '''
+    Description: JSON codec using ujson
+    '''
+    name = "ujson"
+
+    def encode(self, msg: dict):
+        return ujson.dumps(msg)
+
+    def decode(self, data):
+        return ujson.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    '''
+    Description: JSON codec using orjson
+    '''
+    name = "orjson"
+
+    def encode(self, msg: dict):
+        # orjson produces bytes, but TEXT frames need a str
+        return orjson.dumps(msg).decode()
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec(JsonCodec):
+    '''
+    Description: Compact binary codec using msgpack, sent as websocket BINARY frames.
+                 Unity does not speak it, only the local stand-in of Unity.
+    '''
+    name = "msgpack"
+    binary = True
+
+    def encode(self, msg: dict):
+        return msgpack.packb(msg)
+
+    def decode(self, data):
+        return msgpack.unpackb(data)
+
+    def peek(self, data):
+        # Decoding msgpack is cheap, so we decode the whole message and keep it
+        msg_dict = self.decode(data)
+        return msg_dict["Type"], msg_dict
+
+
+# Available codecs. The JSON ones are ordered from the fastest to the slowest
+CODECS = {}
+if orjson:
+    CODECS[OrjsonCodec.name] = OrjsonCodec
+if ujson:
+    CODECS[UjsonCodec.name] = UjsonCodec
+CODECS[JsonCodec.name] = JsonCodec
+if msgpack:
+    CODECS[MsgpackCodec.name] = MsgpackCodec
+
+
+def get_codec(name=None):
+    '''
+    Description: Returns the codec called 'name', or the fastest JSON codec available if 'name' is None
+    Input: name: "json" | "ujson" | "orjson" | "msgpack" | None
+    Output: codec object
+    '''
+    if name is None:
+        return next(codec for codec in CODECS.values() if not codec.binary)()
+    if name not in CODECS:
+        raise ValueError(f"Codec {name} is not available. Available codecs: {', '.join(CODECS)}")
+    return CODECS[name]()
@@ -0,0 +1,119 @@
+import asyncio
+import collections
+import Metrics
+
+# Actions that start the movement of each StopPredictor (see AAgent.send_message())
+START_ACTIONS = {"move": ("mf", "W"), "turn": ("tr", "tl", "D", "A")}
+
+
+class StopPredictor:
+    '''
+    Description: Stop of a movement towards a target: a distance (ForwardDist) or an angle (Turn).
+                 The goals check the target once per sensor frame, so a stop sent when the target has been reached
+                 lands after it: on average half a frame period, plus the time the stop takes to act (the lead:
+                 network, and physics step of the server), at the velocity of the agent.
+                 With 'predictive' (Runtime setting "predictive_stop") the velocity is extrapolated, and the stop is
+                 sent at the frame whose predicted landing point is the closest to the target. The lead is learnt
+                 from the movement done after every stop. In both modes the error of every stop is measured
+    '''
+    def __init__(self, name, predictive=False, lead=0.05, alpha=0.2, metrics: Metrics.Registry = None,
+                 max_samples=1024):
+        '''
+        init method for StopPredictor
+        Input: name: str, name of the movement ("move" | "turn"), label of its metrics
+               predictive: bool, send the stop before reaching the target
+               lead: float, seconds from sending the stop till the movement ends, till it is learnt
+               alpha: float, weight of every new measurement of the lead (exponential moving average)
+               metrics: Metrics.Registry where the errors are exported
+               max_samples: int, number of the latest errors kept for stats()
+        '''
+        self.name = name
+        self.predictive = predictive
+        self.lead = lead
+        self.alpha = alpha
+        # Signed errors of the latest stops: distance (or degrees) beyond the target, negative if short of it
+        self.errors = collections.deque(maxlen=max_samples)
+        self.stops = 0
+        self.early_stops = 0
+        self.interrupted = 0
+        # Task measuring the last stop, till the movement ends
+        self.watching = None
+        metrics = metrics if metrics is not None else Metrics.Registry(False)
+        self.error_histogram = metrics.histogram("aagent_stop_error", "Distance (or degrees) between the target "
+                                                 "of a movement and where it stopped",
+                                                 Metrics.exponential_buckets(0.01, 2, 14), movement=name)
+
+    def should_stop(self, remaining, velocity, period):
+        '''
+        Input: remaining: distance (or degrees) left to the target
+               velocity: velocity towards the target, per second
+               period: seconds till the next sensor frame
+        Output: True if the stop has to be sent now
+        '''
+        if remaining <= 0:
+            return True
+        if not self.predictive or velocity <= 0:
+            return False
+        # What would be left to the target stopping now, and stopping at the next frame (negative: beyond it)
+        now = remaining - velocity * self.lead
+        later = now - velocity * period
+        if abs(now) <= abs(later):
+            self.early_stops += 1
+            return True
+        return False
+
+    def stopped(self, remaining, velocity, final_remaining):
+        '''
+        Records a stop, once the movement has ended
+        Input: remaining: distance (or degrees) left to the target when the stop was sent
+               velocity: velocity towards the target when the stop was sent
+               final_remaining: distance (or degrees) left to the target when the movement ended
+        '''
+        error = -final_remaining
+        self.stops += 1
+        self.errors.append(error)
+        self.error_histogram.observe(abs(error))
+        if velocity > 0:
+            # Seconds the movement went on after the stop
+            lead = min(max((remaining - final_remaining) / velocity, 0.0), 1.0)
+            self.lead += self.alpha * (lead - self.lead)
+
+    def watch(self, agent, remaining, velocity, left, moving, timeout=1.0):
+        '''
+        Measures the stop just sent in the background: waits for the first sensor frame where the movement has
+        ended and records it. Another movement may start right after the stop, so the measure does not wait for
+        the agent to be still, only for that movement to end
+        Input: agent: the agent that sent the stop
+               remaining, velocity: see stopped()
+               left: function that returns the distance (or degrees) left to the target
+               moving: function that returns True while the movement goes on
+               timeout: seconds till giving up, if the movement does not end
+        '''
+        async def measure():
+            if await agent.wait_until(lambda: not moving(), timeout):
+                self.stopped(remaining, velocity, left())
+        self.moved()
+        self.watching = asyncio.create_task(measure())
+        return self.watching
+
+    def moved(self):
+        '''
+        A new movement has been sent: if the last stop is still being measured, it is dropped (the agent has not
+        stopped, and where it would have stopped is not known)
+        '''
+        if self.watching is not None and not self.watching.done():
+            self.watching.cancel()
+            self.interrupted += 1
+        self.watching = None
+
+    def stats(self):
+        '''
+        Output: dict with the number of stops measured, the ones sent before the target, the ones not measured
+                because another movement started before, the mean signed error, the median and maximum absolute
+                error of the latest stops, and the lead learnt
+        '''
+        errors = sorted(abs(error) for error in self.errors)
+        return {"stops": self.stops, "early": self.early_stops, "interrupted": self.interrupted,
+                "mean": sum(self.errors) / len(self.errors) if self.errors else None,
+                "p50": errors[len(errors) // 2] if errors else None,
+                "max": errors[-1] if errors else None, "lead": self.lead}
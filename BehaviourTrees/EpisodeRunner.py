@@ -0,0 +1,188 @@
+import os
+import csv
+import json
+import time
+import argparse
+import tempfile
+import itertools
+import contextlib
+import multiprocessing
+import concurrent.futures
+import AgentHost
+import Headless
+
+# Parquet output is optional, CSV does not need anything
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Columns of the results, one row per episode
+COLUMNS = ["episode", "seed", "config", "name", "control", "tick_mode", "spawn_point", "rays_per_direction",
+           "max_ray_degrees", "ray_length", "duration", "flowers_eaten", "collisions", "follow_time", "distance",
+           "ticks", "ticks_per_s", "messages_sent", "wall_time", "speedup", "error"]
+
+
+def make_episodes(config_paths, controls, seeds, sensors=(None,), spawn_points=(None,), duration=600.0,
+                  tick_mode="reactive", scene="Scene-1.json"):
+    '''
+    Description: Creates the grid of episodes: every combination of configuration file, control, sensor,
+                 spawn point and seed
+    Input: config_paths: list of configuration files of the agents
+           controls: list of agent_control messages (e.g. "bt:BTCritter")
+           seeds: list of int, seeds of the episodes
+           sensors: list of ray_perception_sensor_param [rays_per_direction, max_ray_degrees, sphere_cast_radius,
+                    ray_length] (None -> the one of the configuration file)
+           spawn_points: list of int (None -> the one of the configuration file)
+           duration: float, simulated seconds of each episode
+           tick_mode: str, tick mode of the agents
+           scene: scene file of the world
+    Output: episodes: list of dicts, each one with the parameters of an episode
+    '''
+    episodes = []
+    for config_path, control, sensor, spawn_point, seed in itertools.product(config_paths, controls, sensors,
+                                                                            spawn_points, seeds):
+        episodes.append({"episode": len(episodes), "seed": seed, "config": config_path, "control": control,
+                         "sensor": sensor, "spawn_point": spawn_point, "duration": duration,
+                         "tick_mode": tick_mode, "scene": scene})
+    return episodes
+
+
+def run_episode(episode: dict):
+    '''
+    Description: Runs an episode in the headless world, on simulated time. It is run in the worker processes
+    Input: episode: dict with the parameters of the episode (see make_episodes())
+    Output: row: dict with the parameters and the metrics of the episode (see COLUMNS)
+    '''
+    with open(episode["config"], 'r') as file:
+        config = json.load(file)
+    parameters = config["AgentParameters"]
+    if episode["sensor"] is not None:
+        parameters["ray_perception_sensor_param"] = list(episode["sensor"])
+    if episode["spawn_point"] is not None:
+        parameters["spawn_point"] = episode["spawn_point"]
+    rays_per_direction, max_ray_degrees, _, ray_length = parameters["ray_perception_sensor_param"]
+    row = {"episode": episode["episode"], "seed": episode["seed"], "config": os.path.basename(episode["config"]),
+           "name": parameters["name"], "control": episode["control"], "tick_mode": episode["tick_mode"],
+           "spawn_point": parameters.get("spawn_point", 0), "rays_per_direction": rays_per_direction,
+           "max_ray_degrees": max_ray_degrees, "ray_length": ray_length, "duration": episode["duration"],
+           "error": ""}
+    # The agent reads its configuration from a file, so the one of the episode is written in a temporary file
+    with tempfile.NamedTemporaryFile('w', suffix=".json", delete=False) as file:
+        json.dump(config, file)
+    config_path = file.name
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(None):
+            world, agents, bodies = Headless.run_headless(
+                episode["scene"], [config_path], episode["duration"], episode["control"], episode["seed"],
+                runtime={"tick_mode": episode["tick_mode"], "bt_executor": "flat"})
+    except Exception as e:
+        row["error"] = repr(e)
+        return row
+    finally:
+        os.remove(config_path)
+    wall_time = time.perf_counter() - start
+    if not agents or not bodies:
+        row["error"] = "The agent could not be created or connected"
+        return row
+    agent, body = agents[0], bodies[0]
+    row.update({"flowers_eaten": agent.flowers_eaten, "collisions": body.collisions,
+                "follow_time": round(agent.follow_time, 3), "distance": round(body.distance_travelled, 3),
+                "ticks": agent.ticks, "ticks_per_s": round(agent.ticks / world.time, 3),
+                "messages_sent": agent.messages_sent, "wall_time": round(wall_time, 3),
+                "speedup": round(world.time / wall_time, 1)})
+    return row
+
+
+def run_episodes(episodes, workers=None):
+    '''
+    Description: Runs the episodes in a pool of processes
+    Input: episodes: list of episodes (see make_episodes())
+           workers: int, number of processes (by default, one per CPU)
+    Output: rows: list with the result of each episode, in the order of 'episodes'
+    '''
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+        return list(executor.map(run_episode, episodes, chunksize=1))
+
+
+def write_results(rows, path):
+    '''
+    Description: Writes the results in a CSV file, or in a Parquet file if 'path' ends with .parquet
+                 (it needs pyarrow)
+    '''
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise RuntimeError("Writing Parquet files needs pyarrow. Use a .csv file or install pyarrow")
+        table = pyarrow.table({column: [row.get(column) for row in rows] for column in COLUMNS})
+        pyarrow.parquet.write_table(table, path)
+        return
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def summarize(rows):
+    '''
+    :return: text with the mean of the metrics of the episodes, by configuration file and control
+    '''
+    groups = {}
+    for row in rows:
+        if not row["error"]:
+            groups.setdefault((row["config"], row["control"]), []).append(row)
+    lines = [f"{'config':<16}{'control':<14}{'episodes':>9}{'flowers':>9}{'collisions':>11}{'follow (s)':>11}"
+             f"{'ticks/s':>9}{'speedup':>9}"]
+    for (config, control), group in sorted(groups.items()):
+        mean = {metric: sum(row[metric] for row in group) / len(group)
+                for metric in ("flowers_eaten", "collisions", "follow_time", "ticks_per_s", "speedup")}
+        lines.append(f"{config:<16}{control:<14}{len(group):>9}{mean['flowers_eaten']:>9.2f}"
+                     f"{mean['collisions']:>11.2f}{mean['follow_time']:>11.1f}{mean['ticks_per_s']:>9.1f}"
+                     f"{mean['speedup']:>9.0f}")
+    errors = sum(1 for row in rows if row["error"])
+    if errors:
+        lines.append(f"{errors} episodes failed")
+    return "\n".join(lines)
+
+
+def parse_sensor(text):
+    '''
+    :return: ray_perception_sensor_param from a text like "5,90,0,5"
+             (rays_per_direction,max_ray_degrees,sphere_cast_radius,ray_length)
+    '''
+    values = [float(value) for value in text.split(",")]
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError("The sensor must be rays_per_direction,max_degrees,sphere_radius,length")
+    return [int(values[0])] + values[1:]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs seeded episodes of the agents in the headless world")
+    parser.add_argument("configs", nargs="*", default=["AAgent-*.json"],
+                        help="configuration files of the agents (or glob patterns, default: AAgent-*.json)")
+    parser.add_argument("--control", nargs="+", default=["bt:BTCritter"], help="agent_control messages")
+    parser.add_argument("--seeds", type=int, default=10, help="episodes per combination (default: 10)")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--sensor", type=parse_sensor, nargs="+", default=[None],
+                        help="sensors to try, e.g. 5,90,0,5 3,60,0,10 (default: the one of each configuration)")
+    parser.add_argument("--spawn-point", type=int, nargs="+", default=[None],
+                        help="spawn points to try (default: the one of each configuration)")
+    parser.add_argument("--duration", type=float, default=600.0, help="simulated seconds per episode")
+    parser.add_argument("--tick-mode", choices=["free", "reactive"], default="reactive")
+    parser.add_argument("--scene", default="Scene-1.json")
+    parser.add_argument("--workers", type=int, help="number of processes (default: one per CPU)")
+    parser.add_argument("--output", default="episodes.csv", help="results file, .csv or .parquet")
+    args = parser.parse_args()
+
+    episodes = make_episodes(AgentHost.expand_config_paths(args.configs), args.control,
+                             range(args.first_seed, args.first_seed + args.seeds), args.sensor, args.spawn_point,
+                             args.duration, args.tick_mode, args.scene)
+    print(f"Running {len(episodes)} episodes of {args.duration:.0f} simulated seconds")
+    start = time.perf_counter()
+    rows = run_episodes(episodes, args.workers)
+    write_results(rows, args.output)
+    print(summarize(rows))
+    print(f"{len(rows)} episodes in {time.perf_counter() - start:.1f} s, results in {args.output}")
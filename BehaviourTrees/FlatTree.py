@@ -0,0 +1,260 @@
+import py_trees as pt
+from py_trees import common
+
+
+class FlatBehaviourTree:
+    '''
+    Description: Lean executor of a py_trees behaviour tree. The tree is compiled into flat arrays of nodes,
+                 with the kind of each node and the indices of its children precomputed, and it is ticked with
+                 a direct dispatch loop instead of the generators, logging and visitors of
+                 py_trees.trees.BehaviourTree.
+                 It keeps the semantics of py_trees for Selector, Sequence (with and without memory) and
+                 Parallel, and calls the initialise(), update() and terminate() methods of the behaviours
+                 in the same situations. The status of each node is kept in the py_trees node itself, so
+                 the tree can still be inspected, displayed or reset (e.g. stop_behaviour_tree()).
+                 Nodes of other kinds (decorators, custom composites) are ticked with their own py_trees logic.
+    '''
+    # Kinds of nodes
+    BEHAVIOUR = 0
+    SEQUENCE = 1
+    SELECTOR = 2
+    PARALLEL = 3
+    OTHER = 4
+
+    # Parallel policies
+    SUCCESS_ON_ALL = 0
+    SUCCESS_ON_ONE = 1
+    SUCCESS_ON_SELECTED = 2
+
+    def __init__(self, root):
+        '''
+        init method for FlatBehaviourTree, compiles the tree
+        Input: root: root node of a py_trees tree
+        '''
+        self.root = root
+        # One element per node, in depth first order (the root is the node 0)
+        self.nodes = []
+        self.kinds = []
+        self.children = []
+        self.memory = []
+        self.policy = []
+        # Position of the current child of each composite (None if it has no current child)
+        self.current = []
+        # Number of ticks done
+        self.count = 0
+        self.compile(root)
+        self.dispatch = [self.tick_behaviour, self.tick_sequence, self.tick_selector, self.tick_parallel,
+                         self.tick_other]
+
+    def compile(self, node):
+        '''
+        Adds 'node' and all its descendants to the flat arrays
+        :return: index of 'node'
+        '''
+        index = len(self.nodes)
+        self.nodes.append(node)
+        self.kinds.append(self.node_kind(node))
+        self.children.append(())
+        self.memory.append(getattr(node, "memory", False))
+        self.policy.append(None)
+        self.current.append(None)
+        if self.kinds[index] in (self.SEQUENCE, self.SELECTOR, self.PARALLEL):
+            self.children[index] = tuple(self.compile(child) for child in node.children)
+        if self.kinds[index] == self.PARALLEL:
+            if isinstance(node.policy, common.ParallelPolicy.SuccessOnAll):
+                self.policy[index] = (self.SUCCESS_ON_ALL, node.policy.synchronise, ())
+            elif isinstance(node.policy, common.ParallelPolicy.SuccessOnOne):
+                self.policy[index] = (self.SUCCESS_ON_ONE, node.policy.synchronise, ())
+            else:
+                selected = tuple(self.nodes.index(child) for child in node.policy.children)
+                self.policy[index] = (self.SUCCESS_ON_SELECTED, node.policy.synchronise, selected)
+        return index
+
+    def node_kind(self, node):
+        '''
+        :return: kind of the node 'node'
+        '''
+        if type(node) is pt.composites.Sequence:
+            return self.SEQUENCE
+        if type(node) is pt.composites.Selector:
+            return self.SELECTOR
+        if type(node) is pt.composites.Parallel:
+            node.validate_policy_configuration()
+            return self.PARALLEL
+        if isinstance(node, pt.composites.Composite) or isinstance(node, pt.decorators.Decorator):
+            return self.OTHER
+        return self.BEHAVIOUR
+
+    def tick(self):
+        '''
+        Ticks the whole tree once
+        :return: the new status of the root
+        '''
+        self.count += 1
+        return self.dispatch[self.kinds[0]](0)
+
+    def tick_node(self, index):
+        '''
+        Ticks the node 'index' and its descendants
+        :return: the new status of the node
+        '''
+        return self.dispatch[self.kinds[index]](index)
+
+    def stop(self, index, new_status):
+        '''
+        Stops the node 'index' with the status 'new_status', like py_trees stop() does:
+        the running children of a composite are stopped and then terminate() is called
+        '''
+        kind = self.kinds[index]
+        node = self.nodes[index]
+        if kind == self.OTHER:
+            node.stop(new_status)
+            return
+        if kind == self.PARALLEL:
+            for child in self.children[index]:
+                if self.nodes[child].status == common.Status.RUNNING:
+                    self.stop(child, common.Status.INVALID)
+        if kind != self.BEHAVIOUR and new_status == common.Status.INVALID:
+            self.current[index] = None
+            for child in self.children[index]:
+                if self.nodes[child].status != common.Status.INVALID:
+                    self.stop(child, common.Status.INVALID)
+        node.terminate(new_status)
+        node.status = new_status
+
+    def tick_behaviour(self, index):
+        node = self.nodes[index]
+        if node.status != common.Status.RUNNING:
+            node.initialise()
+        new_status = node.update()
+        if new_status != common.Status.RUNNING:
+            # terminate() can check the current status, so it is set afterwards
+            node.terminate(new_status)
+        node.status = new_status
+        return new_status
+
+    def tick_other(self, index):
+        node = self.nodes[index]
+        for _ in node.tick():
+            pass
+        return node.status
+
+    def tick_selector(self, index):
+        node = self.nodes[index]
+        children = self.children[index]
+        if node.status != common.Status.RUNNING:
+            self.current[index] = 0 if children else None
+            node.initialise()
+        if not children:
+            self.stop(index, common.Status.FAILURE)
+            return common.Status.FAILURE
+        if self.memory[index]:
+            # Children with higher priority than the current one are not ticked, just stopped
+            position = self.current[index]
+            for child in children[:position]:
+                if self.nodes[child].status != common.Status.INVALID:
+                    self.stop(child, common.Status.INVALID)
+        else:
+            position = 0
+        previous = self.current[index]
+        for position in range(position, len(children)):
+            status = self.tick_node(children[position])
+            if status == common.Status.RUNNING or status == common.Status.SUCCESS:
+                self.current[index] = position
+                if previous is None or previous != position:
+                    # Stop the children with lower priority
+                    for child in children[position + 1:]:
+                        if self.nodes[child].status != common.Status.INVALID:
+                            self.stop(child, common.Status.INVALID)
+                if status == common.Status.SUCCESS:
+                    self.stop(index, status)
+                else:
+                    node.status = status
+                return status
+        self.stop(index, common.Status.FAILURE)
+        self.current[index] = len(children) - 1
+        return common.Status.FAILURE
+
+    def tick_sequence(self, index):
+        node = self.nodes[index]
+        children = self.children[index]
+        position = 0
+        if node.status != common.Status.RUNNING:
+            self.current[index] = 0 if children else None
+            for child in children:
+                if self.nodes[child].status != common.Status.INVALID:
+                    self.stop(child, common.Status.INVALID)
+            node.initialise()
+        elif self.memory[index] and self.current[index] is not None:
+            # Resume from the child that was running
+            position = self.current[index]
+        else:
+            self.current[index] = 0 if children else None
+        if not children:
+            self.stop(index, common.Status.SUCCESS)
+            return common.Status.SUCCESS
+        while position < len(children):
+            status = self.tick_node(children[position])
+            if status != common.Status.SUCCESS:
+                if not self.memory[index]:
+                    for child in children[position + 1:]:
+                        if self.nodes[child].status != common.Status.INVALID:
+                            self.stop(child, common.Status.INVALID)
+                if status != common.Status.RUNNING:
+                    self.stop(index, status)
+                else:
+                    node.status = status
+                return status
+            if position + 1 < len(children):
+                self.current[index] = position + 1
+            position += 1
+        self.stop(index, common.Status.SUCCESS)
+        return common.Status.SUCCESS
+
+    def tick_parallel(self, index):
+        node = self.nodes[index]
+        children = self.children[index]
+        policy, synchronise, selected = self.policy[index]
+        if node.status != common.Status.RUNNING:
+            for child in children:
+                if self.nodes[child].status != common.Status.INVALID:
+                    self.stop(child, common.Status.INVALID)
+            self.current[index] = None
+            node.initialise()
+        if not children:
+            self.stop(index, common.Status.SUCCESS)
+            return common.Status.SUCCESS
+        for child in children:
+            if synchronise and self.nodes[child].status == common.Status.SUCCESS:
+                continue
+            self.tick_node(child)
+        new_status = common.Status.RUNNING
+        statuses = [self.nodes[child].status for child in children]
+        if common.Status.FAILURE in statuses:
+            new_status = common.Status.FAILURE
+        elif policy == self.SUCCESS_ON_ALL:
+            if all(status == common.Status.SUCCESS for status in statuses):
+                new_status = common.Status.SUCCESS
+        elif policy == self.SUCCESS_ON_ONE:
+            if common.Status.SUCCESS in statuses:
+                new_status = common.Status.SUCCESS
+        elif all(self.nodes[child].status == common.Status.SUCCESS for child in selected):
+            new_status = common.Status.SUCCESS
+        if new_status != common.Status.RUNNING:
+            self.stop(index, new_status)
+        node.status = new_status
+        return new_status
+
+
+def create_executor(root, executor="py_trees"):
+    '''
+    Description: Creates the object that ticks the behaviour tree with root 'root'
+    Input: root: root node of a py_trees tree
+           executor: "py_trees" (py_trees.trees.BehaviourTree) | "flat" (FlatBehaviourTree)
+    Output: object with a tick() method
+    '''
+    if executor == "flat":
+        return FlatBehaviourTree(root)
+    if executor == "py_trees":
+        return pt.trees.BehaviourTree(root)
+    raise ValueError(f"Unknown behaviour tree executor {executor}. Available executors: py_trees, flat")
@@ -1,8 +1,8 @@
 import math
-import random
+import time
 import asyncio 
-import Sensors
-from collections import Counter
+import Metrics
+from collections import Counter, deque
 
 
 def calculate_distance(point_a, point_b):
@@ -18,7 +18,223 @@ def calculate_distance(point_a, point_b):
 
 
 
-class DoNothing:
+class Goal:
+    '''
+    Description: Base class of the goals. The same goal object can be run many times (see GoalRunner):
+                 reset() puts it back in its initial state, and preempt() makes run() return at its next step,
+                 without sending any more actions to the agent
+    '''
+    def __init__(self):
+        '''
+        init method for Goal class
+        '''
+        # set when the goal has to finish as soon as possible
+        self.preempted = False
+        # future the goal is waiting for in sleep(), if any
+        self.sleeper = None
+        # Histogram of the duration of the steps of the goal (code run between two sleeps), set by the GoalRunner
+        self.step_time = Metrics.NULL_HISTOGRAM
+        # perf_counter() at the beginning of the current step, None if the goal is not running
+        self.step_start = None
+
+    def reset(self):
+        '''
+        Puts the goal back in its initial state, before running it again
+        '''
+        self.preempted = False
+
+    def preempt(self):
+        '''
+        Asks the goal to finish, waking it up if it is sleeping
+        '''
+        self.preempted = True
+        self.wake_up()
+
+    def end_step(self):
+        if self.step_start is not None:
+            self.step_time.observe(time.perf_counter() - self.step_start)
+            self.step_start = None
+
+    def wake_up(self):
+        if self.sleeper is not None and not self.sleeper.done():
+            self.sleeper.set_result(None)
+
+    async def sleep(self, delay):
+        '''
+        Like asyncio.sleep(), but preempt() interrupts it
+        Output: True if the goal can go on, False if it has been preempted
+        '''
+        if self.preempted:
+            return False
+        self.end_step()
+        if delay <= 0:
+            await asyncio.sleep(0)
+        else:
+            loop = asyncio.get_running_loop()
+            self.sleeper = loop.create_future()
+            handle = loop.call_later(delay, self.wake_up)
+            try:
+                await self.sleeper
+            finally:
+                handle.cancel()
+                self.sleeper = None
+        self.step_start = time.perf_counter()
+        return not self.preempted
+
+    async def wait_frame(self, predicate=None, timeout=None):
+        '''
+        Waits till a sensor frame makes 'predicate' true, or for the next sensor frame if there is no predicate
+        (see AAgent.wait_until()). Like sleep(), preempt() interrupts it. It needs self.a_agent
+        Output: True if the goal can go on, False if the timeout has expired or the goal has been preempted
+        '''
+        if self.preempted:
+            return False
+        if predicate is not None and predicate():
+            return True
+        self.end_step()
+        self.sleeper = self.a_agent.frame_waiter(predicate, timeout)
+        try:
+            ready = await self.sleeper
+        finally:
+            self.sleeper = None
+        self.step_start = time.perf_counter()
+        return bool(ready) and not self.preempted
+
+
+
+class GoalRunner:
+    '''
+    Description: Runs the goal of a behaviour in a long-lived task. The behaviour creates the runner and its goal
+                 once, and arms it every time the behaviour is initialised, instead of creating a new goal object
+                 and a new task. The behaviour gets the result with done() and result(), like with an asyncio.Task.
+                 Preempting the goal (terminate() of the behaviour) is a flag checked by the goal at its next step.
+                 Then, the action that stops the agent ('stop_action') is sent only if the behaviour has not been
+                 armed again in the meantime, e.g. by a selector that re-enters the same branch.
+    '''
+    # Commands of the channel of the runner
+    ARM = 0
+
+    def __init__(self, a_agent, goal, stop_action=None):
+        '''
+        init method for GoalRunner class
+        Input: a_agent: Agent object, the agent that executes the goal
+               goal: Goal object, the goal to run
+               stop_action: str, action sent when the goal is preempted (e.g. "stop" or "nt"), or None
+        '''
+        self.a_agent = a_agent
+        self.goal = goal
+        self.stop_action = stop_action
+        goal.step_time = a_agent.metrics.histogram("aagent_goal_step_seconds", "Duration of a step of a goal",
+                                                   goal=type(goal).__name__)
+        # Command channel: the behaviour appends the commands and sets the event to wake up the runner. The event
+        # is also set when the agent exits, so the runner finishes
+        self.commands = deque()
+        self.wakeup = asyncio.Event()
+        a_agent.exit_event.link(self.wakeup)
+        a_agent.goal_runners.append(self)
+        # Long-lived task of the runner, created the first time the goal is armed
+        self.task = None
+        # True while the goal is running
+        self.running = False
+        # Result of the last run of the goal
+        self.finished = True
+        self.goal_result = None
+        self.goal_exception = None
+        # Counters of runs, preemptions and stop actions sent or saved because the goal was armed again
+        self.runs = 0
+        self.preemptions = 0
+        self.stops_sent = 0
+        self.stops_skipped = 0
+
+    def arm(self):
+        '''
+        Starts a new run of the goal
+        '''
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.serve())
+        if self.running:
+            # The behaviour was reset without terminating it (e.g. stop_behaviour_tree()), so the goal is still
+            # running its previous run
+            self.goal.preempt()
+        self.finished = False
+        self.goal_result = None
+        self.goal_exception = None
+        self.commands.append(self.ARM)
+        self.wakeup.set()
+
+    def preempt(self):
+        '''
+        Finishes the current run of the goal, if any
+        '''
+        if self.commands:
+            # The goal had not started yet
+            self.commands.clear()
+        if self.running:
+            self.goal.preempt()
+
+    def done(self):
+        return self.finished
+
+    def close(self):
+        '''
+        Cancels the task of the runner, when the agent finishes
+        Output: the task, to await it, or None if there is none running
+        '''
+        task, self.task = self.task, None
+        if task is None or task.done():
+            return None
+        task.cancel()
+        return task
+
+    def result(self):
+        '''
+        Output: the result of the last run of the goal. If the goal raised an exception, it is raised again
+        '''
+        if self.goal_exception is not None:
+            raise self.goal_exception
+        return self.goal_result
+
+    async def serve(self):
+        '''
+        Body of the task of the runner: runs the goal every time it is armed, till the agent exits
+        '''
+        while not self.a_agent.exit_event.is_set():
+            if not self.commands:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            self.commands.popleft()
+            self.goal.reset()
+            self.runs += 1
+            self.running = True
+            try:
+                self.goal.step_start = time.perf_counter()
+                result = await self.goal.run()
+                exception = None
+            except Exception as e:
+                result = None
+                exception = e
+            finally:
+                self.goal.end_step()
+                self.running = False
+            if self.goal.preempted:
+                self.preemptions += 1
+                if self.commands:
+                    # Armed again, the goal sends its own actions
+                    self.stops_skipped += 1
+                elif self.stop_action is not None:
+                    self.stops_sent += 1
+                    await self.a_agent.send_message("action", self.stop_action)
+            else:
+                self.goal_result = result
+                self.goal_exception = exception
+                self.finished = True
+                # Tick the behaviour tree so the behaviour gets the result
+                self.a_agent.request_tick()
+
+
+
+class DoNothing(Goal):
     """
     Description: Class that represents the action of doing nothing
     """
@@ -27,6 +243,7 @@ class DoNothing:
         init method for DoNothing class
         Input: a_agent: Agent object, the agent that will execute the action (in this case, do nothing)
         '''
+        super().__init__()
         # get the agent object
         self.a_agent = a_agent
         # get the agent's sensors
@@ -39,16 +256,16 @@ class DoNothing:
         Use asyncio to run the action of doing nothing
         Output: True, when the action is done, in this case, after 1 second of sleep
         '''
-        #print message to terminal
-        print("Doing nothing")
+        #log the message
+        self.a_agent.log.debug("goal", "Doing nothing")
         # sleep for 1 second
-        await asyncio.sleep(1)
+        await self.sleep(1)
         # return True when the action is done
         return True
 
 
 
-class ForwardDist:
+class ForwardDist(Goal):
     """
         Moves forward a certain distance specified in the parameter "dist".
         If "dist" is -1, selects a random distance between the initial
@@ -66,6 +283,7 @@ class ForwardDist:
                d_min: float, the minimum distance the agent can move forward
                d_max: float, the maximum distance the agent can move forward
         '''
+        super().__init__()
         # get the agent object
         self.a_agent = a_agent
         # get the agent's sensors
@@ -80,11 +298,45 @@ class ForwardDist:
         self.d_min = d_min
         # set the maximum distance
         self.d_max = d_max
-        # set the starting position
-        self.starting_pos = a_agent.i_state.position
+        # set the starting position (a copy: the position of the internal state is updated in place)
+        self.starting_pos = a_agent.i_state.position.copy()
+        # get the stop predictor of the forward movements (see Control.StopPredictor)
+        self.predictor = a_agent.stop_predictors["move"]
         # set the state of the agent to STOPPED
         self.state = self.STOPPED
 
+    def reset(self):
+        '''
+        Puts the goal back in its initial state, before running it again
+        '''
+        super().reset()
+        self.state = self.STOPPED
+
+    def remaining(self):
+        '''
+        Output: float, distance left to the target distance (negative if beyond it)
+        '''
+        return self.target_dist - math.sqrt(self.i_state.position.dist2(self.starting_pos))
+
+    def watch_stop(self, remaining, velocity):
+        '''
+        Measures where the agent stops after sending "stop" (see Control.StopPredictor.watch)
+        Input: remaining: distance left to the target distance when "stop" was sent
+               velocity: speed when "stop" was sent
+        '''
+        # (copies: the goal may run again before the agent stops)
+        i_state, starting_pos, target_dist = self.i_state, self.starting_pos.copy(), self.target_dist
+        self.predictor.watch(self.a_agent, remaining, velocity,
+                             lambda: target_dist - math.sqrt(i_state.position.dist2(starting_pos)),
+                             lambda: i_state.movingForwards and i_state.changed(i_state.POSITION))
+
+    def should_stop(self):
+        '''
+        Output: True if "stop" has to be sent now. With the predictive stop, when the agent would stop closer to the
+                target than stopping at the next frame
+        '''
+        return self.predictor.should_stop(self.remaining(), self.i_state.velocity.norm(), self.i_state.frame_period)
+
     async def run(self):
         '''
         Use asyncio to run the action of moving forward a certain distance
@@ -92,15 +344,15 @@ class ForwardDist:
         '''
         # try to run the action
         try:
-            while True:
+            while not self.preempted:
                 # if the agent is in the STOPPED state
                 if self.state == self.STOPPED:
                     # set starting position before moving
-                    self.starting_pos = self.a_agent.i_state.position
+                    self.starting_pos.set(self.i_state.position)
                     # Before start moving, calculate the distance we want to move
                     if self.original_dist < 0:
                         # If the distance is negative, select a random distance between d_min and d_max
-                        self.target_dist = random.randint(self.d_min, self.d_max)
+                        self.target_dist = self.a_agent.random.randint(self.d_min, self.d_max)
                     else:
                         # If the distance is positive, set the target distance to the original distance
                         self.target_dist = self.original_dist
@@ -110,29 +362,34 @@ class ForwardDist:
                     self.state = self.MOVING
                 # if the agent is in the MOVING state
                 elif self.state == self.MOVING:
-                    #check if we already have covered the required distance
-                    current_dist = calculate_distance(self.starting_pos, self.i_state.position)
-                    if current_dist >= self.target_dist:
+                    # wait till a sensor frame shows that we have covered the required distance
+                    # (squared distances, no square root needed), or that we have to stop before it (predictive stop)
+                    if self.predictor.predictive:
+                        reached = await self.wait_frame(self.should_stop)
+                    else:
+                        target = self.target_dist * self.target_dist
+                        i_state, starting_pos = self.i_state, self.starting_pos
+                        reached = await self.wait_frame(lambda: i_state.position.dist2(starting_pos) >= target)
+                    if reached:
                         # If we have covered the required distance, stop moving
+                        remaining, velocity = self.remaining(), self.i_state.velocity.norm()
                         await self.a_agent.send_message("action", "stop")
+                        # Measure where the agent stops, once it does
+                        self.watch_stop(remaining, velocity)
                         # Set the state to STOPPED
                         self.state = self.STOPPED
                         # Return True when the action is done
                         return True
-                    # If we haven't covered the required distance
-                    else:
-                        # sleep 0 secs and Keep moving
-                        await asyncio.sleep(0)
                 #If the agent is not in the STOPPED or MOVING state
                 else:
-                    # Print an error message
-                    print("Unknown state: " + str(self.state))
+                    # Log an error message
+                    self.a_agent.log.error("goal", "Unknown state: " + str(self.state))
                     # Return False
                     return False
         # If the action is cancelled
         except asyncio.CancelledError:
-            # Print a message to the terminal
-            print("***** TASK Forward CANCELLED")
+            # Log a message
+            self.a_agent.log.debug("goal_cancelled", "***** TASK Forward CANCELLED")
             # Send the message "stop" to the agent
             await self.a_agent.send_message("action", "stop")
             # Set the state to STOPPED
@@ -140,7 +397,7 @@ class ForwardDist:
 
 
 
-class Turn:
+class Turn(Goal):
     """
     Description: Class that represents the action of turning a certain angle.
     """
@@ -156,6 +413,7 @@ class Turn:
         init method for Turn class
         Input: a_agent: Agent object, the agent that will execute the action (in this case, turn)
         '''
+        super().__init__()
         # get the agent object
         self.a_agent = a_agent
         # get the agent's sensors
@@ -170,9 +428,32 @@ class Turn:
         self.accumulated_rotation = 0
         # set the direction to turn (by default right)
         self.direction = self.RIGHT
+        # get the stop predictor of the turns (see Control.StopPredictor)
+        self.predictor = a_agent.stop_predictors["turn"]
         # set the state of the agent to SELECTING
         self.state = self.SELECTING
 
+    def reset(self):
+        '''
+        Puts the goal back in its initial state, before running it again
+        '''
+        super().reset()
+        self.accumulated_rotation = 0
+        self.direction = self.RIGHT
+        self.state = self.SELECTING
+
+    def watch_stop(self, remaining, velocity):
+        '''
+        Measures where the turn ends after sending "nt" (see Control.StopPredictor.watch)
+        Input: remaining: degrees left to the rotation amount when "nt" was sent
+               velocity: degrees per second in the direction of the turn when "nt" was sent
+        '''
+        i_state, direction, stop_rotation = self.i_state, self.direction, self.i_state.rotation.y
+        self.predictor.watch(self.a_agent, remaining, velocity,
+                             lambda: remaining - i_state.yaw_delta(stop_rotation) * direction,
+                             lambda: (i_state.isRotatingRight or i_state.isRotatingLeft) and
+                             i_state.changed(i_state.ROTATION))
+
     async def run(self):
         '''
         Use asyncio to run the action of turning a certain angle
@@ -180,15 +461,15 @@ class Turn:
         '''
         # try to run the action
         try:
-            while True:
+            while not self.preempted:
                 # if the agent is in the SELECTING state
                 if self.state == self.SELECTING:
                     # Select a random angle between 10 and 90 degrees
-                    self.rotation_amount = random.randint(10, 90)
-                    #print the angle to the terminal
-                    print("Degrees: " + str(self.rotation_amount))
+                    self.rotation_amount = self.a_agent.random.randint(10, 90)
+                    #log the angle
+                    self.a_agent.log.debug("goal", "Degrees: " + str(self.rotation_amount))
                     # Select a random direction to turn (left or right)
-                    self.direction = random.choice([self.LEFT, self.RIGHT])
+                    self.direction = self.a_agent.random.choice([self.LEFT, self.RIGHT])
                     #if the direction is right
                     if self.direction == self.RIGHT:
                         # Send the message "tr" to the agent (turn right)
@@ -198,41 +479,27 @@ class Turn:
                         #Send the message "tl" to the agent (turn left)
                         await self.a_agent.send_message("action", "tl")
                     # Set the previous rotation to the current rotation of the agent in the y-axis
-                    self.prev_rotation = self.i_state.rotation["y"]
+                    self.prev_rotation = self.i_state.rotation.y
                     # Set the accumulated rotation to 0
                     self.accumulated_rotation = 0
                     # Set the state to TURNING
                     self.state = self.TURNING
                 # if the agent is in the TURNING state
                 elif self.state == self.TURNING:
-                    # Get the current rotation of the agent in the y-axis
-                    current_rotation = self.i_state.rotation["y"]
-                    # If the direction is right
-                    if self.direction == self.RIGHT:
-                        #if the previous rotation is greater than the current rotation
-                        if self.prev_rotation > current_rotation: 
-                            #update the accumulated rotation to the difference between the previous and current rotation (clockwise)
-                            self.accumulated_rotation += 360 - self.prev_rotation + current_rotation
-                        #if the previous rotation is less than the current rotation
-                        else:
-                            #update the accumulated rotation to the difference between the current and previous rotation (clockwise)
-                            self.accumulated_rotation += current_rotation - self.prev_rotation
-                    # If the direction is left
-                    else:
-                        #if the previous rotation is less than the current rotation
-                        if self.prev_rotation < current_rotation: 
-                            #update the accumulated rotation to the difference between the current and previous rotation (counter-clockwise)
-                            self.accumulated_rotation += 360 - current_rotation + self.prev_rotation
-                        #if the previous rotation is greater than the current rotation
-                        else:
-                            #update the accumulated rotation to the difference between the previous and current rotation (counter-clockwise)
-                            self.accumulated_rotation += self.prev_rotation - current_rotation
+                    # Update the accumulated rotation with the degrees turned in the direction of the turn since the
+                    # last check (wrapped to [-180, 180), so crossing 0/360 degrees is not a special case)
+                    self.accumulated_rotation += self.i_state.yaw_delta(self.prev_rotation) * self.direction
                     # Set the previous rotation to the current rotation
-                    self.prev_rotation = current_rotation
-                    # If the accumulated rotation is greater than or equal to the rotation amount
-                    if self.accumulated_rotation >= self.rotation_amount:
+                    self.prev_rotation = self.i_state.rotation.y
+                    # If the accumulated rotation is greater than or equal to the rotation amount (or, with the
+                    # predictive stop, the turn would end closer to it stopping now than at the next frame)
+                    remaining = self.rotation_amount - self.accumulated_rotation
+                    velocity = self.i_state.angular_velocity.y * self.direction
+                    if self.predictor.should_stop(remaining, velocity, self.i_state.frame_period):
                         # Send the message "nt" to the agent (no turn)
                         await self.a_agent.send_message("action", "nt")
+                        # Measure where the turn ends, once it does
+                        self.watch_stop(remaining, velocity)
                         # Reset the accumulated rotation to 0
                         self.accumulated_rotation = 0
                         # Set the direction to right
@@ -241,18 +508,18 @@ class Turn:
                         self.state = self.SELECTING
                         # Return True when the action is done
                         return True
-                # Sleep for 0 seconds and keep running the action
-                await asyncio.sleep(0)
+                # Wait for the next sensor frame and keep running the action (the rotation only changes with them)
+                await self.wait_frame()
         # If the action is cancelled
         except asyncio.CancelledError:
-            # Print a message to the terminal
-            print("***** TASK Turn CANCELLED")
+            # Log a message
+            self.a_agent.log.debug("goal_cancelled", "***** TASK Turn CANCELLED")
             # Send the message "nt" to the agent (no turn)
             await self.a_agent.send_message("action", "nt")
 
 
 
-class Avoid:
+class Avoid(Goal):
     '''
     Description: Class that represents the action of avoiding obstacles
     '''
@@ -265,11 +532,12 @@ class Avoid:
     RIGHT = 1 # Turn right
 
 
-    def __init__(self, a_agent, rotation_amount):
+    def __init__(self, a_agent, rotation_amount=30):
         '''
         init method for Avoid class
         Input: a_agent: Agent object, the agent that will execute the action (in this case, avoid obstacles)
         '''
+        super().__init__()
         # get the agent object
         self.a_agent = a_agent
         # get the agent's sensors
@@ -287,6 +555,15 @@ class Avoid:
         self.direction = self.RIGHT
         # set the state of the agent to MOVING
         self.state = self.MOVING
+
+    def reset(self):
+        '''
+        Puts the goal back in its initial state, before running it again
+        '''
+        super().reset()
+        self.accumulated_rotation = 0
+        self.direction = self.RIGHT
+        self.state = self.MOVING
     
     async def run(self):
         '''
@@ -295,23 +572,27 @@ class Avoid:
         '''
         # try to run the action
         try:
-            while True:
+            while not self.preempted:
                 # if the agent is in the MOVING state    
                 if self.state == self.MOVING:
-                    # Check if any of the rays on the left side of the agent hit any obstacle
-                    if any(self.rc_sensor.sensor_rays[Sensors.RayCastSensor.HIT][:5]):
+                    # Check if any of the rays on the left side of the agent hit any obstacle (the sides of the
+                    # sensor come from its configuration, whatever the number of rays)
+                    if self.rc_sensor.any_hit(self.rc_sensor.left):
                         # If any of the rays hit, turn right, avoiding the obstacle
-                        self.direction == self.RIGHT
+                        self.direction = self.RIGHT
                         # Send the message "tr" to the agent (turn right)
-                        await self.a_agent.send_message("action", "tr")
-                    # Check if any of the rays on the right side of the agent hit any obstacle
-                    elif any(self.rc_sensor.sensor_rays[Sensors.RayCastSensor.HIT][5:]):
+                        await self.a_agent.send_message("action", "tr", trace="Avoid")
+                    # Check if the center ray or any of the rays on the right side of the agent hit any obstacle
+                    elif self.rc_sensor.any_hit():
                         # If any of the rays hit, turn left, avoiding the obstacle
-                        self.direction == self.LEFT
+                        self.direction = self.LEFT
                         # Send the message "tl" to the agent (turn left)
-                        await self.a_agent.send_message("action", "tl")
+                        await self.a_agent.send_message("action", "tl", trace="Avoid")
+                    # No ray hits anything: there is nothing to avoid, and no turn to wait for
+                    else:
+                        return True
                     # Set the previous rotation to the current rotation of the agent in the y-axis
-                    self.prev_rotation = self.i_state.rotation["y"]
+                    self.prev_rotation = self.i_state.rotation.y
                     # Set the accumulated rotation to 0
                     self.accumulated_rotation = 0
                     # Set the state to TURNING
@@ -319,34 +600,15 @@ class Avoid:
 
                 # if the agent is in the TURNING state
                 elif self.state == self.TURNING:
-                    # Get the current rotation of the agent in the y-axis
-                    current_rotation = self.i_state.rotation["y"]
-                    # If the direction is right
-                    if self.direction == self.RIGHT:
-                        # If the previous rotation is greater than the current rotation
-                        if self.prev_rotation > current_rotation: 
-                            # Update the accumulated rotation to the difference between the previous and current rotation (clockwise)
-                            self.accumulated_rotation += 360 - self.prev_rotation + current_rotation
-                        # If the previous rotation is less than the current rotation
-                        else:
-                            # Update the accumulated rotation to the difference between the current and previous rotation (clockwise)
-                            self.accumulated_rotation += current_rotation - self.prev_rotation
-                    # If the direction is left
-                    else:
-                        # If the previous rotation is less than the current rotation
-                        if self.prev_rotation < current_rotation: 
-                            # Update the accumulated rotation to the difference between the current and previous rotation (counter-clockwise)
-                            self.accumulated_rotation += 360 - current_rotation + self.prev_rotation
-                        # If the previous rotation is greater than the current rotation
-                        else:
-                            # Update the accumulated rotation to the difference between the previous and current rotation (counter-clockwise)
-                            self.accumulated_rotation += self.prev_rotation - current_rotation
+                    # Update the accumulated rotation with the degrees turned since the last check, whatever the
+                    # direction (wrapped to [-180, 180), so crossing 0/360 degrees is not a special case)
+                    self.accumulated_rotation += abs(self.i_state.yaw_delta(self.prev_rotation))
                     # Set the previous rotation to the current rotation
-                    self.prev_rotation = current_rotation
+                    self.prev_rotation = self.i_state.rotation.y
                     # Check if the accumulated rotation is greater than or equal to the rotation amount, means that the turn is done:
                     if self.accumulated_rotation >= self.rotation_amount:
                         # Send the message "nt" to the agent (no turn)
-                        await self.a_agent.send_message("action", "nt")
+                        await self.a_agent.send_message("action", "nt", trace="Avoid")
                         # Reset the accumulated rotation to 0
                         self.accumulated_rotation = 0
                         # Set the direction to right (default)
@@ -355,17 +617,18 @@ class Avoid:
                         self.state = self.MOVING
                         # Return True when the action is done
                         return True
-                # Sleep for 0.1 seconds and keep running the action if the agent has not finish avoiding the obstacle
-                await asyncio.sleep(0.1)
+                # Wait for the next sensor frame and keep running the action if the agent has not finish avoiding
+                # the obstacle (the rotation only changes with the frames)
+                await self.wait_frame()
         # If the action is cancelled
         except asyncio.CancelledError:
-            # Print a message to the terminal
-            print("***** TASK Avoid CANCELLED")
+            # Log a message
+            self.a_agent.log.debug("goal_cancelled", "***** TASK Avoid CANCELLED")
             # Send the message "nt" to the agent (no turn)
             await self.a_agent.send_message("action", "nt")
         
 
-class EatFlower:
+class EatFlower(Goal):
     '''
     Description: Class that represents the action of eating a flower, to eat in this case
                  is just stopping the agent for 5 seconds next to the flower'''
@@ -373,6 +636,7 @@ class EatFlower:
         '''
         init method for EatFlower class
         Input: a_agent: Agent object, the agent that will execute the action (in this case, eat)'''
+        super().__init__()
         # get the agent object
         self.a_agent = a_agent
 
@@ -385,10 +649,12 @@ class EatFlower:
         if self.a_agent.hungry:
             # Send the message "action" to the agent (stop)
             await self.a_agent.send_message("action", "stop")
-            # Sleep for 5 seconds next to the flower
-            await asyncio.sleep(5)  
+            # Sleep for 5 seconds next to the flower, unless the goal is preempted
+            if not await self.sleep(5):
+                return False
             # Set the agent as not hungry
             self.a_agent.hungry = False
+            self.a_agent.flowers_eaten += 1
             # Return True when the action is done, the agent has eaten the flower
             return True
         # If the agent is not hungry
@@ -398,7 +664,7 @@ class EatFlower:
 
 
 
-class FollowAstronaut:
+class FollowAstronaut(Goal):
     '''
     Description: Class that represents the action of following an astronaut
     '''
@@ -414,6 +680,7 @@ class FollowAstronaut:
         init method for FollowAstronaut class
         Input: a_agent: Agent object, the agent that will execute the action (in this case, follow an astronaut)
         '''
+        super().__init__()
         # get the agent object
         self.a_agent = a_agent
         # get the agent's sensors
@@ -432,6 +699,16 @@ class FollowAstronaut:
         self.state = self.MOVING
         # set the agent as not hungry (by default)
         self.ishungry = False
+
+    def reset(self):
+        '''
+        Puts the goal back in its initial state, before running it again
+        '''
+        super().reset()
+        self.accumulated_rotation = 0
+        self.direction = self.RIGHT
+        self.state = self.MOVING
+        self.ishungry = False
         
     async def run(self):
         '''
@@ -441,33 +718,29 @@ class FollowAstronaut:
         # try to run the action
         try:
             # while the agent is not hungry
-            while not self.ishungry:
+            while not self.ishungry and not self.preempted:
                 # if the agent is in the MOVING state
                 if self.state == self.MOVING:
-                    # Check if any of the rays hits an astronaut, using the detection sensor that we get from the BTCritter.py's detect_astronaut class
-                    if self.rc_sensor.sensor_rays[Sensors.RayCastSensor.HIT][self.a_agent.det_sensor]:
-                        # if the sensor that detects the astronaut is on the left side of the agent (0-4)
-                        if self.a_agent.det_sensor < 5:
-                            # Turn left by the angle given by the sensor that detects the astronaut,
-                            # if the sensor is 0, turn left by -90 degrees, if it is 4, turn left by -18 degrees
-                            turn_angle = -90 + self.a_agent.det_sensor * (90 / 5)
+                    # Check if any of the rays hits an astronaut, and get the bearing of the nearest one
+                    steering = self.rc_sensor.steering("Astronaut")
+                    if steering.target:
+                        # Degrees to turn towards the astronaut: the angle of its ray (negative -> on the left)
+                        turn_angle = steering.bearing
+                        # if the astronaut is on the left side of the agent
+                        if turn_angle < 0:
                             # Send the message "tl" to the agent (turn left)
-                            await self.a_agent.send_message("action", f"tl")
-                        # if the sensor that detects the astronaut is on the right side of the agent (6-10)
-                        elif  self.a_agent.det_sensor >5:
-                            # Turn right by the angle given by the sensor that detects the astronaut,
-                            # if the sensor is 6, turn right by 18 degrees, if it is 10, turn right by 90 degrees
-                            turn_angle = self.a_agent.det_sensor * (90 / 5)
+                            await self.a_agent.send_message("action", "tl", trace="FollowAstronaut")
+                        # if the astronaut is on the right side of the agent
+                        elif turn_angle > 0:
                             # Send the message "tr" to the agent (turn right)
-                            await self.a_agent.send_message("action", f"tr")
-                        # if the sensor that detects the astronaut is in the middle of the agent (5), just move forward, no need to turn
+                            await self.a_agent.send_message("action", "tr", trace="FollowAstronaut")
+                        # if the astronaut is in front of the agent, just move forward, no need to turn
                         else:
-                            #set the turn angle to 0 because, if not, we'd get an error of referencing before assignment
-                            turn_angle = 0
                             # Send the message "mf" to the agent (move forward)
-                            await self.a_agent.send_message("action", f"mf")
+                            await self.a_agent.send_message("action", "mf", trace="FollowAstronaut")
                         #set a sleep time to wait for the agent to turn  or move forward
-                        await asyncio.sleep(0.15)
+                        if not await self.sleep(0.15):
+                            return False
                         #go forward another time (this was added empirically to make the agent follow the astronaut better)
                         await self.a_agent.send_message("action", "mf")
 
@@ -475,40 +748,29 @@ class FollowAstronaut:
                     # If the agent is not in front of an astronaut, but is inside this action, means that the agent recently saw the astronaut
                     #so we go in the direction that we followed the astronaut last time, this is part of the bonus task.
                     else:
+                        # No turn to wait for
+                        turn_angle = 0
                         # Send the message "mf" to the agent (move forward) a couple of times
                         await self.a_agent.send_message("action", "mf")
                         await self.a_agent.send_message("action", "mf")
 
                     #set previous rotation of the agent to the current rotation 
-                    self.prev_rotation = self.i_state.rotation["y"]
+                    self.prev_rotation = self.i_state.rotation.y
                     #set the accumulated rotation to 0
                     self.accumulated_rotation = 0
                     #set the state to TURNING
                     self.state = self.TURNING
                 # if the agent is in the TURNING state
                 elif self.state == self.TURNING:
-                    # Get the current rotation of the agent in the y-axis
-                    current_rotation = self.i_state.rotation["y"]
-                    # If the direction is right
-                    if self.direction == self.RIGHT:
-                        # Calculate the rotation change by subtracting the previous rotation from the current rotation and adding 360 to avoid
-                        # negative values, then take the modulo 360 so we get the correct value and never does more than an entire rotation (360 degrees)
-                        rotation_change = (current_rotation - self.prev_rotation + 360) % 360
-                        # Update the accumulated rotation by adding the rotation change
-                        self.accumulated_rotation += rotation_change
-                    # If the direction is left
-                    elif self.direction == self.LEFT:
-                        # Calculate the rotation change by subtracting the current rotation from the previous rotation and adding 360 to avoid
-                        # negative values, then take the modulo 360 so we get the correct value and never does more than an entire rotation (360 degrees)
-                        rotation_change = (self.prev_rotation - current_rotation + 360) % 360
-                        # Update the accumulated rotation by adding the rotation change
-                        self.accumulated_rotation += rotation_change
+                    # Update the accumulated rotation with the degrees turned since the last check, whatever the
+                    # direction (wrapped to [-180, 180), so crossing 0/360 degrees is not a special case)
+                    self.accumulated_rotation += abs(self.i_state.yaw_delta(self.prev_rotation))
                     # Set the previous rotation to the current rotation
-                    self.prev_rotation = current_rotation
+                    self.prev_rotation = self.i_state.rotation.y
                     # If the accumulated rotation is greater than or equal to the rotation amount
                     if self.accumulated_rotation >= abs(turn_angle):
                         # Send the message "nt" to the agent (no turn) as the turn is done
-                        await self.a_agent.send_message("action", "nt")
+                        await self.a_agent.send_message("action", "nt", trace="FollowAstronaut")
                         # Reset the accumulated rotation to 0
                         self.accumulated_rotation = 0
                         # Set the direction to right (default)
@@ -517,16 +779,16 @@ class FollowAstronaut:
                         self.state = self.MOVING
                         # Return True when the action is done
                         return True
-                    # Sleep for 0 seconds and keep running the action
-                    await asyncio.sleep(0)
+                    # Wait for the next sensor frame and keep running the action
+                    await self.wait_frame()
                 # If the agent is not in the MOVING or TURNING state
                 if not self.a_agent.hungry:
                     # Print an error message
                     self.ishungry = True
         # If the action is cancelled
         except asyncio.CancelledError:
-            # Print a message to the terminal
-            print("***** TASK Follow CANCELLED")
+            # Log a message
+            self.a_agent.log.debug("goal_cancelled", "***** TASK Follow CANCELLED")
             # Send the message "nt" to the agent (no turn)
             await self.a_agent.send_message("action", "nt")
 
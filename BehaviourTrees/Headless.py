@@ -0,0 +1,376 @@
+import time
+import asyncio
+import argparse
+import selectors
+import contextlib
+import collections
+import aiohttp
+import AAgent_BT
+import AgentLog
+import AgentHost
+import Simulator
+
+
+class VirtualSelector(selectors.BaseSelector):
+    '''
+    Description: Selector of the VirtualClockLoop. Instead of blocking till the next timer of the event loop,
+                 it advances the virtual clock till that timer and only polls the real file descriptors
+    '''
+    def __init__(self, loop):
+        self.loop = loop
+        self.selector = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None):
+        return self.selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self.selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self.selector.modify(fileobj, events, data)
+
+    def select(self, timeout=None):
+        if timeout is None:
+            # No timers and nothing to run: only a real event (e.g. from another thread) can wake up the loop
+            return self.selector.select(None)
+        # Every iteration of the loop costs 'iteration_time', so tasks that never sleep still let time go by
+        self.loop.virtual_time += max(timeout, self.loop.iteration_time)
+        return self.selector.select(0)
+
+    def close(self):
+        self.selector.close()
+
+    def get_key(self, fileobj):
+        return self.selector.get_key(fileobj)
+
+    def get_map(self):
+        return self.selector.get_map()
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    '''
+    Description: Event loop that runs on simulated time. loop.time() returns the virtual clock, and when all the
+                 tasks are waiting for a timer (asyncio.sleep(), asyncio.wait_for(), call_later()...) the clock
+                 jumps to that timer instead of waiting for it. So the agents, the goals and the simulated world
+                 run as fast as the CPU allows, with the same timing they would have in real time.
+    '''
+    def __init__(self, iteration_time=0.005):
+        '''
+        init method for VirtualClockLoop
+        Input: iteration_time: float, simulated seconds that each iteration of the loop takes, when there are
+                               tasks ready to run
+        '''
+        self.virtual_time = 0.0
+        self.iteration_time = iteration_time
+        super().__init__(VirtualSelector(self))
+
+    def time(self):
+        return self.virtual_time
+
+
+class DelayLine:
+    '''
+    Description: One-way network latency: the items pushed are delivered 'latency' seconds later, in order
+    '''
+    def __init__(self, latency, deliver):
+        '''
+        Input: latency: float, seconds
+               deliver: function called with each item when it arrives
+        '''
+        self.latency = latency
+        self.deliver = deliver
+        self.queue = collections.deque()
+
+    def push(self, item):
+        loop = asyncio.get_running_loop()
+        self.queue.append((loop.time() + self.latency, item))
+        if len(self.queue) == 1:
+            loop.call_at(self.queue[0][0], self.drain)
+
+    def drain(self):
+        loop = asyncio.get_running_loop()
+        while self.queue and self.queue[0][0] <= loop.time():
+            self.deliver(self.queue.popleft()[1])
+        if self.queue:
+            loop.call_at(self.queue[0][0], self.drain)
+
+
+class LocalConnection(Simulator.Connection):
+    '''
+    Description: Connection of an agent running in the same process as the Simulator.
+                 The messages are encoded like in the websocket and put in the inbox of the agent
+    '''
+    def __init__(self, ws, latency=0.0):
+        super().__init__(None)
+        self.local_ws = ws
+        self.delay = DelayLine(latency, self.deliver) if latency > 0 else None
+
+    async def send(self, msg: dict):
+        if self.local_ws.closed:
+            raise ConnectionResetError("The agent is disconnected")
+        msg_type = aiohttp.WSMsgType.BINARY if self.codec.binary else aiohttp.WSMsgType.TEXT
+        msg = aiohttp.WSMessage(msg_type, self.codec.encode(msg), None)
+        if self.delay is None:
+            self.local_ws.inbox.put_nowait(msg)
+        else:
+            self.delay.push(msg)
+
+    def deliver(self, msg):
+        if not self.local_ws.closed:
+            self.local_ws.inbox.put_nowait(msg)
+
+    async def close(self):
+        await self.local_ws.close()
+
+
+class LocalWebSocket:
+    '''
+    Description: Websocket of an agent connected to a Simulator running in the same process.
+                 It has the methods of aiohttp.ClientWebSocketResponse used by the agent.
+                 With 'latency' the messages take that many seconds to arrive, in each direction
+    '''
+    def __init__(self, simulator, latency=0.0):
+        self.simulator = simulator
+        self.inbox = asyncio.Queue()
+        self.closed = False
+        self.connection = LocalConnection(self, latency)
+        self.delay = DelayLine(latency, self.deliver) if latency > 0 else None
+
+    async def send_str(self, data):
+        await self.send(data, False)
+
+    async def send_bytes(self, data):
+        await self.send(data, True)
+
+    async def send(self, data, binary):
+        if self.closed:
+            raise ConnectionResetError("The websocket is closed")
+        if self.delay is None:
+            await self.simulator.receive(self.connection, data, binary)
+        else:
+            self.delay.push((data, binary))
+
+    def deliver(self, message):
+        if not self.closed:
+            asyncio.ensure_future(self.simulator.receive(self.connection, *message))
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            self.simulator.disconnect(self.connection)
+            self.inbox.put_nowait(aiohttp.WSMessage(aiohttp.WSMsgType.CLOSED, None, None))
+
+    def exception(self):
+        return None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        msg = await self.inbox.get()
+        if msg.type == aiohttp.WSMsgType.CLOSED:
+            raise StopAsyncIteration
+        return msg
+
+
+class LocalSession:
+    '''
+    Description: Stand-in of aiohttp.ClientSession that connects the agents to a Simulator running in the same
+                 process, whatever the URL of their configuration file. 'latency': see LocalWebSocket
+    '''
+    def __init__(self, simulator, latency=0.0):
+        self.simulator = simulator
+        self.latency = latency
+
+    async def ws_connect(self, url):
+        if not self.simulator.accepting:
+            raise aiohttp.ClientConnectionError("The simulator is not accepting connections")
+        return LocalWebSocket(self.simulator, self.latency)
+
+    async def close(self):
+        pass
+
+
+async def run_world(world, config_paths, duration, control=None, sensor_rate=20.0, physics_rate=50.0,
+                    runtime=None, seed=None, outages=None, latency=0.0, script=None):
+    '''
+    Description: Runs the agents of 'config_paths' in 'world' during 'duration' seconds of the clock of the
+                 event loop, with the Simulator and the agents in the same process and event loop
+    Input: world: Simulator.World where the agents are simulated
+           config_paths: list of configuration files of the agents
+           duration: float, seconds to simulate
+           control: str, agent_control message sent to the agents when they start (e.g. "bt:BTCritter")
+           sensor_rate, physics_rate: float, see Simulator
+           runtime: dict, Runtime settings that override the ones of the configuration files
+           seed: seed of the random generators of the agents, each agent gets its own one derived from it
+           outages: list of (start, duration): seconds since the beginning of the run at which the Simulator
+                    disconnects all the agents, and seconds during which it does not accept connections
+           latency: float, seconds the messages take to arrive between the agents and the Simulator, each way
+           script: async function called with the list of agents once they are running, e.g. to run goals
+                   on them directly. The run ends when it returns, or after 'duration' seconds
+    Output: (agents, bodies): list with the AAgent objects and list with the Simulator.Body of the agents
+                              at the end of the run
+    '''
+    loop = asyncio.get_running_loop()
+    simulator = Simulator.Simulator(world, sensor_rate=sensor_rate, physics_rate=physics_rate, control=control)
+    simulator_tasks = simulator.start_tasks()
+    if outages:
+        simulator_tasks.append(asyncio.create_task(run_outages(simulator, outages)))
+    session = LocalSession(simulator, latency)
+    agents = []
+    for index, path in enumerate(config_paths):
+        agent_runtime = dict(runtime or {})
+        if seed is not None:
+            agent_runtime.setdefault('seed', f"{seed}:{index}")
+        try:
+            agents.append(AAgent_BT.AAgent(path, session=session, clock=loop.time, runtime=agent_runtime))
+        except Exception as e:
+            print(f"Failed creating the agent of {path}: {e!r}")
+    agent_tasks = [asyncio.create_task(agent.run()) for agent in agents]
+    try:
+        if script is None:
+            await asyncio.sleep(duration)
+        else:
+            script_task = asyncio.create_task(script(agents))
+            await asyncio.wait([script_task], timeout=duration)
+            script_task.cancel()
+        bodies = list(world.bodies)
+    finally:
+        for agent in agents:
+            agent.exit_event.set()
+        # A simple goal does not check the exit event, so the agents that are still running it are cancelled
+        if agent_tasks:
+            _, pending = await asyncio.wait(agent_tasks, timeout=1.0)
+            for task in pending:
+                task.cancel()
+        results = await asyncio.gather(*agent_tasks, return_exceptions=True)
+        for task in simulator_tasks:
+            task.cancel()
+    for agent, result in zip(agents, results):
+        if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError):
+            print(f"Agent {agent.AgentParameters['name']} failed: {result!r}")
+    return agents, bodies
+
+
+async def run_outages(simulator, outages):
+    '''
+    Description: Simulates the 'outages' (see run_world()) of the Simulator
+    '''
+    loop = asyncio.get_running_loop()
+    begin = loop.time()
+    for start, duration in sorted(outages):
+        await asyncio.sleep(begin + start - loop.time())
+        await simulator.outage(duration)
+
+
+def run_headless(scene_path, config_paths, duration, control=None, seed=None, fast_forward=True,
+                 iteration_time=0.005, **kwargs):
+    '''
+    Description: Runs the agents in a simulated world without Unity and without network.
+                 With 'fast_forward' the event loop runs on simulated time (VirtualClockLoop): the sleeps of
+                 the goals, the timers of the behaviours and the steps of the world take no wall time
+    Input: scene_path: scene file of the world (see Scene-1.json)
+           config_paths: list of configuration files of the agents
+           duration: float, seconds to simulate
+           control: str, agent_control message sent to the agents when they start (e.g. "bt:BTCritter")
+           seed: int, seed of the world and of the random generators of the agents. On simulated time,
+                 the same seed gives the same run
+           fast_forward: bool, run on simulated time (True) or on wall time (False)
+           iteration_time: float, see VirtualClockLoop
+           kwargs: other arguments of run_world()
+    Output: (world, agents, bodies): the world and the result of run_world()
+    '''
+    world = Simulator.World.from_file(scene_path, seed)
+    loop = VirtualClockLoop(iteration_time) if fast_forward else asyncio.new_event_loop()
+    try:
+        agents, bodies = loop.run_until_complete(run_world(world, config_paths, duration, control, seed=seed,
+                                                           **kwargs))
+    finally:
+        # Like asyncio.run(), cancel the tasks that are still alive (e.g. the GoalRunners) before closing
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+        # The records of the agents are written by a background thread, wait till they are out
+        AgentLog.flush()
+    return world, agents, bodies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the agents in a simulated world on simulated time")
+    parser.add_argument("configs", nargs="+", help="configuration files of the agents (or glob patterns)")
+    parser.add_argument("--scene", default="Scene-1.json", help="scene file (default: Scene-1.json)")
+    parser.add_argument("--duration", type=float, default=3600.0, help="simulated seconds (default: 3600)")
+    parser.add_argument("--control", default="bt:BTCritter", help="agent_control message sent at start")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--tick-mode", choices=["free", "reactive"], help="override the tick mode of the agents")
+    parser.add_argument("--bt-executor", choices=["py_trees", "flat"], help="override the executor of the agents")
+    parser.add_argument("--sensor-rate", type=float, default=20.0, help="sensor frames/s per agent")
+    parser.add_argument("--physics-rate", type=float, default=50.0, help="steps/s of the world")
+    parser.add_argument("--iteration-time", type=float, default=0.005,
+                        help="simulated seconds of each iteration of the event loop with tasks ready to run")
+    parser.add_argument("--real-time", action="store_true", help="run on wall time instead of simulated time")
+    parser.add_argument("--trace-file", help="Chrome trace of the reactions of each agent, e.g. trace-{name}.json")
+    parser.add_argument("--action-batching", action="store_true", help="batch the actions of each tick")
+    parser.add_argument("--send-queue", type=int, help="frames of the send queue of the writer task (0 -> none)")
+    parser.add_argument("--reconnect", action="store_true", help="reconnect the agents when they are disconnected")
+    parser.add_argument("--outage", nargs=2, type=float, action="append", metavar=("START", "DURATION"),
+                        help="disconnect all the agents at START seconds during DURATION seconds (repeatable)")
+    parser.add_argument("--predictive-stop", action="store_true", help="stop the movements before the target")
+    parser.add_argument("--latency", type=float, default=0.0, help="one-way latency of the messages, in seconds")
+    parser.add_argument("--log-level", choices=list(AgentLog.LEVELS), help="override the log level of the agents")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the agents")
+    args = parser.parse_args()
+
+    runtime = {}
+    if args.tick_mode:
+        runtime["tick_mode"] = args.tick_mode
+    if args.bt_executor:
+        runtime["bt_executor"] = args.bt_executor
+    if args.trace_file:
+        runtime["trace_file"] = args.trace_file
+    if args.log_level:
+        runtime["log_level"] = args.log_level
+    if args.action_batching:
+        runtime["action_batching"] = True
+    if args.send_queue is not None:
+        runtime["send_queue"] = args.send_queue
+    if args.reconnect:
+        runtime["reconnect"] = True
+    if args.predictive_stop:
+        runtime["predictive_stop"] = True
+    start = time.perf_counter()
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(None):
+        world, agents, bodies = run_headless(args.scene, AgentHost.expand_config_paths(args.configs),
+                                             args.duration, args.control, args.seed, not args.real_time,
+                                             args.iteration_time, sensor_rate=args.sensor_rate,
+                                             physics_rate=args.physics_rate, runtime=runtime, outages=args.outage,
+                                             latency=args.latency)
+    elapsed = time.perf_counter() - start
+    print(f"Simulated {world.time:.0f} s in {elapsed:.1f} s of wall time ({world.time / elapsed:.0f}x)")
+    for agent in agents:
+        body = next((body for body in bodies if body.name == agent.AgentParameters['name']), None)
+        print(f"  {agent.AgentParameters['name']}: ticks: {agent.ticks}  messages sent: {agent.messages_sent}  "
+              f"received: {agent.messages_received}" +
+              (f"  distance: {body.distance_travelled:.1f}  collisions: {body.collisions}" if body else ""))
+        if agent.action_batcher is not None:
+            stats = agent.action_batcher.stats()
+            print(f"    actions: {stats['queued']}  coalesced: {stats['coalesced']}  "
+                  f"deduplicated: {stats['deduplicated']}  frames: {stats['frames']}  "
+                  f"bytes saved: {stats['bytes_saved']}")
+        if agent.recover_times:
+            recover_times = sorted(agent.recover_times)
+            print(f"    connections lost: {agent.connection_losses}  recovered: {agent.reconnects}  "
+                  f"attempts: {agent.reconnect_attempts}  time to recover p50: "
+                  f"{recover_times[len(recover_times) // 2]:.2f} s  max: {recover_times[-1]:.2f} s")
+        for name, predictor in agent.stop_predictors.items():
+            stats = predictor.stats()
+            if stats['stops']:
+                print(f"    {name} stops: {stats['stops']}  early: {stats['early']}  "
+                      f"interrupted: {stats['interrupted']}  mean error: {stats['mean']:+.3f}  "
+                      f"p50 |error|: {stats['p50']:.3f}  max: {stats['max']:.3f}  lead: {stats['lead'] * 1e3:.0f} ms")
+        for behaviour, latency in agent.tracer.report().items():
+            print(f"    {behaviour:<20} reactions: {latency['count']:<6} p50: {latency['p50'] * 1e3:.1f} ms  "
+                  f"p99: {latency['p99'] * 1e3:.1f} ms")
@@ -0,0 +1,250 @@
+import bisect
+from aiohttp import web
+
+
+def exponential_buckets(start, factor, count):
+    '''
+    :return: list with the upper bounds of 'count' buckets, starting at 'start' and multiplying by 'factor'
+    '''
+    return [start * factor ** i for i in range(count)]
+
+
+# Buckets of the latency histograms, in seconds: from 1 us to ~2 s
+LATENCY_BUCKETS = exponential_buckets(1e-6, 2.0, 22)
+
+
+class Histogram:
+    '''
+    Description: Histogram with fixed buckets, like the ones of Prometheus. Observing a value is a bisection and
+                 three additions, so it can be used in the hot paths of the agent.
+                 The quantiles are estimated from the buckets, by linear interpolation inside the bucket
+    '''
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.bounds = list(buckets)
+        # counts[i]: values <= bounds[i] (and > bounds[i - 1]), counts[-1]: values over the last bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        '''
+        :return: estimation of the quantile 'q' (0..1) of the values observed, None if there are no values
+        '''
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.bounds[-1]
+
+    def snapshot(self):
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else None,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+    def prometheus_lines(self, labels):
+        lines = []
+        cumulative = 0
+        separator = "," if labels else ""
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{{labels}{separator}le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum{braces(labels)} {self.sum!r}")
+        lines.append(f"{self.name}_count{braces(labels)} {self.count}")
+        return lines
+
+
+class Counter:
+    '''
+    Description: Counter incremented with inc(), or read from 'function' when the metrics are pulled.
+                 The second way has no cost in the hot paths, for the counters the agent already keeps
+    '''
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels, function=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.function = function
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+    def snapshot(self):
+        return self.get()
+
+    def prometheus_lines(self, labels):
+        return [f"{self.name}{braces(labels)} {self.get()}"]
+
+
+class Gauge(Counter):
+    '''
+    Description: Value that goes up and down (e.g. the depth of a queue), set with set() or read from 'function'
+    '''
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+
+class NullHistogram:
+    '''
+    Description: Histogram of a disabled Registry, that does nothing
+    '''
+    def observe(self, value):
+        pass
+
+
+class NullCounter:
+    '''
+    Description: Counter (or Gauge) of a disabled Registry, that does nothing
+    '''
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+NULL_HISTOGRAM = NullHistogram()
+NULL_COUNTER = NullCounter()
+
+
+class Registry:
+    '''
+    Description: Metrics of an agent. The metrics are created once (e.g. in the init method of the agent) and
+                 kept in attributes, so updating them does not look anything up.
+                 A disabled registry gives metrics that do nothing, so the instrumentation can be switched off
+                 entirely (Runtime setting "metrics": false).
+                 Pull API: snapshot() returns the current values, prometheus_text() the Prometheus text format
+    '''
+    def __init__(self, enabled=True, **labels):
+        '''
+        init method for Registry
+        Input: enabled: bool, False -> all the metrics do nothing
+               labels: labels added to all the metrics, e.g. agent="Critter_1"
+        '''
+        self.enabled = enabled
+        self.labels = labels
+        self.metrics = {}
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, **labels):
+        '''
+        :return: the histogram 'name' with the labels 'labels', created if it does not exist
+        '''
+        if not self.enabled:
+            return NULL_HISTOGRAM
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.metrics:
+            self.metrics[key] = Histogram(name, help_text, labels, buckets)
+        return self.metrics[key]
+
+    def counter(self, name, help_text, function=None, **labels):
+        '''
+        :return: the counter 'name' with the labels 'labels', created if it does not exist
+        '''
+        if not self.enabled:
+            return NULL_COUNTER
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.metrics:
+            self.metrics[key] = Counter(name, help_text, labels, function)
+        return self.metrics[key]
+
+    def gauge(self, name, help_text, function=None, **labels):
+        '''
+        :return: the gauge 'name' with the labels 'labels', created if it does not exist
+        '''
+        if not self.enabled:
+            return NULL_COUNTER
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.metrics:
+            self.metrics[key] = Gauge(name, help_text, labels, function)
+        return self.metrics[key]
+
+    def snapshot(self):
+        '''
+        :return: dict {name: value} for the counters and gauges, and {name: {count, sum, mean, p50, p90, p99}}
+                 for the histograms. The name includes the labels of the metric,
+                 e.g. "aagent_goal_step_seconds{goal=Turn}"
+        '''
+        result = {}
+        for (name, labels), metric in self.metrics.items():
+            if labels:
+                name += "{" + ",".join(f"{key}={value}" for key, value in labels) + "}"
+            result[name] = metric.snapshot()
+        return result
+
+    def prometheus_text(self):
+        return prometheus_text([self])
+
+
+def braces(labels: str):
+    return "{" + labels + "}" if labels else ""
+
+
+def format_labels(labels: dict):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def prometheus_text(registries):
+    '''
+    Description: Renders the metrics of several registries (e.g. all the agents of a host) in the Prometheus
+                 text format, with the HELP and TYPE lines once per metric name
+    '''
+    by_name = {}
+    for registry in registries:
+        for (name, _), metric in registry.metrics.items():
+            by_name.setdefault(name, []).append((registry, metric))
+    lines = []
+    for name, metrics in by_name.items():
+        lines.append(f"# HELP {name} {metrics[0][1].help}")
+        lines.append(f"# TYPE {name} {metrics[0][1].kind}")
+        for registry, metric in metrics:
+            lines.extend(metric.prometheus_lines(format_labels(dict(registry.labels, **metric.labels))))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    '''
+    Description: HTTP endpoint that serves the metrics of some registries in the Prometheus text format,
+                 on GET /metrics
+    '''
+    def __init__(self, registries, host="127.0.0.1", port=9100):
+        self.registries = registries
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(text=prometheus_text(self.registries), content_type="text/plain")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,309 @@
+import asyncio
+import collections
+import Metrics
+
+# Channel of each action: the actions of a channel replace the state set by the previous one
+# (the movement and the turning of the agent are independent)
+CHANNELS = {"mf": "move", "stop": "move", "W": "move", "S": "move",
+            "tr": "turn", "tl": "turn", "nt": "turn", "D": "turn", "A": "turn"}
+
+# Actions that turn one step each time they are sent, so they are never coalesced nor deduplicated.
+# "W" and "S" are not: like "mf" and "stop", they set the movement of the agent till another action of the move
+# channel changes it, so sending one again changes nothing. "D" and "A" start a new step every time
+# (see Simulator.World.apply_action() and tests/test_outbound.py)
+STEP_ACTIONS = {"D", "A"}
+
+# Actions that stop the agent, that the OutboundWriter never drops
+NEVER_DROP = {"stop", "nt", "S"}
+
+# Overflow policies of the OutboundWriter
+POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class ActionBatcher:
+    '''
+    Description: Outbound queue of the actions of an agent (Runtime setting "action_batching").
+                 The actions are queued during a tick and sent together when the queue is flushed:
+                     - An action replaces the one of its channel queued before it in the same tick, that has not
+                       been sent yet (e.g. "stop" followed by "mf" -> "mf").
+                     - An action equal to the last one sent in its channel less than 'refresh' seconds ago is not
+                       sent again (e.g. "mf" sent twice back-to-back). After 'refresh' seconds it is, in case the
+                       server has changed the state of the agent on its own.
+                 The actions left are sent in a single frame: {"type": "actions", "content": [...]}, or as a
+                 regular "action" message when there is only one.
+    '''
+    def __init__(self, codec, clock, refresh=1.0):
+        '''
+        init method for ActionBatcher
+        Input: codec: Codec of the messages of the agent
+               clock: function that returns the current time in seconds (the clock of the agent)
+               refresh: float, seconds during which a repeated action is not sent again (0 -> always sent)
+        '''
+        self.codec = codec
+        self.clock = clock
+        self.refresh = refresh
+        # Actions queued since the last flush, in order
+        self.pending = []
+        # Last action sent on each channel: {channel: (action, time)}
+        self.last_sent = {}
+        # Size of the "action" message of each action, to count the bytes saved
+        self.message_sizes = {}
+        # Counters
+        self.actions_queued = 0
+        self.actions_coalesced = 0
+        self.actions_deduplicated = 0
+        self.actions_sent = 0
+        self.frames_sent = 0
+        self.bytes_unbatched = 0
+        self.bytes_sent = 0
+
+    def add(self, action):
+        '''
+        Queues 'action', replacing the action of its channel queued before it
+        '''
+        self.actions_queued += 1
+        self.bytes_unbatched += self.message_size(action)
+        channel = CHANNELS.get(action)
+        if channel is not None and action not in STEP_ACTIONS:
+            for i, queued in enumerate(self.pending):
+                if CHANNELS.get(queued) == channel and queued not in STEP_ACTIONS:
+                    del self.pending[i]
+                    self.actions_coalesced += 1
+                    break
+        self.pending.append(action)
+
+    def take(self):
+        '''
+        Empties the queue
+        :return: (msg_data, actions): the message with the actions to send, encoded with the codec, and the list
+                 of actions in it, or None if there is nothing to send
+        '''
+        if not self.pending:
+            return None
+        now = self.clock()
+        actions = []
+        for action in self.pending:
+            channel = CHANNELS.get(action)
+            if action in STEP_ACTIONS:
+                # After a step the turning state depends on the server, nothing can be deduplicated against it
+                self.last_sent.pop(channel, None)
+            elif channel is not None:
+                last = self.last_sent.get(channel)
+                if last is not None and last[0] == action and now - last[1] < self.refresh:
+                    self.actions_deduplicated += 1
+                    continue
+                self.last_sent[channel] = (action, now)
+            actions.append(action)
+        self.pending.clear()
+        if not actions:
+            return None
+        self.actions_sent += len(actions)
+        self.frames_sent += 1
+        if len(actions) == 1:
+            msg_data = self.codec.encode({"type": "action", "content": actions[0]})
+        else:
+            msg_data = self.codec.encode({"type": "actions", "content": actions})
+        self.bytes_sent += len(msg_data)
+        return msg_data, actions
+
+    def message_size(self, action):
+        size = self.message_sizes.get(action)
+        if size is None:
+            size = self.message_sizes[action] = len(self.codec.encode({"type": "action", "content": action}))
+        return size
+
+    def forget(self, actions):
+        '''
+        The frame with 'actions' has not been sent (see OutboundWriter), so they are not taken as the last ones
+        sent: the next time they are queued they are sent again
+        '''
+        for action in actions:
+            channel = CHANNELS.get(action)
+            last = self.last_sent.get(channel)
+            if last is not None and last[0] == action:
+                del self.last_sent[channel]
+
+    def reset(self):
+        '''
+        Forgets the actions queued and the ones sent, e.g. after reconnecting with a server that has created the
+        agent again
+        '''
+        self.pending.clear()
+        self.last_sent.clear()
+
+    def stats(self):
+        '''
+        :return: dict with the counters of the actions, and the frames and bytes saved by the batching
+        '''
+        return {"queued": self.actions_queued, "coalesced": self.actions_coalesced,
+                "deduplicated": self.actions_deduplicated, "sent": self.actions_sent, "frames": self.frames_sent,
+                "frames_saved": self.actions_queued - self.frames_sent,
+                "bytes_saved": self.bytes_unbatched - self.bytes_sent}
+
+
+def droppable(actions):
+    '''
+    :return: True if a frame with 'actions' can be dropped: it only has movement commands. Messages that are
+             not actions ('actions' is None) are never dropped
+    '''
+    return actions is not None and not any(action in NEVER_DROP for action in actions)
+
+
+class OutboundWriter:
+    '''
+    Description: Writer task of the messages of an agent (Runtime setting "send_queue"). The goals put their
+                 messages in a bounded queue, without waiting for the network, and the writer task sends them in
+                 order. When the server is slow and the queue is full, the policy decides what to do:
+                     - drop_oldest: the oldest frame with only movement commands (mf, tr, tl...) is dropped.
+                     - drop_newest: the new frame is dropped if it only has movement commands.
+                     - block: the goal waits till there is room in the queue.
+                 Frames with "stop"/"nt" and messages that are not actions are never dropped: if there is nothing
+                 to drop they are queued anyway, over the limit
+    '''
+    def __init__(self, write, max_size=64, policy="drop_oldest", on_drop=None, metrics: Metrics.Registry = None):
+        '''
+        init method for OutboundWriter
+        Input: write: coroutine function that sends an encoded message through the websocket
+               max_size: int, frames in the queue before the policy applies
+               policy: str, see POLICIES
+               on_drop: function called with the actions of every frame dropped
+               metrics: Metrics.Registry where the depth of the queue is exported
+        '''
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown send queue policy {policy}, it has to be one of {', '.join(POLICIES)}")
+        self.write = write
+        self.max_size = max_size
+        self.policy = policy
+        self.on_drop = on_drop
+        # Frames waiting to be sent: (encoded message, list of actions or None)
+        self.queue = collections.deque()
+        # Set when there is something in the queue / when there is room in it / when it is empty
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        self.empty = asyncio.Event()
+        self.empty.set()
+        self.task = None
+        # Counters
+        self.frames_queued = 0
+        self.frames_dropped = 0
+        self.frames_written = 0
+        self.max_depth = 0
+        metrics = metrics if metrics is not None else Metrics.Registry(False)
+        self.depth_histogram = metrics.histogram("aagent_send_queue_depth", "Frames in the send queue when a frame "
+                                                 "is queued", Metrics.exponential_buckets(1, 2, 10))
+        metrics.gauge("aagent_send_queue_frames", "Frames in the send queue", lambda: len(self.queue))
+        metrics.gauge("aagent_send_queue_max_frames", "Maximum number of frames in the send queue",
+                      lambda: self.max_depth)
+        metrics.counter("aagent_send_queue_dropped_total", "Frames dropped because the send queue was full",
+                        lambda: self.frames_dropped)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    async def put(self, msg_data, actions=None):
+        '''
+        Queues a message. It only waits with the "block" policy, when the queue is full
+        Input: msg_data: encoded message
+               actions: list with the actions of the message, None if it is not an action message
+        Output: True if the message has been queued, False if it has been dropped
+        '''
+        if len(self.queue) >= self.max_size:
+            if self.policy == "block":
+                while len(self.queue) >= self.max_size and self.running():
+                    self.not_full.clear()
+                    await self.not_full.wait()
+            elif not self.make_room(actions):
+                self.dropped(actions)
+                return False
+        self.depth_histogram.observe(len(self.queue))
+        self.queue.append((msg_data, actions))
+        self.frames_queued += 1
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.not_empty.set()
+        self.empty.clear()
+        return True
+
+    def make_room(self, actions):
+        '''
+        The queue is full: drops a frame according to the policy
+        :return: True if the new frame with 'actions' can be queued, False if it has to be dropped
+        '''
+        new_droppable = droppable(actions)
+        if self.policy == "drop_newest" and new_droppable:
+            return False
+        for i, (_, queued_actions) in enumerate(self.queue):
+            if droppable(queued_actions):
+                del self.queue[i]
+                self.dropped(queued_actions)
+                return True
+        # Nothing to drop: the new frame is dropped, unless it has to be sent anyway
+        return not new_droppable
+
+    def dropped(self, actions):
+        self.frames_dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(actions)
+
+    async def run(self):
+        '''
+        Writer task: sends the messages of the queue, in order
+        '''
+        try:
+            while True:
+                if not self.queue:
+                    self.not_empty.clear()
+                    self.empty.set()
+                    await self.not_empty.wait()
+                    continue
+                msg_data, _ = self.queue.popleft()
+                self.not_full.set()
+                await self.write(msg_data)
+                self.frames_written += 1
+        finally:
+            # Nobody has to wait for the writer any more
+            self.not_full.set()
+            self.empty.set()
+
+    async def drain(self, timeout):
+        '''
+        Waits till the queue is empty or 'timeout' seconds have passed
+        :return: True if the queue is empty
+        '''
+        if self.running():
+            try:
+                await asyncio.wait_for(self.empty.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return not self.queue
+
+    def clear(self):
+        '''
+        Drops the frames still queued, e.g. when the connection has been lost
+        '''
+        self.frames_dropped += len(self.queue)
+        self.queue.clear()
+        self.not_full.set()
+        self.empty.set()
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                # The error has already been reported by the agent, when the writer failed
+                pass
+            self.task = None
+
+    def stats(self):
+        '''
+        :return: dict with the counters of the queue
+        '''
+        return {"queued": self.frames_queued, "dropped": self.frames_dropped, "written": self.frames_written,
+                "max_depth": self.max_depth, "depth": len(self.queue)}
@@ -0,0 +1,221 @@
+import numpy as np
+
+
+class BatchRayCaster:
+    '''
+    Description: Casts the rays of the sensors of all the agents of a World at once, with NumPy.
+                 It gives the same results as World.cast_rays(), but instead of testing every ray against every
+                 object in Python, it does one vectorized pass per sensor step:
+                     1. Broadphase: the circles (flowers, astronauts, critters and agents) are put in a uniform
+                        grid, with cells as big as the longest ray, so each agent only considers the circles of
+                        the 3x3 cells around it, and only the walls closer than its ray length.
+                     2. Narrowphase: every ray is intersected with the candidates of its agent, and the nearest
+                        hit of each ray is kept.
+    '''
+    def __init__(self, world):
+        '''
+        init method for BatchRayCaster
+        Input: world: World whose agents cast the rays
+        '''
+        self.world = world
+        # Static circles, that do not change between steps
+        self.static_x = np.array([obj["x"] for obj in world.objects], dtype=float)
+        self.static_z = np.array([obj["z"] for obj in world.objects], dtype=float)
+        self.static_r = np.array([obj["radius"] for obj in world.objects], dtype=float)
+        self.static_info = [(obj["name"], obj["tag"]) for obj in world.objects]
+        # Walls: arrays with the ends of the segments
+        walls = np.array([wall[1:] for wall in world.walls], dtype=float).reshape(-1, 4)
+        self.wall_x1, self.wall_z1, self.wall_x2, self.wall_z2 = walls.T
+        self.wall_names = [wall[0] for wall in world.walls]
+        # Counters of the candidates of the last step, to check the broadphase
+        self.candidate_pairs = 0
+
+    def cast_all(self, bodies):
+        '''
+        Casts the rays of all the agents in 'bodies'
+        :return: list with the perception of each agent, as expected by RayCastSensor.set_perception()
+        '''
+        num_bodies = len(bodies)
+        if num_bodies == 0:
+            return []
+        # Agents
+        body_x = np.array([body.x for body in bodies], dtype=float)
+        body_z = np.array([body.z for body in bodies], dtype=float)
+        body_length = np.array([body.ray_length for body in bodies], dtype=float)
+        body_sphere = np.array([body.sphere_cast_radius for body in bodies], dtype=float)
+        num_rays = np.array([len(body.ray_angles) for body in bodies], dtype=np.int64)
+        first_ray = np.zeros(num_bodies, dtype=np.int64)
+        np.cumsum(num_rays[:-1], out=first_ray[1:])
+        total_rays = int(num_rays.sum())
+
+        # Rays: agent, origin and direction of each one
+        ray_body = np.repeat(np.arange(num_bodies), num_rays)
+        ray_yaw = np.radians(np.repeat([body.yaw for body in bodies], num_rays) +
+                             np.concatenate([body.ray_angles for body in bodies]))
+        ray_dx = np.sin(ray_yaw)
+        ray_dz = np.cos(ray_yaw)
+
+        # Candidate (ray, object, distance) of the circles and the walls. The objects are numbered like in
+        # World.cast_rays(): first the walls, then the static circles and then the agents
+        num_walls = len(self.wall_names)
+        rays, objects, distances = [], [], []
+
+        # Circles: the static ones and then the agents
+        circle_x = np.concatenate([self.static_x, body_x])
+        circle_z = np.concatenate([self.static_z, body_z])
+        circle_r = np.concatenate([self.static_r, [body.radius for body in bodies]])
+        num_static = len(self.static_x)
+        pair_body, pair_circle = self.broadphase(body_x, body_z, body_length + body_sphere, circle_x, circle_z,
+                                                 circle_r)
+        # An agent does not see itself
+        keep = pair_circle != num_static + pair_body
+        pair_body, pair_circle = pair_body[keep], pair_circle[keep]
+        self.candidate_pairs = len(pair_body)
+        if len(pair_body):
+            ray, circle = self.expand_to_rays(pair_body, pair_circle, num_rays, first_ray)
+            owner = ray_body[ray]
+            rays.append(ray)
+            objects.append(circle + num_walls)
+            distances.append(ray_circle_distances(circle_x[circle], circle_z[circle],
+                                                  circle_r[circle] + body_sphere[owner], body_x[owner],
+                                                  body_z[owner], ray_dx[ray], ray_dz[ray]))
+
+        # Walls, that are long, so they are not in the grid: the agent only tests the ones closer than its rays
+        if num_walls:
+            distance = point_segment_distances(body_x[:, None], body_z[:, None], self.wall_x1, self.wall_z1,
+                                               self.wall_x2, self.wall_z2)
+            pair_body, pair_wall = np.nonzero(distance <= body_length[:, None])
+            if len(pair_body):
+                ray, wall = self.expand_to_rays(pair_body, pair_wall, num_rays, first_ray)
+                owner = ray_body[ray]
+                rays.append(ray)
+                objects.append(wall)
+                distances.append(ray_segment_distances(body_x[owner], body_z[owner], ray_dx[ray], ray_dz[ray],
+                                                       self.wall_x1[wall], self.wall_z1[wall], self.wall_x2[wall],
+                                                       self.wall_z2[wall]))
+
+        nearest_distance = np.repeat(body_length, num_rays)
+        nearest_object = np.full(total_rays, -1, dtype=np.int64)
+        if rays:
+            self.keep_nearest(np.concatenate(rays), np.concatenate(objects), np.concatenate(distances),
+                              nearest_distance, nearest_object)
+
+        # Perception messages
+        info = [(name, "Wall") for name in self.wall_names] + self.static_info + \
+            [(body.name, body.tag) for body in bodies]
+        distances = np.round(nearest_distance, 3).tolist()
+        objects = nearest_object.tolist()
+        perceptions = []
+        for start, n in zip(first_ray.tolist(), num_rays.tolist()):
+            perceptions.append([[i, 0, None] if obj < 0 else
+                                [i, 1, {"name": info[obj][0], "tag": info[obj][1], "distance": distance}]
+                                for i, obj, distance in zip(range(n), objects[start:start + n],
+                                                            distances[start:start + n])])
+        return perceptions
+
+    @staticmethod
+    def broadphase(body_x, body_z, reach, circle_x, circle_z, circle_r):
+        '''
+        Finds, with a uniform grid, the circles that the rays of each agent can hit
+        Input: body_x, body_z: arrays with the positions of the agents, that are also circles
+               reach: array with the ray length of each agent, plus its sphere cast radius
+               circle_x, circle_z, circle_r: arrays with the circles
+        Output: (pair_body, pair_circle): arrays with the candidate pairs (index of agent, index of circle)
+        '''
+        cell = max(float(reach.max() + circle_r.max()), 1e-6)
+        # Cells of the circles, sorted by cell key. The agents are circles too, so their cells are in the range
+        cell_x = np.floor(circle_x / cell).astype(np.int64)
+        cell_z = np.floor(circle_z / cell).astype(np.int64)
+        offset = int(cell_x.min()) - 1
+        width = int(cell_x.max()) - offset + 2
+        keys = (cell_z * width) + (cell_x - offset)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # Keys of the 3x3 cells around each agent
+        agent_cx = np.floor(body_x / cell).astype(np.int64) - offset
+        agent_cz = np.floor(body_z / cell).astype(np.int64)
+        neighbour_x = agent_cx[:, None] + np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
+        neighbour_z = agent_cz[:, None] + np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+        neighbour_keys = neighbour_z * width + neighbour_x
+        start = np.searchsorted(sorted_keys, neighbour_keys, side="left").ravel()
+        end = np.searchsorted(sorted_keys, neighbour_keys, side="right").ravel()
+        counts = end - start
+        # Expand every (agent, cell) range into (agent, circle) pairs
+        pair_body = np.repeat(np.repeat(np.arange(len(body_x)), 9), counts)
+        position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+        pair_circle = order[position]
+        # Keep only the circles in reach
+        dx = circle_x[pair_circle] - body_x[pair_body]
+        dz = circle_z[pair_circle] - body_z[pair_body]
+        in_reach = dx * dx + dz * dz <= (reach[pair_body] + circle_r[pair_circle]) ** 2
+        return pair_body[in_reach], pair_circle[in_reach]
+
+    @staticmethod
+    def expand_to_rays(pair_body, pair_object, num_rays, first_ray):
+        '''
+        Turns (agent, object) pairs into (ray, object) pairs, for all the rays of the agent
+        '''
+        counts = num_rays[pair_body]
+        ray = np.repeat(first_ray[pair_body], counts) + np.arange(counts.sum()) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        return ray, np.repeat(pair_object, counts)
+
+    @staticmethod
+    def keep_nearest(ray, obj, t, nearest_distance, nearest_object):
+        '''
+        Updates the nearest hit of each ray with the distances 't' of the (ray, obj) pairs (NaN -> no hit).
+        Like World.cast_rays(), the object with the highest number wins when several are at the same distance
+        '''
+        hit = ~np.isnan(t)
+        ray, obj, t = ray[hit], obj[hit], t[hit]
+        hit = t <= nearest_distance[ray]
+        ray, obj, t = ray[hit], obj[hit], t[hit]
+        if len(ray) == 0:
+            return
+        # Sort by ray, then distance, and take the first of each ray
+        order = np.lexsort((-obj, t, ray))
+        ray, obj, t = ray[order], obj[order], t[order]
+        first = np.ones(len(ray), dtype=bool)
+        first[1:] = ray[1:] != ray[:-1]
+        nearest_distance[ray[first]] = t[first]
+        nearest_object[ray[first]] = obj[first]
+
+
+def point_segment_distances(px, pz, x1, z1, x2, z2):
+    '''
+    Vectorized version of Simulator.point_segment_distance()
+    '''
+    sx, sz = x2 - x1, z2 - z1
+    length2 = sx * sx + sz * sz
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u = np.where(length2 == 0, 0.0, np.clip(((px - x1) * sx + (pz - z1) * sz) / length2, 0.0, 1.0))
+    return np.hypot(px - x1 - u * sx, pz - z1 - u * sz)
+
+
+def ray_segment_distances(ox, oz, dx, dz, x1, z1, x2, z2):
+    '''
+    Vectorized version of Simulator.ray_segment_distance()
+    :return: array with the distances, NaN where the ray does not hit the segment
+    '''
+    sx, sz = x2 - x1, z2 - z1
+    denominator = dx * sz - dz * sx
+    wx, wz = x1 - ox, z1 - oz
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (wx * sz - wz * sx) / denominator
+        u = (wx * dz - wz * dx) / denominator
+    miss = (denominator == 0) | (t < 0) | (u < 0) | (u > 1)
+    return np.where(miss, np.nan, t)
+
+
+def ray_circle_distances(cx, cz, radius, ox, oz, dx, dz):
+    '''
+    Vectorized version of Simulator.ray_circle_distance()
+    :return: array with the distances, NaN where the ray does not hit the circle
+    '''
+    wx, wz = cx - ox, cz - oz
+    projection = wx * dx + wz * dz
+    d2 = wx * wx + wz * wz - projection * projection
+    with np.errstate(invalid="ignore"):
+        t = projection - np.sqrt(radius * radius - d2)
+    miss = (projection < 0) | (d2 > radius * radius) | (t < 0)
+    return np.where(miss, np.nan, t)
@@ -1,9 +1,39 @@
+import numpy as np
+from collections import namedtuple
+
+
+# Entry of the tag index of a RayCastSensor: indices of the rays hitting objects with a tag (in ray order),
+# distance to the nearest of those objects and index of the ray that hits it
+TagHits = namedtuple("TagHits", ["rays", "min_distance", "nearest"])
+
+# Result of RayCastSensor.steering(): heading in degrees from the center (positive to the right), index of its ray,
+# free distance along it (distance to the target if 'target') and whether it is the bearing of the target
+Steering = namedtuple("Steering", ["bearing", "ray", "distance", "target"])
+
+
 class RayCastSensor:
     HIT = 0
     DISTANCE = 1
     OBJECT_INFO = 2
     ANGLE = 3
 
+    # Tags of the hit objects are interned to small ints, shared by all the sensors
+    NO_TAG = -1
+    tag_ids = {}
+    tag_names = []
+
+    @classmethod
+    def tag_id(cls, tag):
+        """
+        :param tag: Tag of an object (e.g. "Flower")
+        :return: Small int that identifies the tag. It is created the first time the tag is seen
+        """
+        tag_id = cls.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = cls.tag_ids[tag] = len(cls.tag_names)
+            cls.tag_names.append(tag)
+        return tag_id
+
     def __init__(self, ray_perception_config):
         """
         :param ray_perception_config:
@@ -18,34 +48,58 @@ class RayCastSensor:
             sphere_cast_radius -> Radius of sphere to cast.
             ray_length -> Length of the rays to cast.
         """
-        self.sensor_rays = None
         self.rays_per_direction = ray_perception_config[0]
         self.num_rays = (self.rays_per_direction * 2) + 1
         self.max_ray_degrees = ray_perception_config[1]
         self.sphere_cast_radius = ray_perception_config[2]
         self.ray_length = ray_perception_config[3]
 
-        # Array [3 x num_rays] with the live information of the sensor rays
-        # row HIT -> bool, hit ON/OFF
-        # row DISTANCE -> int, distance to the target
-        # row OBJECT_INFO -> Information about the object that the ray is hitting
-        # row ANGLE -> int, degrees from the center. Positive, rays on the right. Negative, rays on the left
-        self.sensor_rays = [[False for _ in range(self.num_rays)],
-                            [-1 for _ in range(self.num_rays)],
-                            [None for _ in range(self.num_rays)],
-                            [0.0 for _ in range(self.num_rays)]]
-        # Fill the angles of each ray
-        angle_between_rays = self.max_ray_degrees / self.rays_per_direction
-        # Left side rays (negative angles)
-        for r in range(self.rays_per_direction):
-            self.sensor_rays[RayCastSensor.ANGLE][r] = -((self.rays_per_direction - r) * angle_between_rays)
-        # Center ray
-        self.sensor_rays[RayCastSensor.ANGLE][self.rays_per_direction] = 0.0
-        # Right side rays (positive angles)
-        for r in range(self.rays_per_direction+1, (self.rays_per_direction * 2)+1):
-            self.sensor_rays[RayCastSensor.ANGLE][r] = ((r - self.rays_per_direction) * angle_between_rays)
-
-    def set_perception(self, perception):
+        # Live information of the sensor rays, one NumPy array per field with one element per ray
+        # hit -> bool, hit ON/OFF
+        # distance -> float, distance to the target (-1 if there is no hit)
+        # tag -> int, id of the tag of the object that the ray is hitting (NO_TAG if there is no hit)
+        # angle -> float, degrees from the center. Positive, rays on the right. Negative, rays on the left
+        # object_info -> Information about the object that the ray is hitting (list of dicts or None)
+        self.hit = np.zeros(self.num_rays, dtype=bool)
+        self.distance = np.full(self.num_rays, -1.0)
+        self.tag = np.full(self.num_rays, RayCastSensor.NO_TAG, dtype=np.int16)
+        self.object_info = [None for _ in range(self.num_rays)]
+        self.all_rays = list(range(self.num_rays))
+        # Sequence number of the last frame received (0 -> no frame yet)
+        self.frame_seq = 0
+        # Time (clock of the agent) at which the last frame was received, None if unknown (see Tracing.py)
+        self.frame_time = None
+        # Index {tag: TagHits} of the current frame, built the first time it is used (see tag_index)
+        self._tag_index = {}
+        self._tag_index_seq = 0
+        # Fill the angles of each ray: left side rays (negative angles), center ray and right side rays (positive)
+        angle_between_rays = self.max_ray_degrees / self.rays_per_direction if self.rays_per_direction else 0.0
+        self.angle = (np.arange(self.num_rays) - self.rays_per_direction) * angle_between_rays
+
+        # Geometry of the rays, fixed by the configuration, so the goals do not depend on the number of rays
+        # left, centre, right -> slices of the rays on each side (left and right are empty with a single ray)
+        self.left = slice(0, self.rays_per_direction)
+        self.centre = slice(self.rays_per_direction, self.rays_per_direction + 1)
+        self.right = slice(self.rays_per_direction + 1, self.num_rays)
+        # angles -> list with the angle of each ray, for scalar access (a float, not a NumPy scalar)
+        self.angles = self.angle.tolist()
+        # sin, cos -> of the angle of each ray. direction -> [num_rays x 2] unit vectors of the rays in the frame
+        # of the agent (x to the right, z forwards)
+        radians = np.radians(self.angle)
+        self.sin = np.sin(radians)
+        self.cos = np.cos(radians)
+        self.direction = np.stack((self.sin, self.cos), axis=1)
+        # Rays from the center outwards, the right one first: preference of steering() between equally free rays
+        self.centre_out = sorted(range(self.num_rays), key=lambda ray: (abs(self.angles[ray]), -self.angles[ray]))
+        # Result of the last steering() query, with the frame and the target it was computed for
+        self._steering = None
+        self._steering_key = None
+
+        # Compatibility view of the current frame (see sensor_rays), built the first time it is used
+        self._sensor_rays = None
+        self._sensor_rays_seq = -1
+
+    def set_perception(self, perception, frame_time=None):
         """
         :param perception: Has the form  [[<num_ray_cast>, <hit[1\0]>, <hit_object_info>] ... ]
                            where <hit_object_info> is a dictionary with the form
@@ -53,12 +107,133 @@ class RayCastSensor:
                             or
                                 None
                             if the ray does not hit any object
+        :param frame_time: Time at which the frame was received, if known
         :return:
         """
-        for p in perception:
-            self.sensor_rays[RayCastSensor.HIT][p[0]] = p[1]
-            if p[2] is None:
-                self.sensor_rays[RayCastSensor.DISTANCE][p[0]] = -1
-            else:
-                self.sensor_rays[RayCastSensor.DISTANCE][p[0]] = p[2]["distance"]
-            self.sensor_rays[RayCastSensor.OBJECT_INFO][p[0]] = p[2]
+        if not perception:
+            return
+        rays = [p[0] for p in perception]
+        infos = [p[2] for p in perception]
+        # Unity usually sends all the rays in order, and assigning whole arrays is faster than indexing them
+        if rays == self.all_rays:
+            rays = slice(None)
+            self.object_info[:] = infos
+        else:
+            for ray, info in zip(rays, infos):
+                self.object_info[ray] = info
+        # Bulk update of the arrays
+        self.hit[rays] = [p[1] for p in perception]
+        self.distance[rays] = [-1 if info is None else info["distance"] for info in infos]
+        tag_ids = RayCastSensor.tag_ids
+        tags = [RayCastSensor.NO_TAG if info is None else tag_ids.get(info["tag"]) for info in infos]
+        if None in tags:
+            # There are tags that we have never seen before
+            tags = [RayCastSensor.NO_TAG if info is None else RayCastSensor.tag_id(info["tag"]) for info in infos]
+        self.tag[rays] = tags
+        # New frame
+        self.frame_seq += 1
+        self.frame_time = frame_time
+
+    @property
+    def tag_index(self):
+        """
+        :return: Dictionary {tag: TagHits(rays, min_distance, nearest)} with the objects hit by the rays in the
+                 current frame. It is built only once per frame, so it can be checked many times per tick
+        """
+        if self._tag_index_seq != self.frame_seq:
+            # One pass building the entries directly: with a few rays, the fixed costs (a second pass to convert
+            # the entries, NumPy calls) are most of the cost
+            index = {}
+            for ray, info in enumerate(self.object_info):
+                if info:
+                    tag = info["tag"]
+                    entry = index.get(tag)
+                    if entry is None:
+                        index[tag] = TagHits([ray], info["distance"], ray)
+                    else:
+                        entry.rays.append(ray)
+                        if info["distance"] < entry.min_distance:
+                            index[tag] = TagHits(entry.rays, info["distance"], ray)
+            self._tag_index = index
+            self._tag_index_seq = self.frame_seq
+        return self._tag_index
+
+    @property
+    def sensor_rays(self):
+        """
+        :return: List [4 x num_rays] with the information of the sensor rays in the current frame, kept for
+                 compatibility: row HIT -> hit, row DISTANCE -> distance, row OBJECT_INFO -> object_info,
+                 row ANGLE -> angle. The rows are plain lists (bool, float), like before the NumPy arrays.
+                 They are built once per frame, the first time they are used, and do not change with the
+                 next frames
+        """
+        if self._sensor_rays_seq != self.frame_seq:
+            self._sensor_rays = [self.hit.tolist(), self.distance.tolist(), list(self.object_info), self.angles]
+            self._sensor_rays_seq = self.frame_seq
+        return self._sensor_rays
+
+    def nearest_hit(self, tag):
+        """
+        :param tag: Tag of the objects we are looking for (e.g. "Flower")
+        :return: Index of the ray that hits the nearest object with that tag, or None if no ray hits one
+        """
+        entry = self.tag_index.get(tag)
+        return entry.nearest if entry else None
+
+    def any_hit(self, rays=slice(None)):
+        """
+        :param rays: Slice (or indices) of the rays to check. By default, all of them
+        :return: True if any of those rays hits an object
+        """
+        return bool(self.hit[rays].any())
+
+    def hits_by_tag(self):
+        """
+        :return: Dictionary {tag: array with the indices of the rays hitting objects with that tag}
+        """
+        hits = {}
+        for tag_id in np.unique(self.tag[self.tag != RayCastSensor.NO_TAG]):
+            hits[RayCastSensor.tag_names[tag_id]] = np.flatnonzero(self.tag == tag_id)
+        return hits
+
+    def steering(self, target=None):
+        """
+        Steering query, in one pass over the rays of the current frame
+        :param target: Tag of the objects to head to (e.g. "Astronaut"), or None
+        :return: Steering(bearing, ray, distance, target):
+                 if a ray hits an object with the 'target' tag, the bearing of the nearest one (target -> True);
+                 otherwise, the best free heading: the ray with the longest free distance (ray_length if it hits
+                 nothing), the nearest to the center if there are several
+        """
+        key = (self.frame_seq, target)
+        if key == self._steering_key:
+            return self._steering
+        # The nearest object with the target tag comes from the tag index of the frame
+        entry = self.tag_index.get(target) if target is not None else None
+        if entry is not None:
+            result = Steering(self.angles[entry.nearest], entry.nearest, entry.min_distance, True)
+        else:
+            # Plain lists: with a few rays, a loop over them is faster than NumPy
+            hit, distance, ray_length = self.hit.tolist(), self.distance.tolist(), self.ray_length
+            best_ray, best_distance = None, -1.0
+            for ray in self.centre_out:
+                free_distance = distance[ray] if hit[ray] else ray_length
+                if free_distance > best_distance:
+                    best_ray, best_distance = ray, free_distance
+            result = Steering(self.angles[best_ray], best_ray, best_distance, False)
+        self._steering, self._steering_key = result, key
+        return result
+
+    def min_distance_in_cone(self, deg_lo, deg_hi, tag=None):
+        """
+        :param deg_lo: Lower angle of the cone, in degrees from the center (negative to the left)
+        :param deg_hi: Higher angle of the cone, in degrees from the center (positive to the right)
+        :param tag: If given, only the objects with that tag are considered
+        :return: Distance to the nearest object hit by a ray inside the cone, or None if there is none
+        """
+        mask = self.hit & (self.angle >= deg_lo) & (self.angle <= deg_hi)
+        if tag is not None:
+            mask &= self.tag == RayCastSensor.tag_ids.get(tag, RayCastSensor.NO_TAG)
+        if not mask.any():
+            return None
+        return float(self.distance[mask].min())
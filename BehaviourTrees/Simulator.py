@@ -0,0 +1,566 @@
+import json
+import math
+import random
+import asyncio
+import argparse
+import aiohttp
+from aiohttp import web
+import Codec
+import RayCaster
+
+
+# Tags of the agents in the sensor frames, by agent type. Other types get the type without the "AAgent" prefix
+AGENT_TAGS = {"AAgentCritterMantaRay": "CritterMantaRay", "AAgentAstronaut": "Astronaut"}
+
+# Physics used when the scene does not define them
+DEFAULT_PHYSICS = {
+    # units/s moving forwards or backwards
+    "speed": 2.5,
+    # degrees/s turning
+    "turn_speed": 90.0,
+    # degrees turned by each A/D action
+    "turn_step": 5.0,
+    # radius of the agents
+    "agent_radius": 0.5,
+    # maximum distance from the spawn point at which the agents are placed, so they do not overlap
+    "spawn_jitter": 1.0,
+}
+
+
+class Body:
+    '''
+    Description: An agent in the simulated world, controlled by the actions it receives.
+                 It moves on the x,z plane. The yaw is in degrees, turning right increases it,
+                 and the forward direction is (sin(yaw), cos(yaw)), like in Unity.
+    '''
+    def __init__(self, params, x, z, yaw, radius):
+        '''
+        init method for Body
+        Input: params: dict with the AgentParameters the agent sent in its 'initial_params' message
+               x, z, yaw: float, initial pose of the agent
+               radius: float, radius of the agent
+        '''
+        self.params = params
+        self.name = params["name"]
+        agent_type = params.get("type", "AAgent")
+        self.tag = AGENT_TAGS.get(agent_type, agent_type.replace("AAgent", "", 1) or agent_type)
+        self.x = x
+        self.z = z
+        self.yaw = yaw
+        self.radius = radius
+        # Movement: 1 forwards, -1 backwards, 0 stopped
+        self.moving = 0
+        # Rotation: 1 right, -1 left, 0 no rotation
+        self.turning = 0
+        # Degrees left of the current A/D turn step (0 -> turning till a "nt")
+        self.turn_left = 0.0
+        # Actions the agent is executing, reported in its internal state as currentActions
+        self.current_actions = []
+        # Sensor: [rays_per_direction, max_ray_degrees, sphere_cast_radius, ray_length], with index 0 being
+        # the leftmost ray, like RayCastSensor
+        rays_per_direction, max_ray_degrees, sphere_cast_radius, ray_length = params["ray_perception_sensor_param"]
+        angle_between_rays = max_ray_degrees / rays_per_direction if rays_per_direction else 0.0
+        self.ray_angles = [(i - rays_per_direction) * angle_between_rays for i in range(rays_per_direction * 2 + 1)]
+        self.sphere_cast_radius = sphere_cast_radius
+        self.ray_length = ray_length
+        # Counters used to evaluate the behaviour of the agent
+        self.collisions = 0
+        self.colliding = False
+        self.distance_travelled = 0.0
+        self.actions_received = 0
+
+    def i_state(self, speed):
+        '''
+        :return: internal state of the agent, as sent in the sensor frames
+        '''
+        return {
+            "isRotatingRight": self.turning > 0,
+            "isRotatingLeft": self.turning < 0,
+            "movingForwards": self.moving > 0,
+            "movingBackwards": self.moving < 0,
+            "speed": speed if self.moving else 0.0,
+            "position": {"x": self.x, "y": 0.0, "z": self.z},
+            "rotation": {"x": 0.0, "y": self.yaw, "z": 0.0},
+            "currentActions": list(self.current_actions),
+        }
+
+
+class World:
+    '''
+    Description: 2D world where the agents move: walls (segments), and flowers, astronauts and critters (circles)
+                 loaded from a scene file, plus the agents themselves.
+                 It is independent of the network, so it can be stepped by the websocket server (see Simulator)
+                 or directly in the same process as the agents.
+    '''
+    # Minimum number of agents to cast their rays with the BatchRayCaster
+    BATCH_MIN_BODIES = 4
+
+    def __init__(self, scene: dict, seed=None, batch_rays=True):
+        '''
+        init method for World
+        Input: scene: dict with the scene (see Scene-1.json)
+               seed: seed of the random numbers used to place the agents
+               batch_rays: bool, cast the rays of all the agents at once with RayCaster.BatchRayCaster,
+                           instead of one by one with cast_rays()
+        '''
+        self.physics = dict(DEFAULT_PHYSICS, **scene.get("physics", {}))
+        self.random = random.Random(seed)
+        # Walls: list of (name, x1, z1, x2, z2)
+        self.walls = [(wall.get("name", f"Wall_{i}"), *wall["from"], *wall["to"])
+                      for i, wall in enumerate(scene.get("walls", []))]
+        # Static objects: list of dicts with name, tag, x, z, radius and solid
+        self.objects = []
+        for kind, tag, solid in (("flowers", "Flower", False), ("astronauts", "Astronaut", True),
+                                 ("critters", "CritterMantaRay", True)):
+            for i, obj in enumerate(scene.get(kind, [])):
+                self.objects.append({"name": obj.get("name", f"{tag}_{i}"), "tag": obj.get("tag", tag),
+                                     "x": obj["position"][0], "z": obj["position"][1],
+                                     "radius": obj.get("radius", 0.5), "solid": obj.get("solid", solid)})
+        # Spawn points: list of (x, z, yaw)
+        self.spawn_points = [tuple(point) for point in scene.get("spawn_points", [[0.0, 0.0, 0.0]])]
+        self.bodies = []
+        # Simulated seconds
+        self.time = 0.0
+        self.ray_caster = RayCaster.BatchRayCaster(self) if batch_rays else None
+
+    @classmethod
+    def from_file(cls, scene_path, seed=None, batch_rays=True):
+        with open(scene_path, 'r') as file:
+            return cls(json.load(file), seed, batch_rays)
+
+    def add_body(self, params: dict):
+        '''
+        Adds the agent with parameters 'params' at its spawn point
+        :return: the Body of the agent, or None if it can not be created (like Unity, that answers "error")
+        '''
+        spawn_point = params.get("spawn_point", 0)
+        if not 0 <= spawn_point < len(self.spawn_points) or "ray_perception_sensor_param" not in params:
+            return None
+        x, z, yaw = self.spawn_points[spawn_point]
+        jitter = self.physics["spawn_jitter"]
+        body = Body(params, x + self.random.uniform(-jitter, jitter), z + self.random.uniform(-jitter, jitter),
+                    yaw, self.physics["agent_radius"])
+        self.bodies.append(body)
+        return body
+
+    def remove_body(self, body: Body):
+        if body in self.bodies:
+            self.bodies.remove(body)
+
+    def apply_action(self, body: Body, action: str):
+        '''
+        Applies an action sent by an agent:
+            mf / W: move forwards      stop / S: stop moving
+            tr: turn right             tl: turn left          nt: stop turning
+            D: turn right one step     A: turn left one step
+        '''
+        body.actions_received += 1
+        if action == "mf" or action == "W":
+            body.moving = 1
+        elif action == "stop" or action == "S":
+            body.moving = 0
+        elif action == "tr" or action == "tl":
+            body.turning = 1 if action == "tr" else -1
+            body.turn_left = 0.0
+        elif action == "nt":
+            body.turning = 0
+            body.turn_left = 0.0
+        elif action == "D" or action == "A":
+            body.turning = 1 if action == "D" else -1
+            body.turn_left = self.physics["turn_step"]
+        else:
+            print(f"Unknown action {action} from {body.name}")
+        self.update_current_actions(body)
+
+    def update_current_actions(self, body: Body):
+        body.current_actions = []
+        if body.moving > 0:
+            body.current_actions.append("W")
+        if body.turning > 0:
+            body.current_actions.append("D")
+        elif body.turning < 0:
+            body.current_actions.append("A")
+
+    def step(self, dt: float):
+        '''
+        Moves all the agents 'dt' seconds
+        '''
+        self.time += dt
+        for body in self.bodies:
+            if body.turning:
+                turn = self.physics["turn_speed"] * dt
+                if body.turn_left > 0:
+                    turn = min(turn, body.turn_left)
+                    body.turn_left -= turn
+                    if body.turn_left <= 0:
+                        body.turning = 0
+                        body.turn_left = 0.0
+                        self.update_current_actions(body)
+                body.yaw = (body.yaw + body.turning * turn) % 360
+            if body.moving:
+                distance = body.moving * self.physics["speed"] * dt
+                yaw = math.radians(body.yaw)
+                x = body.x + math.sin(yaw) * distance
+                z = body.z + math.cos(yaw) * distance
+                if self.collides(body, x, z):
+                    # The agent does not go through the obstacle, and a new collision is counted when it starts
+                    if not body.colliding:
+                        body.collisions += 1
+                    body.colliding = True
+                else:
+                    body.colliding = False
+                    body.x, body.z = x, z
+                    body.distance_travelled += abs(distance)
+
+    def collides(self, body: Body, x: float, z: float):
+        '''
+        :return: True if the agent 'body' at (x, z) overlaps a wall, a solid object or another agent
+        '''
+        for _, x1, z1, x2, z2 in self.walls:
+            if point_segment_distance(x, z, x1, z1, x2, z2) < body.radius:
+                return True
+        for obj in self.objects:
+            if obj["solid"] and (x - obj["x"]) ** 2 + (z - obj["z"]) ** 2 < (body.radius + obj["radius"]) ** 2:
+                return True
+        for other in self.bodies:
+            if other is not body and (x - other.x) ** 2 + (z - other.z) ** 2 < (body.radius + other.radius) ** 2:
+                # Only an agent getting closer to the other one collides, so they can move apart
+                if (x - other.x) ** 2 + (z - other.z) ** 2 < (body.x - other.x) ** 2 + (body.z - other.z) ** 2:
+                    return True
+        return False
+
+    def cast_rays(self, body: Body):
+        '''
+        Casts the rays of the sensor of 'body'. The objects are inflated by the radius of the sphere cast
+        (the walls are not, they are thin enough)
+        :return: perception, as expected by RayCastSensor.set_perception()
+        '''
+        perception = []
+        circles = [(obj["name"], obj["tag"], obj["x"], obj["z"], obj["radius"]) for obj in self.objects]
+        circles += [(other.name, other.tag, other.x, other.z, other.radius) for other in self.bodies
+                    if other is not body]
+        for i, angle in enumerate(body.ray_angles):
+            yaw = math.radians(body.yaw + angle)
+            dx, dz = math.sin(yaw), math.cos(yaw)
+            nearest = None
+            nearest_distance = body.ray_length
+            for name, x1, z1, x2, z2 in self.walls:
+                t = ray_segment_distance(body.x, body.z, dx, dz, x1, z1, x2, z2)
+                if t is not None and t <= nearest_distance:
+                    nearest, nearest_distance = (name, "Wall"), t
+            for name, tag, cx, cz, radius in circles:
+                t = ray_circle_distance(body.x, body.z, dx, dz, cx, cz, radius + body.sphere_cast_radius)
+                if t is not None and t <= nearest_distance:
+                    nearest, nearest_distance = (name, tag), t
+            if nearest is None:
+                perception.append([i, 0, None])
+            else:
+                perception.append([i, 1, {"name": nearest[0], "tag": nearest[1],
+                                          "distance": round(nearest_distance, 3)}])
+        return perception
+
+    def perceive_all(self, bodies):
+        '''
+        Casts the rays of the agents in 'bodies'
+        :return: list with the perception of each agent
+        '''
+        # With a few agents the fixed cost of the NumPy calls is higher than casting the rays one by one
+        if self.ray_caster is not None and len(bodies) >= self.BATCH_MIN_BODIES:
+            return self.ray_caster.cast_all(bodies)
+        return [self.cast_rays(body) for body in bodies]
+
+    def sensor_frame(self, body: Body, perception=None):
+        '''
+        :return: 'sensor' message for the agent 'body', with its perception (cast now if it is None)
+                 and internal state
+        '''
+        if perception is None:
+            perception = self.cast_rays(body)
+        return {"Type": "sensor", "Content": [perception, body.i_state(self.physics["speed"])]}
+
+
+def point_segment_distance(px, pz, x1, z1, x2, z2):
+    '''
+    :return: distance from the point (px, pz) to the segment (x1, z1)-(x2, z2)
+    '''
+    sx, sz = x2 - x1, z2 - z1
+    length2 = sx * sx + sz * sz
+    u = 0.0 if length2 == 0 else max(0.0, min(1.0, ((px - x1) * sx + (pz - z1) * sz) / length2))
+    return math.hypot(px - x1 - u * sx, pz - z1 - u * sz)
+
+
+def ray_segment_distance(ox, oz, dx, dz, x1, z1, x2, z2):
+    '''
+    :return: distance from (ox, oz) along the unit direction (dx, dz) to the segment (x1, z1)-(x2, z2),
+             or None if the ray does not hit it
+    '''
+    sx, sz = x2 - x1, z2 - z1
+    denominator = dx * sz - dz * sx
+    if denominator == 0:
+        return None
+    wx, wz = x1 - ox, z1 - oz
+    t = (wx * sz - wz * sx) / denominator
+    u = (wx * dz - wz * dx) / denominator
+    if t < 0 or u < 0 or u > 1:
+        return None
+    return t
+
+
+def ray_circle_distance(ox, oz, dx, dz, cx, cz, radius):
+    '''
+    :return: distance from (ox, oz) along the unit direction (dx, dz) to the circle with center (cx, cz),
+             or None if the ray does not hit it (or starts inside it)
+    '''
+    wx, wz = cx - ox, cz - oz
+    projection = wx * dx + wz * dz
+    d2 = wx * wx + wz * wz - projection * projection
+    if projection < 0 or d2 > radius * radius:
+        return None
+    t = projection - math.sqrt(radius * radius - d2)
+    return t if t >= 0 else None
+
+
+class Connection:
+    '''
+    Description: Websocket of an agent connected to the Simulator. The agent is answered with the codec it uses:
+                 msgpack if it sends BINARY frames, JSON otherwise
+    '''
+    def __init__(self, ws):
+        self.ws = ws
+        self.codec = Codec.get_codec()
+        self.body = None
+
+    def decode(self, data, binary=False):
+        if binary:
+            self.codec = Codec.get_codec("msgpack")
+        return self.codec.decode(data)
+
+    async def send(self, msg: dict):
+        if self.codec.binary:
+            await self.ws.send_bytes(self.codec.encode(msg))
+        else:
+            await self.ws.send_str(self.codec.encode(msg))
+
+    async def close(self):
+        await self.ws.close()
+
+
+class Simulator:
+    '''
+    Description: Stand-in of the Unity server, to run and benchmark the agents without Unity.
+                 It speaks the same websocket protocol:
+                     agent -> server: initial_params, action, actions (list of actions sent in one frame)
+                     server -> agent: sim_control (connection_ready | start | on_hold | error),
+                                      agent_control (goal:<goal> | bt:<behaviour tree>), sensor
+                 The world is stepped 'physics_rate' times per second and every agent receives
+                 'sensor_rate' sensor frames per second.
+    '''
+    def __init__(self, world: World, sensor_rate=20.0, physics_rate=50.0, auto_start=True, control=None,
+                 stats_interval=0.0):
+        '''
+        init method for Simulator
+        Input: world: World to simulate
+               sensor_rate: float, sensor frames per second sent to each agent
+               physics_rate: float, steps of the world per second
+               auto_start: bool, start the simulation as soon as an agent is connected
+               control: str, agent_control message sent to the agents when they start (e.g. "bt:BTCritter")
+               stats_interval: float, seconds between stats printed (0 -> no stats)
+        '''
+        self.world = world
+        self.sensor_rate = sensor_rate
+        self.physics_rate = physics_rate
+        self.auto_start = auto_start
+        self.control = control
+        self.stats_interval = stats_interval
+        self.connections = []
+        self.running = False
+        # False during an outage: the agents are disconnected and cannot connect (see outage())
+        self.accepting = True
+        # Counters
+        self.frames_sent = 0
+        self.actions_received = 0
+        self.step_time = 0.0
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get("/", self.handle_agent)
+        app.on_startup.append(self.start_background_tasks)
+        return app
+
+    async def start_background_tasks(self, app):
+        app["simulator_tasks"] = self.start_tasks()
+
+    def start_tasks(self):
+        '''
+        Starts the physics loop (and the stats loop) in the running event loop
+        :return: list with the tasks
+        '''
+        tasks = [asyncio.create_task(self.physics_loop())]
+        if self.stats_interval > 0:
+            tasks.append(asyncio.create_task(self.stats_loop()))
+        return tasks
+
+    async def handle_agent(self, request):
+        '''
+        Websocket handler of an agent, from its initial parameters till it disconnects
+        '''
+        if not self.accepting:
+            return web.Response(status=503, text="The simulator is not accepting connections")
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        connection = Connection(ws)
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT or msg.type == aiohttp.WSMsgType.BINARY:
+                    await self.receive(connection, msg.data, msg.type == aiohttp.WSMsgType.BINARY)
+        finally:
+            self.disconnect(connection)
+        return ws
+
+    async def receive(self, connection: Connection, data, binary=False):
+        '''
+        Processes a message of an agent
+        Input: connection: Connection of the agent
+               data: str (TEXT frame) or bytes (BINARY frame) with the message
+               binary: bool, True if it came in a BINARY frame
+        '''
+        try:
+            msg_dict = connection.decode(data, binary)
+            msg_type, content = msg_dict["type"], msg_dict["content"]
+        except (ValueError, KeyError, TypeError):
+            print(f"Wrong message: {data!r}")
+            return
+        if msg_type == "action" and connection.body is not None:
+            self.actions_received += 1
+            self.world.apply_action(connection.body, content)
+        elif msg_type == "actions" and connection.body is not None:
+            # Batch of actions of a tick (see Outbound.py), applied in order
+            for action in content:
+                self.actions_received += 1
+                self.world.apply_action(connection.body, action)
+        elif msg_type == "initial_params" and connection.body is None:
+            await self.connect_agent(connection, json.loads(content))
+
+    def disconnect(self, connection: Connection):
+        '''
+        Removes the agent of 'connection' from the simulation
+        '''
+        if connection in self.connections:
+            self.connections.remove(connection)
+        if connection.body is not None:
+            self.world.remove_body(connection.body)
+            connection.body = None
+
+    async def connect_agent(self, connection: Connection, params: dict):
+        connection.body = self.world.add_body(params)
+        if connection.body is None:
+            await connection.send({"Type": "sim_control", "Content": "error"})
+            return
+        await connection.send({"Type": "sim_control", "Content": "connection_ready"})
+        self.connections.append(connection)
+        if self.auto_start:
+            self.running = True
+        if self.running:
+            await self.start_agent(connection)
+
+    async def start_agent(self, connection: Connection):
+        await connection.send({"Type": "sim_control", "Content": "start"})
+        if self.control:
+            await connection.send({"Type": "agent_control", "Content": self.control})
+
+    async def start(self):
+        '''
+        Starts (or resumes) the simulation of all the agents
+        '''
+        self.running = True
+        for connection in list(self.connections):
+            await self.start_agent(connection)
+
+    async def on_hold(self):
+        '''
+        Pauses the simulation of all the agents
+        '''
+        self.running = False
+        await self.broadcast({"Type": "sim_control", "Content": "on_hold"})
+
+    async def outage(self, duration: float):
+        '''
+        Simulates a hiccup of Unity: disconnects all the agents and does not accept connections during
+        'duration' seconds
+        '''
+        self.accepting = False
+        for connection in list(self.connections):
+            self.disconnect(connection)
+            try:
+                await connection.close()
+            except ConnectionError:
+                pass
+        await asyncio.sleep(duration)
+        self.accepting = True
+
+    async def broadcast(self, msg: dict):
+        for connection in list(self.connections):
+            try:
+                await connection.send(msg)
+            except ConnectionError:
+                pass
+
+    async def physics_loop(self):
+        '''
+        Steps the world at a fixed rate and sends the sensor frames to the agents
+        '''
+        loop = asyncio.get_running_loop()
+        dt = 1.0 / self.physics_rate
+        sensor_period = 1.0 / self.sensor_rate
+        next_step = next_sensor = loop.time()
+        while True:
+            next_step += dt
+            if self.running:
+                start = loop.time()
+                self.world.step(dt)
+                if loop.time() >= next_sensor:
+                    next_sensor += sensor_period
+                    await self.send_sensor_frames()
+                self.step_time += loop.time() - start
+            await asyncio.sleep(max(0.0, next_step - loop.time()))
+
+    async def send_sensor_frames(self):
+        connections = list(self.connections)
+        perceptions = self.world.perceive_all([connection.body for connection in connections])
+        for connection, perception in zip(connections, perceptions):
+            try:
+                await connection.send(self.world.sensor_frame(connection.body, perception))
+                self.frames_sent += 1
+            except ConnectionError:
+                pass
+
+    async def stats_loop(self):
+        prev_frames = prev_actions = 0
+        prev_step_time = 0.0
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            print(f"agents: {len(self.connections)}  "
+                  f"frames/s: {(self.frames_sent - prev_frames) / self.stats_interval:.0f}  "
+                  f"actions/s: {(self.actions_received - prev_actions) / self.stats_interval:.0f}  "
+                  f"load: {100 * (self.step_time - prev_step_time) / self.stats_interval:.1f}%")
+            prev_frames, prev_actions, prev_step_time = self.frames_sent, self.actions_received, self.step_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in of the Unity server for the agents")
+    parser.add_argument("scene", nargs="?", default="Scene-1.json", help="scene file (default: Scene-1.json)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4649)
+    parser.add_argument("--sensor-rate", type=float, default=20.0, help="sensor frames/s per agent")
+    parser.add_argument("--physics-rate", type=float, default=50.0, help="steps/s of the world")
+    parser.add_argument("--control", help="agent_control message sent at start, e.g. bt:BTCritter")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--python-rays", action="store_true", help="cast the rays one by one, without NumPy")
+    parser.add_argument("--stats", type=float, default=5.0, help="seconds between stats (0 -> none)")
+    args = parser.parse_args()
+
+    simulator = Simulator(World.from_file(args.scene, args.seed, not args.python_rays), sensor_rate=args.sensor_rate,
+                          physics_rate=args.physics_rate, control=args.control, stats_interval=args.stats)
+    print(f"Simulating {args.scene} on ws://{args.host}:{args.port}/")
+    web.run_app(simulator.create_app(), host=args.host, port=args.port, print=None)
+    print("Bye!!!")
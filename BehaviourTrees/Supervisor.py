@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import queue
+import asyncio
+import multiprocessing
+import AgentHost
+
+
+def shard_configs(config_paths, num_workers):
+    '''
+    Description: Splits the configuration files between the workers in a round robin way
+    Input: config_paths: list of configuration files
+           num_workers: int, number of worker processes
+    Output: shards: list with a (non empty) list of configuration files per worker
+    '''
+    shards = [config_paths[i::num_workers] for i in range(num_workers)]
+    return [shard for shard in shards if shard]
+
+
+async def report_stats(worker_id, agents, stats_queue, interval):
+    '''
+    Description: Sends to the supervisor, every 'interval' seconds, the stats of the agents of a worker:
+                 ticks/s and messages/s of all its agents and the latency of its event loop, measured as
+                 the delay of a sleep with respect to the requested time
+    '''
+    loop = asyncio.get_running_loop()
+    prev_ticks = prev_messages = 0
+    prev_time = loop.time()
+    while True:
+        await asyncio.sleep(interval)
+        now = loop.time()
+        elapsed = now - prev_time
+        ticks = sum(agent.ticks for agent in agents)
+        messages = sum(agent.messages_received + agent.messages_sent for agent in agents)
+        stats_queue.put({
+            "worker": worker_id,
+            "pid": os.getpid(),
+            "agents": len(agents),
+            "alive": sum(not agent.exit_event.is_set() for agent in agents),
+            "ticks_per_s": (ticks - prev_ticks) / elapsed,
+            "messages_per_s": (messages - prev_messages) / elapsed,
+            "latency_ms": (elapsed - interval) * 1000,
+        })
+        prev_ticks, prev_messages, prev_time = ticks, messages, now
+
+
+def worker_main(worker_id, config_paths, stats_queue, stats_interval):
+    '''
+    Description: Entry point of a worker process. It runs all its agents in its own event loop
+    '''
+    async def monitor(agents):
+        await report_stats(worker_id, agents, stats_queue, stats_interval)
+
+    asyncio.run(AgentHost.run_agents(config_paths, monitor=monitor))
+
+
+class Supervisor:
+    '''
+    Description: Spreads a fleet of agents between several worker processes (one per core by default),
+                 each one running many agents on its own event loop (see AgentHost.py).
+                 The workers that crash are restarted and their stats are gathered and printed.
+                 A process per worker is used instead of a ProcessPoolExecutor because a crashed worker
+                 breaks the whole pool, and here we want to restart only the crashed shard.
+    '''
+    def __init__(self, config_paths, num_workers=None, max_restarts=3, stats_interval=5.0):
+        '''
+        init method for Supervisor
+        Input: config_paths: list of configuration files
+               num_workers: int, number of worker processes (by default, the number of cores)
+               max_restarts: int, maximum number of times a worker is restarted after crashing
+               stats_interval: float, seconds between stats reports
+        '''
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.shards = shard_configs(config_paths, self.num_workers)
+        self.max_restarts = max_restarts
+        self.stats_interval = stats_interval
+        # 'spawn' avoids inheriting the state of this process (event loops, sockets...)
+        self.context = multiprocessing.get_context("spawn")
+        self.stats_queue = self.context.Queue()
+        self.workers = {}
+        self.restarts = {worker_id: 0 for worker_id in range(len(self.shards))}
+        # Last stats received from each worker
+        self.stats = {}
+
+    def start_worker(self, worker_id):
+        '''
+        Starts (or restarts) the worker process 'worker_id'
+        '''
+        worker = self.context.Process(target=worker_main, name=f"AgentWorker-{worker_id}",
+                                      args=(worker_id, self.shards[worker_id], self.stats_queue, self.stats_interval))
+        worker.start()
+        self.workers[worker_id] = worker
+
+    def check_workers(self):
+        '''
+        Restarts the workers that have crashed
+        :return: number of workers still running
+        '''
+        for worker_id, worker in list(self.workers.items()):
+            if worker.is_alive():
+                continue
+            del self.workers[worker_id]
+            if worker.exitcode == 0:
+                print(f"Worker {worker_id} finished")
+            elif self.restarts[worker_id] < self.max_restarts:
+                self.restarts[worker_id] += 1
+                print(f"Worker {worker_id} crashed (exit code {worker.exitcode}), "
+                      f"restart {self.restarts[worker_id]}/{self.max_restarts}")
+                self.start_worker(worker_id)
+            else:
+                print(f"Worker {worker_id} crashed (exit code {worker.exitcode}), too many restarts")
+        return len(self.workers)
+
+    def print_stats(self):
+        '''
+        Prints the last stats of each worker and the totals of the fleet
+        '''
+        print(f"{'worker':>6}{'pid':>8}{'agents':>8}{'alive':>7}{'ticks/s':>10}{'msgs/s':>10}"
+              f"{'latency(ms)':>13}{'restarts':>10}")
+        for worker_id, s in sorted(self.stats.items()):
+            print(f"{worker_id:>6}{s['pid']:>8}{s['agents']:>8}{s['alive']:>7}{s['ticks_per_s']:>10.1f}"
+                  f"{s['messages_per_s']:>10.1f}{s['latency_ms']:>13.2f}{self.restarts[worker_id]:>10}")
+        print(f"{'total':>6}{'':>8}{sum(s['agents'] for s in self.stats.values()):>8}"
+              f"{sum(s['alive'] for s in self.stats.values()):>7}"
+              f"{sum(s['ticks_per_s'] for s in self.stats.values()):>10.1f}"
+              f"{sum(s['messages_per_s'] for s in self.stats.values()):>10.1f}")
+
+    def run(self):
+        '''
+        Starts all the workers and supervises them till all of them have finished
+        '''
+        for worker_id in range(len(self.shards)):
+            self.start_worker(worker_id)
+        print(f"Supervising {len(self.shards)} workers")
+        next_print = time.monotonic() + self.stats_interval
+        try:
+            while self.check_workers():
+                # Gather the stats sent by the workers
+                try:
+                    s = self.stats_queue.get(timeout=0.5)
+                    self.stats[s["worker"]] = s
+                except queue.Empty:
+                    pass
+                if time.monotonic() >= next_print and self.stats:
+                    self.print_stats()
+                    next_print = time.monotonic() + self.stats_interval
+        finally:
+            for worker in self.workers.values():
+                worker.terminate()
+                worker.join()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python Supervisor.py [--workers N] <init_file.json | glob> ...")
+    else:
+        args = sys.argv[1:]
+        num_workers = None
+        if args[0] == "--workers":
+            num_workers = int(args[1])
+            args = args[2:]
+        # Get the names of the files with the initial parameters of each agent
+        init_files = AgentHost.expand_config_paths(args)
+
+        Supervisor(init_files, num_workers=num_workers).run()
+
+        print("Bye!!!")
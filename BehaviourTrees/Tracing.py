@@ -0,0 +1,126 @@
+import json
+import Metrics
+
+
+class Tracer:
+    '''
+    Description: Perception-to-action latency of an agent. Every sensor frame is stamped with the clock of the
+                 agent when it is received, and the stamp travels with the perception (RayCastSensor.frame_time).
+                 Two kinds of latencies are recorded when an action is sent (AAgent.send_message()):
+                     - Reaction of a detection node (e.g. BN_DetectObstacle): from the frame in which it detected
+                       something to the first action sent by the goal that reacts to it (e.g. Avoid), matched by
+                       the name the goal passes with its actions. It is measured again once the node stops
+                       detecting it (lost()) and detects it again.
+                     - Decision of a goal (e.g. Avoid): the goal passes its name when it sends an action decided
+                       with the current perception, and the latency is measured from the frame of that perception.
+                 The latencies are kept in histograms per behaviour (p50/p99 in report()), also exported by the
+                 Metrics registry of the agent, and optionally as events of a Chrome trace (chrome://tracing or
+                 https://ui.perfetto.dev).
+    '''
+    def __init__(self, clock, metrics: Metrics.Registry, enabled=True, record_events=False, name="agent",
+                 max_events=100000):
+        '''
+        init method for Tracer
+        Input: clock: function that returns the current time in seconds (the clock of the agent)
+               metrics: Metrics.Registry where the histograms are exported
+               enabled: bool, False -> nothing is traced
+               record_events: bool, keep the events for dump_chrome_trace()
+               name: str, name of the agent (process of the Chrome trace)
+               max_events: int, maximum number of events kept
+        '''
+        self.clock = clock
+        self.metrics = metrics
+        self.enabled = enabled
+        self.record_events = record_events
+        self.name = name
+        self.max_events = max_events
+        # {behaviour: Histogram} of the latencies, in seconds
+        self.latencies = {}
+        # Detections waiting for their first action: {behaviour: (frame_seq, frame_time, reaction)}
+        self.pending = {}
+        # Detections whose reaction has already been measured
+        self.reacted = set()
+        # Events of the Chrome trace
+        self.events = []
+        self.events_dropped = 0
+
+    def histogram(self, behaviour):
+        histogram = self.latencies.get(behaviour)
+        if histogram is None:
+            help_text = "Time from the sensor frame to the action sent by a behaviour"
+            histogram = self.metrics.histogram("aagent_reaction_seconds", help_text, behaviour=behaviour)
+            if not isinstance(histogram, Metrics.Histogram):
+                # The metrics are switched off, but the tracer still reports the latencies
+                histogram = Metrics.Histogram("aagent_reaction_seconds", help_text, {"behaviour": behaviour})
+            self.latencies[behaviour] = histogram
+        return histogram
+
+    def detected(self, behaviour, sensor, reaction=None):
+        '''
+        A detection node has detected something in the current frame of 'sensor'
+        Input: behaviour: str, name of the detection node
+               sensor: RayCastSensor of the agent
+               reaction: str, name of the goal that reacts to the detection (the 'trace' of its actions, see
+                         AAgent.send_message()). None -> the first action sent, whoever sends it
+        '''
+        if self.enabled and behaviour not in self.pending and behaviour not in self.reacted \
+                and sensor.frame_time is not None:
+            self.pending[behaviour] = (sensor.frame_seq, sensor.frame_time, reaction)
+
+    def lost(self, behaviour):
+        '''
+        A detection node does not detect anything in the current frame
+        '''
+        if self.pending or self.reacted:
+            self.pending.pop(behaviour, None)
+            self.reacted.discard(behaviour)
+
+    def action_sent(self, action, behaviour=None, sensor=None):
+        '''
+        Records the latencies of the action 'action', that is being sent now
+        Input: action: str, the action
+               behaviour: str, name of the goal that decided it with the current perception of 'sensor', or None.
+                          The detections that this goal reacts to are resolved with it (see detected())
+               sensor: RayCastSensor of the agent
+        '''
+        if not self.enabled:
+            return
+        now = self.clock()
+        if self.pending:
+            # Only the detections this action reacts to: other behaviours (e.g. a goal being cancelled, or
+            # roaming) may send actions before the goal that reacts to the detection does
+            reactions = [detection for detection, (_, _, reaction) in self.pending.items()
+                         if reaction is None or reaction == behaviour]
+            for detection in reactions:
+                frame_seq, frame_time, _ = self.pending.pop(detection)
+                self.record(detection, frame_seq, frame_time, now, action)
+                self.reacted.add(detection)
+        if behaviour is not None and sensor is not None and sensor.frame_time is not None:
+            self.record(behaviour, sensor.frame_seq, sensor.frame_time, now, action)
+
+    def record(self, behaviour, frame_seq, frame_time, now, action):
+        self.histogram(behaviour).observe(now - frame_time)
+        if self.record_events:
+            if len(self.events) < self.max_events:
+                # Complete event ("X") from the reception of the frame to the action, in microseconds
+                self.events.append({"name": f"{behaviour} -> {action}", "cat": "reaction", "ph": "X",
+                                    "ts": frame_time * 1e6, "dur": (now - frame_time) * 1e6, "pid": self.name,
+                                    "tid": behaviour, "args": {"frame": frame_seq, "action": action}})
+            else:
+                self.events_dropped += 1
+
+    def report(self):
+        '''
+        :return: dict {behaviour: {"count", "p50", "p90", "p99"}} with the latencies in seconds
+        '''
+        return {behaviour: {"count": histogram.count, "p50": histogram.quantile(0.5),
+                            "p90": histogram.quantile(0.9), "p99": histogram.quantile(0.99)}
+                for behaviour, histogram in sorted(self.latencies.items())}
+
+    def dump_chrome_trace(self, path):
+        '''
+        Writes the events in the Chrome trace event format (JSON)
+        '''
+        with open(path, 'w') as file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms",
+                       "otherData": {"agent": self.name, "events_dropped": self.events_dropped}}, file)
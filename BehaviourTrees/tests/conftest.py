@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the agent import each other by name, from the directory of the agent
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
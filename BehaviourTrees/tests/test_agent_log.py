@@ -0,0 +1,44 @@
+import logging
+import pytest
+import AgentLog
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def records(monkeypatch):
+    handler = Capture()
+    monkeypatch.setattr(AgentLog, "writer", None)
+    monkeypatch.setattr(AgentLog, "output_handler", handler)
+    return handler.records
+
+
+def test_rate_limit_drops_and_reports(records):
+    logger = AgentLog.AgentLogger("agent", lambda: 0.0, rate=1.0, burst=2)
+    for _ in range(5):
+        logger.info("event")
+    assert len(records) == 2 and logger.records_suppressed == 3
+
+
+def test_errors_are_never_dropped(records):
+    now = [0.0]
+    logger = AgentLog.AgentLogger("agent", lambda: now[0], rate=1.0, burst=2)
+    for _ in range(5):
+        logger.info("event")
+    for _ in range(3):
+        logger.error("event", "failed")
+    errors = [record for record in records if record.levelno == logging.ERROR]
+    assert len(errors) == 3
+    # The first error reports the records dropped before it
+    assert [record.suppressed for record in errors] == [3, 0, 0]
+    # Errors do not take tokens from the other records of the event
+    now[0] = 1.0
+    logger.info("event")
+    assert records[-1].levelno == logging.INFO and logger.records_suppressed == 3
@@ -0,0 +1,74 @@
+import json
+import os
+import contextlib
+import pytest
+import Control
+import Headless
+import Benchmarks
+
+MOVES = 10
+
+
+def test_stopped_learns_the_lead():
+    predictor = Control.StopPredictor("move", predictive=True, lead=0.05, alpha=0.5)
+    # Stop sent 1 unit before the target at 2 units/s, ended 0.6 units before it: it went on for 0.2 s
+    predictor.stopped(1.0, 2.0, 0.6)
+    assert predictor.lead == pytest.approx(0.125)
+    for _ in range(20):
+        predictor.stopped(1.0, 2.0, 0.6)
+    assert predictor.lead == pytest.approx(0.2)
+    stats = predictor.stats()
+    assert stats["stops"] == 21
+    assert stats["mean"] == pytest.approx(-0.6)
+
+
+def test_stopped_clamps_the_lead():
+    predictor = Control.StopPredictor("turn", lead=0.05, alpha=1.0)
+    # Ended further from the target than when the stop was sent: no negative lead
+    predictor.stopped(10.0, 90.0, 20.0)
+    assert predictor.lead == 0.0
+    # Went on for more than a second: at most a second
+    predictor.stopped(300.0, 90.0, -30.0)
+    assert predictor.lead == 1.0
+    # Not moving when the stop was sent: nothing to learn, but the error is recorded
+    predictor.stopped(5.0, 0.0, 1.0)
+    assert predictor.lead == 1.0
+    assert predictor.stats()["stops"] == 3
+
+
+def test_should_stop_uses_the_lead():
+    predictor = Control.StopPredictor("move", predictive=True, lead=0.1)
+    # 1 unit/s with 0.1 s of lead and frames every 0.05 s: stopping now lands 0.02 short, at the next frame
+    # 0.03 beyond
+    assert predictor.should_stop(0.12, 1.0, 0.05)
+    # Stopping at the next frame lands closer
+    assert not predictor.should_stop(0.3, 1.0, 0.05)
+    assert predictor.early_stops == 1
+    # Without the predictive stop, only once the target is reached
+    predictor.predictive = False
+    assert not predictor.should_stop(0.15, 1.0, 0.05)
+    assert predictor.should_stop(0.0, 1.0, 0.05)
+
+
+@pytest.mark.parametrize("latency", [0.0, 0.05])
+def test_predictive_stop_overshoot(tmp_path, latency):
+    '''
+    Description: ForwardDist and Turn in an empty simulated world (see Simulator.World), with the predictive stop:
+                 the stops land close to the targets, with and without network latency
+    '''
+    scene = os.path.join(tmp_path, "Empty.json")
+    with open(scene, "w") as file:
+        json.dump({"spawn_points": [[0.0, 0.0, 0.0]]}, file)
+    config_path = os.path.join(Benchmarks.BASE_DIR, "AAgent-1.json")
+    with contextlib.redirect_stdout(None):
+        world, agents, bodies = Headless.run_headless(
+            scene, [config_path], MOVES * 30.0, None, 0, runtime={"predictive_stop": True, "log_level": "OFF"},
+            latency=latency, script=lambda agents: Benchmarks.stop_script(agents, MOVES))
+    move = agents[0].stop_predictors["move"].stats()
+    turn = agents[0].stop_predictors["turn"].stats()
+    assert move["stops"] >= MOVES - 1 and turn["stops"] >= MOVES - 1
+    # Units and degrees beyond the target, negative if short of it (without the predictive stop, with 50 ms of
+    # latency: up to 0.37 units and 13 degrees beyond, +0.31 units and +11 degrees on average)
+    moves, turns = agents[0].stop_predictors["move"].errors, agents[0].stop_predictors["turn"].errors
+    assert max(moves) < 0.2 and abs(move["mean"]) < 0.1
+    assert max(turns) < 8.0 and abs(turn["mean"]) < 2.5
@@ -0,0 +1,102 @@
+import random
+import pytest
+import py_trees as pt
+from py_trees import common
+import FlatTree
+
+STATUSES = (common.Status.SUCCESS, common.Status.FAILURE, common.Status.RUNNING)
+TICKS = 40
+
+
+class Scripted(pt.behaviour.Behaviour):
+    '''
+    Description: Leaf that returns the status of its script for the current tick, and records the calls to
+                 initialise() and terminate() in the log shared by the tree
+    '''
+    def __init__(self, name, script, clock, log):
+        super().__init__(name)
+        self.script = script
+        self.clock = clock
+        self.log = log
+
+    def initialise(self):
+        self.log.append(("initialise", self.name))
+
+    def update(self):
+        return self.script[self.clock[0]]
+
+    def terminate(self, new_status):
+        self.log.append(("terminate", self.name, new_status))
+
+
+def make_tree(seed, clock, log, depth=3):
+    '''
+    Description: Random tree of Sequences, Selectors (with and without memory) and Parallels (all the policies,
+                 with and without synchronise) with Scripted leaves. The same seed gives the same tree
+    Output: root of the tree
+    '''
+    rng = random.Random(seed)
+    names = iter(range(10 ** 6))
+
+    def leaf():
+        # Mostly one status for a few ticks in a row, like the behaviours of the agents
+        script, status = [], rng.choice(STATUSES)
+        for _ in range(TICKS):
+            if rng.random() < 0.3:
+                status = rng.choice(STATUSES)
+            script.append(status)
+        return Scripted(f"leaf{next(names)}", script, clock, log)
+
+    def node(level):
+        if level == depth or rng.random() < 0.25:
+            return leaf()
+        children = [node(level + 1) for _ in range(rng.randint(1, 4))]
+        name = f"node{next(names)}"
+        kind = rng.choice(("sequence", "selector", "parallel"))
+        if kind == "sequence":
+            return pt.composites.Sequence(name, memory=rng.random() < 0.5, children=children)
+        if kind == "selector":
+            return pt.composites.Selector(name, memory=rng.random() < 0.5, children=children)
+        synchronise = rng.random() < 0.5
+        policy = rng.choice(("all", "one", "selected"))
+        if policy == "all":
+            policy = common.ParallelPolicy.SuccessOnAll(synchronise=synchronise)
+        elif policy == "one":
+            policy = common.ParallelPolicy.SuccessOnOne()
+        else:
+            policy = common.ParallelPolicy.SuccessOnSelected(rng.sample(children, rng.randint(1, len(children))),
+                                                             synchronise=synchronise)
+        return pt.composites.Parallel(name, policy=policy, children=children)
+
+    return node(0)
+
+
+def run(executor, seed):
+    '''
+    Output: for every tick, the status of the root, the status of every node and the calls to initialise() and
+            terminate() of the leaves, ticking the tree of 'seed' with 'executor'
+    '''
+    clock, log = [0], []
+    root = make_tree(seed, clock, log)
+    tree = FlatTree.create_executor(root, executor)
+    nodes = list(root.iterate())
+    ticks = []
+    for tick in range(TICKS):
+        clock[0] = tick
+        tree.tick()
+        ticks.append((root.status, [(node.name, node.status) for node in nodes], log[:]))
+        log.clear()
+    return ticks
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_flat_tree_ticks_like_py_trees(seed):
+    expected = run("py_trees", seed)
+    ticks = run("flat", seed)
+    for tick, (flat, reference) in enumerate(zip(ticks, expected)):
+        assert flat == reference, f"tick {tick}"
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        FlatTree.create_executor(pt.behaviours.Success("leaf"), "unknown")
@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+import Codec
+import Benchmarks
+
+JSON_CODECS = [name for name in ("json", "ujson", "orjson") if name in Codec.CODECS]
+
+
+def sensor_frame(x):
+    '''
+    Output: 'sensor' message with the agent at position x
+    '''
+    frame = Benchmarks.make_sensor_frame()
+    frame["Content"][1]["position"]["x"] = x
+    return frame
+
+
+def make_agent(codec):
+    '''
+    Output: agent in mailbox mode that records the type of the messages it applies, and the position of the
+            sensor frames
+    '''
+    agent = Benchmarks.make_agent(runtime={"sensor_mailbox": True, "codec": codec, "log_level": "OFF"})
+    applied = []
+    apply_message = agent.apply_message
+
+    def record(msg_dict, received=None):
+        if msg_dict["Type"] == "sensor":
+            applied.append(("sensor", msg_dict["Content"][1]["position"]["x"]))
+        else:
+            applied.append((msg_dict["Type"], msg_dict["Content"]))
+        apply_message(msg_dict, received)
+
+    agent.apply_message = record
+    return agent, applied
+
+
+@pytest.mark.parametrize("codec", list(Codec.CODECS))
+def test_burst_is_coalesced(codec):
+    async def burst():
+        agent, applied = make_agent(codec)
+        for x in range(10):
+            agent.post_incoming_message(agent.codec.encode(sensor_frame(float(x))))
+        await asyncio.sleep(0)
+        return agent, applied
+
+    agent, applied = asyncio.run(burst())
+    # Only the newest frame of the burst is applied
+    assert applied == [("sensor", 9.0)]
+    assert agent.i_state.position.x == 9.0
+    assert agent.sensor_frames_received == 10 and agent.sensor_frames_applied == 1
+    assert agent.sensor_frames_dropped == 9 and agent.sensor_frames_coalesced == 1
+
+
+@pytest.mark.parametrize("codec", list(Codec.CODECS))
+def test_control_messages_keep_their_order(codec):
+    async def messages():
+        agent, applied = make_agent(codec)
+        encode = agent.codec.encode
+        agent.post_incoming_message(encode(sensor_frame(1.0)))
+        agent.post_incoming_message(encode(sensor_frame(2.0)))
+        agent.post_incoming_message(encode({"Type": "sim_control", "Content": "on_hold"}))
+        agent.post_incoming_message(encode(sensor_frame(3.0)))
+        agent.post_incoming_message(encode({"Type": "sim_control", "Content": "start"}))
+        await asyncio.sleep(0)
+        return applied
+
+    # The frame received before a control message is applied before it, the stale one is dropped
+    assert asyncio.run(messages()) == [("sensor", 2.0), ("sim_control", "on_hold"), ("sensor", 3.0),
+                                       ("sim_control", "start")]
+
+
+@pytest.mark.parametrize("codec", JSON_CODECS)
+def test_binary_frames(codec):
+    async def messages():
+        agent, applied = make_agent(codec)
+        agent.post_incoming_message(agent.codec.encode(sensor_frame(1.0)).encode())
+        agent.post_incoming_message(b'{"Type": "sim_control", "Content": "start"}')
+        # Not a message: dropped, without losing the connection
+        agent.post_incoming_message(b'\xff\xfe')
+        await asyncio.sleep(0)
+        return agent, applied
+
+    agent, applied = asyncio.run(messages())
+    assert applied == [("sensor", 1.0), ("sim_control", "start")]
+    assert agent.simulation_state == agent.RUNNING
+
+
+@pytest.mark.parametrize("codec", JSON_CODECS)
+def test_peek_str_and_bytes(codec):
+    codec = Codec.get_codec(codec)
+    for data in ('{"Type": "sensor", "Content": []}', b'{"Type": "sensor", "Content": []}'):
+        assert codec.peek(data) == ("sensor", None)
+    # "Type" is not at the beginning: the message is decoded
+    msg_type, msg_dict = codec.peek(b'{"Content": "connection_ready", "Type": "sim_control"}')
+    assert msg_type == "sim_control" and msg_dict["Content"] == "connection_ready"
@@ -0,0 +1,71 @@
+import pytest
+import Codec
+import Outbound
+import Simulator
+
+
+def pose_after(actions, duration=1.0):
+    '''
+    Output: pose of an agent in the simulated world after 'duration' seconds, sending the timed 'actions': list
+            of (time, action), in order
+    '''
+    world = Simulator.World({"physics": {"spawn_jitter": 0.0}})
+    body = world.add_body({"name": "agent", "ray_perception_sensor_param": [1, 90, 0.5, 10]})
+    for time, action in actions:
+        world.step(time - world.time)
+        world.apply_action(body, action)
+    world.step(duration - world.time)
+    return round(body.x, 6), round(body.z, 6), round(body.yaw, 6), body.moving, body.turning
+
+
+@pytest.mark.parametrize("action", sorted(Outbound.CHANNELS))
+def test_step_actions_match_the_simulator(action):
+    # An action that is not a step sets a state: sending it again a moment later changes nothing, so the
+    # ActionBatcher can deduplicate it. A step action starts a new step
+    once = pose_after([(0.0, action)])
+    twice = pose_after([(0.0, action), (0.02, action)])
+    if action in Outbound.STEP_ACTIONS:
+        assert once != twice
+    else:
+        assert once == twice
+
+
+def make_batcher(refresh=1.0):
+    clock = [0.0]
+    return Outbound.ActionBatcher(Codec.get_codec(), lambda: clock[0], refresh), clock
+
+
+@pytest.mark.parametrize("action", ["W", "S", "mf", "stop", "tr", "nt"])
+def test_state_actions_are_deduplicated(action):
+    batcher, clock = make_batcher()
+    batcher.add(action)
+    assert batcher.take()[1] == [action]
+    clock[0] = 0.5
+    batcher.add(action)
+    assert batcher.take() is None
+    assert batcher.actions_deduplicated == 1
+    # After 'refresh' seconds it is sent again
+    clock[0] = 2.0
+    batcher.add(action)
+    assert batcher.take()[1] == [action]
+
+
+@pytest.mark.parametrize("action", sorted(Outbound.STEP_ACTIONS))
+def test_step_actions_are_always_sent(action):
+    batcher, clock = make_batcher()
+    batcher.add(action)
+    batcher.add(action)
+    assert batcher.take()[1] == [action, action]
+    clock[0] = 0.1
+    batcher.add(action)
+    assert batcher.take()[1] == [action]
+    assert batcher.actions_coalesced == 0 and batcher.actions_deduplicated == 0
+
+
+def test_actions_of_a_channel_are_coalesced():
+    batcher, clock = make_batcher()
+    # "W" replaces "S", queued before it in the same tick; "D" does not replace nor is replaced by "tr"
+    for action in ("S", "tr", "W", "D"):
+        batcher.add(action)
+    assert batcher.take()[1] == ["tr", "W", "D"]
+    assert batcher.actions_coalesced == 1
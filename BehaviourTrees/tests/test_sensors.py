@@ -0,0 +1,34 @@
+import Sensors
+
+
+def perception(num_rays, hits):
+    '''
+    Output: perception of a frame where the rays in 'hits' {ray: distance} hit a wall
+    '''
+    return [[ray, 1 if ray in hits else 0,
+             {"name": "Wall_0", "tag": "Wall", "distance": hits[ray]} if ray in hits else None]
+            for ray in range(num_rays)]
+
+
+def test_sensor_rays_are_plain_lists():
+    sensor = Sensors.RayCastSensor([5, 90, 0.5, 10])
+    sensor.set_perception(perception(11, {3: 2.5}))
+    hit, distance, object_info, angle = sensor.sensor_rays
+    assert all(type(value) is bool for value in hit)
+    assert all(type(value) is float for value in distance + angle)
+    assert hit[3] and not hit[4]
+    assert distance[3] == 2.5 and distance[4] == -1
+    assert object_info[3]["tag"] == "Wall" and object_info[4] is None
+    assert angle[0] == -90.0 and angle[5] == 0.0 and angle[10] == 90.0
+
+
+def test_sensor_rays_built_once_per_frame():
+    sensor = Sensors.RayCastSensor([1, 90, 0.5, 10])
+    sensor.set_perception(perception(3, {0: 1.0}))
+    rays = sensor.sensor_rays
+    assert sensor.sensor_rays is rays
+    sensor.set_perception(perception(3, {2: 4.0}))
+    # A new view for the new frame, the one of the previous frame does not change
+    assert sensor.sensor_rays is not rays
+    assert rays[Sensors.RayCastSensor.HIT] == [True, False, False]
+    assert sensor.sensor_rays[Sensors.RayCastSensor.HIT] == [False, False, True]
@@ -0,0 +1,46 @@
+import pytest
+import Metrics
+import Tracing
+
+
+class FakeSensor:
+    def __init__(self, frame_seq, frame_time):
+        self.frame_seq = frame_seq
+        self.frame_time = frame_time
+
+
+def make_tracer():
+    clock = [0.0]
+    return Tracing.Tracer(lambda: clock[0], Metrics.Registry(False)), clock
+
+
+def test_detection_resolved_by_its_reaction():
+    tracer, clock = make_tracer()
+    tracer.detected("BN_DetectObstacle", FakeSensor(1, 0.0), "Avoid")
+    tracer.detected("BN_DetectAstro", FakeSensor(1, 0.0), "FollowAstronaut")
+    # Actions of other behaviours do not resolve the detections
+    clock[0] = 0.01
+    tracer.action_sent("nt")
+    tracer.action_sent("mf", "FollowAstronaut")
+    clock[0] = 0.05
+    tracer.action_sent("tr", "Avoid")
+    astro, obstacle = tracer.latencies["BN_DetectAstro"], tracer.latencies["BN_DetectObstacle"]
+    assert astro.count == 1 and astro.sum == pytest.approx(0.01)
+    assert obstacle.count == 1 and obstacle.sum == pytest.approx(0.05)
+    assert not tracer.pending
+
+
+def test_detection_without_reaction_resolved_by_any_action():
+    tracer, clock = make_tracer()
+    tracer.detected("BN_DetectFlower", FakeSensor(1, 0.0))
+    clock[0] = 0.02
+    tracer.action_sent("stop")
+    assert tracer.report()["BN_DetectFlower"]["count"] == 1
+    # Measured once till the detection is lost
+    tracer.detected("BN_DetectFlower", FakeSensor(2, 0.02))
+    tracer.action_sent("stop")
+    assert tracer.report()["BN_DetectFlower"]["count"] == 1
+    tracer.lost("BN_DetectFlower")
+    tracer.detected("BN_DetectFlower", FakeSensor(3, 0.04))
+    tracer.action_sent("stop")
+    assert tracer.report()["BN_DetectFlower"]["count"] == 2
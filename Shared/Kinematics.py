@@ -0,0 +1,204 @@
+import math
+import time
+
+
+class Vec3:
+    """
+    Vec3
+        3D vector updated in place. v["x"] is the same as v.x, like the dictionaries of the messages of Unity
+    """
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"Vec3({self.x}, {self.y}, {self.z})"
+
+    def set(self, other):
+        """
+        Copies the coordinates of 'other', a Vec3 or a dictionary with the keys 'x', 'y', 'z'
+        """
+        self.x = other["x"]
+        self.y = other["y"]
+        self.z = other["z"]
+
+    def copy(self):
+        return Vec3(self.x, self.y, self.z)
+
+    def norm(self):
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def dist2(self, other):
+        """
+        :return: squared distance to 'other' (compare it with the squared distance, no square root needed)
+        """
+        dx = self.x - other.x
+        dy = self.y - other.y
+        dz = self.z - other.z
+        return dx * dx + dy * dy + dz * dz
+
+
+def wrap_degrees(angle):
+    """
+    :return: 'angle' in the range [-180, 180)
+    """
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class Pose:
+    """
+    Pose
+        Position and rotation of the agent, from the internal state of the sensor frames. Applying a frame only
+        keeps it, with the time it was received, and the one before it: the fields are derived from both frames
+        the first time they are read after a frame (the pose, the dirty bits and the velocities apart), so a
+        frame nobody looks at costs nothing.
+            position: <Vec3> Position using world coordinates
+            rotation: <Vec3> Rotation y - Yaw, x - Pitch, z - Roll
+            frame_id: <int> Number of sensor frames applied, it changes every time the state is updated
+            frame_time: <float> Clock when the last frame was received
+            frame_period: <float> Seconds between frames (moving average)
+            dirty: <int> Fields changed by the last frame (POSITION | ROTATION bits, and the ones of the subclasses)
+            velocity: <Vec3> Velocity in units/s, estimated from the last two frames
+            angular_velocity: <Vec3> Angular velocity in degrees/s, estimated from the last two frames
+    """
+    # Bits of 'dirty' (the lower ones are for the subclasses)
+    POSITION = 4
+    ROTATION = 8
+
+    __slots__ = ("frame", "prev_frame", "frame_id", "frame_time", "prev_frame_time", "clock", "derived_id",
+                 "dirty_id", "velocities_id", "_position", "_rotation", "_velocity", "_angular_velocity",
+                 "_frame_period", "_dirty")
+
+    def __init__(self, frame, clock=time.monotonic):
+        """
+        :param frame: Internal state before the first frame
+        :param clock: Clock of the frame times
+        """
+        self.frame = frame
+        self.prev_frame = frame
+        self.frame_id = 0
+        self.frame_time = None
+        self.prev_frame_time = None
+        self.clock = clock
+        # frame_id the fields were derived for: position and rotation, dirty, and the velocities
+        self.derived_id = 0
+        self.dirty_id = 0
+        self.velocities_id = 0
+        self._position = Vec3()
+        self._rotation = Vec3()
+        self._position.set(frame["position"])
+        self._rotation.set(frame["rotation"])
+        self._velocity = Vec3()
+        self._angular_velocity = Vec3()
+        self._frame_period = 0.0
+        self._dirty = 0
+
+    def set_internal_state(self, i_state_dict, received=None):
+        """
+        Applies the internal state of a sensor frame
+        :param i_state_dict: Internal state sent by Unity (it is kept, not copied)
+        :param received: Clock when the frame was received (by default, now)
+        """
+        self.prev_frame = self.frame
+        self.prev_frame_time = self.frame_time
+        self.frame = i_state_dict
+        self.frame_time = self.clock() if received is None else received
+        self.frame_id += 1
+
+    def derive(self):
+        """
+        Derives the position and the rotation of the last frame
+        """
+        self.derived_id = self.frame_id
+        position, rotation, p, r = self.frame["position"], self.frame["rotation"], self._position, self._rotation
+        p.x, p.y, p.z = position["x"], position["y"], position["z"]
+        r.x, r.y, r.z = rotation["x"], rotation["y"], rotation["z"]
+
+    def derive_dirty(self):
+        """
+        Compares the last frame with the frame before it
+        :return: dirty bits of the fields of the pose that changed (the subclasses add theirs)
+        """
+        self.dirty_id = self.frame_id
+        dirty = 0
+        if self.frame["position"] != self.prev_frame["position"]:
+            dirty |= self.POSITION
+        if self.frame["rotation"] != self.prev_frame["rotation"]:
+            dirty |= self.ROTATION
+        self._dirty = dirty
+        return dirty
+
+    def derive_velocities(self):
+        """
+        Estimates the velocities from the last two frames, and updates the frame period
+        """
+        self.velocities_id = self.frame_id
+        # Time since the previous frame (0 -> the estimations are kept)
+        dt = self.frame_time - self.prev_frame_time if self.frame_id > 1 else 0.0
+        if dt <= 0:
+            return
+        self._frame_period = self._frame_period + 0.2 * (dt - self._frame_period) if self._frame_period else dt
+        position, prev_position = self.frame["position"], self.prev_frame["position"]
+        v = self._velocity
+        v.x = (position["x"] - prev_position["x"]) / dt
+        v.y = (position["y"] - prev_position["y"]) / dt
+        v.z = (position["z"] - prev_position["z"]) / dt
+        rotation, prev_rotation = self.frame["rotation"], self.prev_frame["rotation"]
+        w = self._angular_velocity
+        w.x = wrap_degrees(rotation["x"] - prev_rotation["x"]) / dt
+        w.y = wrap_degrees(rotation["y"] - prev_rotation["y"]) / dt
+        w.z = wrap_degrees(rotation["z"] - prev_rotation["z"]) / dt
+
+    @property
+    def position(self):
+        if self.derived_id != self.frame_id:
+            self.derive()
+        return self._position
+
+    @property
+    def rotation(self):
+        if self.derived_id != self.frame_id:
+            self.derive()
+        return self._rotation
+
+    @property
+    def velocity(self):
+        if self.velocities_id != self.frame_id:
+            self.derive_velocities()
+        return self._velocity
+
+    @property
+    def angular_velocity(self):
+        if self.velocities_id != self.frame_id:
+            self.derive_velocities()
+        return self._angular_velocity
+
+    @property
+    def frame_period(self):
+        if self.velocities_id != self.frame_id:
+            self.derive_velocities()
+        return self._frame_period
+
+    @property
+    def dirty(self):
+        if self.dirty_id != self.frame_id:
+            self.derive_dirty()
+        return self._dirty
+
+    def changed(self, fields):
+        """
+        :return: True if the last frame changed any of 'fields' (e.g. Pose.POSITION | Pose.ROTATION)
+        """
+        return bool(self.dirty & fields)
+
+    def yaw_delta(self, prev_yaw):
+        """
+        :return: degrees turned since the yaw was 'prev_yaw', in [-180, 180) (positive -> to the right)
+        """
+        return wrap_degrees(self.rotation.y - prev_yaw)